@@ -1,50 +1,20 @@
 import geopandas as gpd
 import pandas as pd
 import sys
-sys.path.append('/gerrymander-geoprocessing/areal_interpolation')
-import areal_interpolation as ai
+sys.path.append('Analysis')
+import assignment
+import census
+import plans
 import tabulate
 
-start_path = ''
-
-maps = {'reform': {'name': 'PGP Reform map',
-                   'path': start_path + 'Maps/Reform map/Districts map bethune-hill final.shp',
-                   'district_colname': 'DISTRICT',
-                   'show': True},
-        'enacted': {'name': 'Enacted map',
-                    'path': start_path + 'Maps/Enacted map/enacted.shp',
-                    'district_colname': 'ID',
-                    'show': False},
-        'dems':    {'name': 'VA House Dems map',
-                    'path': start_path + 'Maps/House Dems map/HB7001.shp',
-                    'district_colname': 'OBJECTID',
-                    'show': False},
-# =============================================================================
-#         'gop_bell1':     {'name': 'VA House GOP (Bell 1)',
-#                     'path': start_path + 'Maps/GOP map bell/HB7002_shapefile.shp',
-#                     'district_colname': 'OBJECTID',
-#                     'show': False},
-# =============================================================================
-        'gop_bell2':     {'name': 'VA House GOP (Bell)',
-                    'path': start_path + 'Maps/GOP map bell substitute/HB7002_ANS.shp',
-                    'district_colname': 'OBJECTID',
-                    'show': False}, 
-        'gop_jones':    {'name': 'VA House GOP (Jones)',
-                    'path': start_path + 'Maps/GOP map jones/HB7003.shp',
-                    'district_colname': 'OBJECTID',
-                    'show': False},
-        'new_VA':    {'name': 'New VA Majority',
-                    'path': start_path + 'Maps/New VA Majority/VA NVM Map Submission 20180926.shp',
-                    'district_colname': 'District',
-                    'show': False}
-        }
+# the plans of plans.maps, copied since each gets a 'df' entry below
+maps = {mapname: dict(plans.maps[mapname]) for mapname in plans.maps}
         
-common_colname = 'district_no'
+common_colname = plans.common_colname
 
 # identify relevant districts
-affected = [63, 69, 70, 71, 74, 77, 80, 89, 90, 92, 95]
-adjacent= [27, 55, 61, 62, 64, 66, 68, 72, 73, 75, 76, 78, 79, 81, 83, 85, 91, 93, 94, 96, 97, 100]
-bh = [str(i) for i in affected + adjacent]
+affected = plans.affected
+adjacent = plans.adjacent
 
 affected_label = 'Ruled unconstitutional as enacted'
 adjacent_label = 'Adjacent to a district ruled unconstitutional'
@@ -55,36 +25,34 @@ census_blocks = '/mapping/VA/2010 Census/Census Blocks with Population/tabblock2
 
 P10_table = '/mapping/VA/2010 Census/P10 Race for 18+ Population by Block/nhgis0003_ds172_2010_block.csv'
 
-blocks = gpd.read_file(census_blocks)
+# only the blocks around the plans' districts, with only the columns we use
+blocks = census.read_blocks(census_blocks, [plans.load_plan(maps[mapname]['path'], maps[mapname]['district_colname'])
+                                            for mapname in maps])
 
-race = pd.read_csv(P10_table)[1:]
+# BVAP and VAP by block, streamed from the NHGIS table
+race = census.read_block_race(P10_table)
 
-# column codes
-bvap = 'H74004'
-vap = 'H74001'
+blocks['GISJOIN'] = census.gisjoin(blocks)
 
-blocks['GISJOIN'] = 'G' + blocks['STATEFP10'] + blocks['COUNTYFP10'].apply(lambda x: x.zfill(4)) + blocks['TRACTCE10'].apply(lambda x: x.zfill(7)) + blocks['BLOCKCE'].apply(lambda x: x.zfill(4))
+blocks_w_race = census.join_block_race(blocks, race)
 
-blocks_w_race = blocks.merge(race.loc[:, ['GISJOIN', bvap, vap]], on='GISJOIN')
-blocks_w_race = blocks_w_race.rename(columns={bvap: 'BVAP', vap: 'VAP'})
-blocks_w_race = blocks_w_race.astype({'BVAP': int, 'VAP': int})
+# index the blocks once; each plan then assigns every block to the district
+# containing most of its area
+block_index = assignment.AssignmentIndex(blocks_w_race)
+block_values = blocks_w_race[['BVAP', 'VAP']].values
 
 for mapname in maps:
-    df = gpd.read_file(maps[mapname]['path'])
+    df = plans.load_plan(maps[mapname]['path'], maps[mapname]['district_colname'])
     
-    df = df.rename(columns={maps[mapname]['district_colname']: common_colname})
-        
-    df[common_colname] = df[common_colname].astype(str)
-    df = df[df[common_colname].isin(bh)]
-    
-    df = ai.aggregate(blocks_w_race, df, source_columns=['BVAP', 'VAP'], method='greatest_area')[1]
+    block_district = block_index.assign(df)
+    df[['BVAP', 'VAP']] = assignment.tally(block_district, block_values, len(df)).astype(int)
 
     df['prop_BVAP_' + mapname] = df['BVAP'] / df['VAP']
     df = df.rename(columns={'BVAP': 'BVAP_' + mapname,
                             'VAP': 'VAP_' + mapname})
 
-    df.loc[df[common_colname].isin([str(i) for i in affected]), 'status'] = affected_label
-    df.loc[df[common_colname].isin([str(i) for i in adjacent]), 'status'] = adjacent_label
+    df.loc[df[common_colname].isin(affected), 'status'] = affected_label
+    df.loc[df[common_colname].isin(adjacent), 'status'] = adjacent_label
 
     maps[mapname]['df'] = df
 
@@ -95,7 +63,6 @@ for mapname in keys[1:]:
     df = df.merge(maps[mapname]['df'][[common_colname] + [i + '_' + mapname for i in ['BVAP', 'VAP', 'prop_BVAP']]],
                       on=common_colname)
 
-df[common_colname] = df[common_colname].astype(int)
 sorted = df.sort_values(by=['status', common_colname], ascending=[False, True])
 sorted
 
@@ -0,0 +1,195 @@
+"""
+boundary_index: Shared-boundary graph of the building-block units (precincts
+or census blocks) that districts are assembled from.
+
+The index stores, for n units, an n x n sparse matrix of the boundary length
+each pair of units shares and the length of each unit's boundary that is not
+shared with any other unit (the state line, coastline, or edge of the study
+region). District perimeters and areas then follow from sums over the units
+assigned to each district, without any polygon unions.
+
+Building the index is a one-time step per unit geography; run this module as
+a script to build and save one:
+
+    python boundary_index.py <units shapefile> [<output .npz>]
+
+"""
+
+import hashlib
+import os
+import sys
+import geopandas as gpd
+import numpy as np
+import scipy.sparse as sp
+import shapely
+
+
+def build_boundary_index(units):
+    """
+    Return (shared, exterior, areas) for the geometries in units.
+
+    Keyword arguments:
+        units -- GeoSeries or GeoDataFrame of unit geometries
+
+    shared is a symmetric scipy.sparse CSR matrix whose (i, j) entry is the
+    length of boundary shared by units i and j (rook adjacency: units that
+    only meet at a point are not neighbours). exterior is the length of each
+    unit's boundary not shared with another unit, and areas the unit areas.
+    Lengths and areas are in the units of the geometries' CRS.
+    """
+
+    geoms = np.asarray(units.geometry if hasattr(units, 'geometry') else units)
+    n = len(geoms)
+
+    tree = shapely.STRtree(geoms)
+    i, j = tree.query(geoms, predicate='intersects')
+    keep = i < j
+    i, j = i[keep], j[keep]
+
+    boundaries = shapely.boundary(geoms)
+    lengths = shapely.length(shapely.intersection(boundaries[i], boundaries[j]))
+    keep = lengths > 0
+    i, j, lengths = i[keep], j[keep], lengths[keep]
+
+    shared = sp.coo_matrix((np.concatenate([lengths, lengths]),
+                            (np.concatenate([i, j]), np.concatenate([j, i]))),
+                           shape=(n, n)).tocsr()
+    exterior = np.maximum(shapely.length(geoms) - np.asarray(shared.sum(axis=1)).ravel(), 0)
+
+    return shared, exterior, shapely.area(geoms)
+
+
+def _units_key(units):
+    """Hash of the geometries (as WKB) and CRS of units, identifying their boundary index"""
+
+    geoms = np.asarray(units.geometry if hasattr(units, 'geometry') else units)
+    h = hashlib.sha1(str(getattr(units, 'crs', None)).encode())
+    for wkb in shapely.to_wkb(geoms):
+        h.update(hashlib.sha1(wkb or b'').digest())
+    return h.hexdigest()
+
+
+def save_boundary_index(path, index, key=''):
+    """Save (shared, exterior, areas) to an .npz file at path, with the _units_key of its units"""
+
+    shared, exterior, areas = index
+    shared = shared.tocsr()
+    np.savez(path, data=shared.data, indices=shared.indices, indptr=shared.indptr,
+             shape=shared.shape, exterior=exterior, areas=areas, key=key)
+
+
+def load_boundary_index(path):
+    """Load (shared, exterior, areas) saved by save_boundary_index"""
+
+    with np.load(path) as f:
+        shared = sp.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+        return shared, f['exterior'], f['areas']
+
+
+def boundary_index(units, path=None):
+    """
+    Return the boundary index of units, loading it from path if it was saved
+    there for the same geometries (by _units_key) and building and saving it
+    there otherwise.
+
+    Keyword arguments:
+        units -- GeoSeries or GeoDataFrame of unit geometries
+        path -- .npz file to load from or save to; not cached if None
+    """
+
+    if path is None:
+        return build_boundary_index(units)
+    key = _units_key(units)
+    if os.path.exists(path):
+        with np.load(path) as f:
+            saved = str(f['key']) if 'key' in f.files else None
+        if saved == key:
+            return load_boundary_index(path)
+    index = build_boundary_index(units)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    save_boundary_index(path, index, key)
+    return index
+
+
+def _plan_codes(assignment, n_districts):
+    """
+    Flatten an assignment of shape (plans, units) into bincount bins: plan p,
+    district d goes to p * (n_districts + 1) + d, and units outside every
+    district go to the spare bin n_districts of their plan.
+    """
+
+    codes = np.where(assignment < 0, n_districts, assignment)
+    return codes + (np.arange(len(codes)) * (n_districts + 1))[:, None]
+
+
+def _unflatten(sums, plans, n_districts, one_plan):
+    out = sums.reshape(plans, n_districts + 1)[:, :n_districts]
+    return out[0] if one_plan else out
+
+
+def discrete_area(index, assignment, n_districts=None):
+    """
+    Return district areas for one or many plans as sums of unit areas.
+
+    Keyword arguments:
+        index -- (shared, exterior, areas) boundary index of the units
+        assignment -- int array of district codes (0 to n_districts - 1, or
+            negative for units outside every district), of shape (units,) for
+            one plan or (plans, units) for many
+        n_districts -- number of districts; inferred from assignment if None
+
+    Returns an array of shape (n_districts,) or (plans, n_districts).
+    """
+
+    assignment = np.asarray(assignment)
+    codes = np.atleast_2d(assignment)
+    if n_districts is None:
+        n_districts = codes.max() + 1
+    bins = _plan_codes(codes, n_districts)
+    sums = np.bincount(bins.ravel(), weights=np.broadcast_to(index[2], bins.shape).ravel(),
+                       minlength=len(codes) * (n_districts + 1))
+    return _unflatten(sums, len(codes), n_districts, assignment.ndim == 1)
+
+
+def discrete_perimeter(index, assignment, n_districts=None):
+    """
+    Return district perimeters for one or many plans from the boundary index.
+
+    Keyword arguments:
+        index -- (shared, exterior, areas) boundary index of the units
+        assignment -- as for discrete_area
+        n_districts -- number of districts; inferred from assignment if None
+
+    A district's perimeter is the exterior boundary of its units plus the
+    boundary they share with units outside the district. With membership
+    matrix P and shared-length matrix S this is P'(S1 + e) - diag(P'SP);
+    the diagonal term is summed over the upper-triangle edge list of S,
+    which is cheaper than forming SP for every plan.
+    """
+
+    shared, exterior, areas = index
+    assignment = np.asarray(assignment)
+    codes = np.atleast_2d(assignment)
+    if n_districts is None:
+        n_districts = codes.max() + 1
+    bins = _plan_codes(codes, n_districts)
+    size = len(codes) * (n_districts + 1)
+
+    boundary = np.asarray(shared.sum(axis=1)).ravel() + exterior
+    total = np.bincount(bins.ravel(), weights=np.broadcast_to(boundary, bins.shape).ravel(),
+                        minlength=size)
+
+    edges = sp.triu(shared, k=1).tocoo()
+    a, b = bins[:, edges.row], bins[:, edges.col]
+    same = a == b
+    internal = np.bincount(a[same], weights=np.broadcast_to(edges.data, a.shape)[same],
+                           minlength=size)
+
+    return _unflatten(total - 2 * internal, len(codes), n_districts, assignment.ndim == 1)
+
+
+if __name__ == '__main__':
+    units_path = sys.argv[1]
+    out_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(units_path)[0] + '_boundaries.npz'
+    units = gpd.read_file(units_path)
+    save_boundary_index(out_path, build_boundary_index(units), _units_key(units))
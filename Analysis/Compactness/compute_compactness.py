@@ -1,69 +1,31 @@
 import sys
 sys.path.append('/Analysis/Compactness')
+sys.path.append('Analysis')
 import continuous_measures as cm
+import plans
 import geopandas as gpd
 import pandas as pd
 import tabulate
 
-start_path = ''
+# the plans of plans.maps, copied since each gets a 'df' entry below
+maps = {mapname: dict(plans.maps[mapname]) for mapname in plans.maps}
 
-maps = {'reform': {'name': 'PGP Reform map',
-                   'path': start_path + 'Maps/Reform map/Districts map bethune-hill final.shp',
-                   'district_colname': 'DISTRICT',
-                   'show': True},
-        'enacted': {'name': 'Enacted map',
-                    'path': start_path + 'Maps/Enacted map/enacted.shp',
-                    'district_colname': 'ID',
-                    'show': False},
-        'dems':    {'name': 'VA House Dems map',
-                    'path': start_path + 'Maps/House Dems map/HB7001.shp',
-                    'district_colname': 'OBJECTID',
-                    'show': False},
-# =============================================================================
-#         'gop_bell1':     {'name': 'VA House GOP (Bell 1)',
-#                     'path': start_path + 'Maps/GOP map bell/HB7002_shapefile.shp',
-#                     'district_colname': 'OBJECTID',
-#                     'show': False},
-# =============================================================================
-        'gop_bell2':     {'name': 'VA House GOP (Bell)',
-                    'path': start_path + 'Maps/GOP map bell substitute/HB7002_ANS.shp',
-                    'district_colname': 'OBJECTID',
-                    'show': False}, 
-        'gop_jones':    {'name': 'VA House GOP (Jones)',
-                    'path': start_path + 'Maps/GOP map jones/HB7003.shp',
-                    'district_colname': 'OBJECTID',
-                    'show': False},
-        'new_VA':    {'name': 'New VA Majority',
-                    'path': start_path + 'Maps/New VA Majority/VA NVM Map Submission 20180926.shp',
-                    'district_colname': 'District',
-                    'show': False}
-        }
+# columns of cm.compactness_table
+metrics = {'Reock (higher is better)': 'reock',
+           'Schwartzberg (lower is better)': 'schwartzberg',
+           'Convex hull ratio (higher is better)': 'c_hull_ratio',
+           'Polsby-Popper (higher is better)': 'polsby_popper'}
 
-metrics = {'Reock (higher is better)': cm.reock,
-           'Schwartzberg (lower is better)': cm.schwartzberg,
-           'Convex hull ratio (higher is better)': cm.c_hull_ratio,
-           'Polsby-Popper (higher is better)': cm.polsby_popper}
-
-# identify relevant districts
-affected = [63, 69, 70, 71, 74, 77, 80, 89, 90, 92, 95]
-adjacent= [27, 55, 61, 62, 64, 66, 68, 72, 73, 75, 76, 78, 79, 81, 83, 85, 91, 93, 94, 96, 97, 100]
-bh = [str(i) for i in affected + adjacent]
-
-common_colname = 'district_no'
+common_colname = plans.common_colname
 
 for mapname in maps:
-    df = gpd.read_file(maps[mapname]['path'])
-
-    df = df.rename(columns={maps[mapname]['district_colname']: common_colname})
-
-    df[common_colname] = df[common_colname].astype(str)
-    df = df[df[common_colname].isin(bh)]
+    df = plans.load_plan(maps[mapname]['path'], maps[mapname]['district_colname'])
 
+    # every metric from one pass over the district geometries
+    table = cm.compactness_table(df)
     for m in metrics:
-        # df[m + '_' + mapname] = metrics[m](df)
-        df[m] = metrics[m](df)
+        df[m] = table[metrics[m]]
     df['map'] = mapname
-    df[common_colname] = df[common_colname].astype(int)
     maps[mapname]['df'] = df
 
 all = pd.concat([maps[mapname]['df'] for mapname in maps], sort=False)
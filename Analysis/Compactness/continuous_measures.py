@@ -7,14 +7,24 @@ From Voting Rights Data Institute, 2018, https://github.com/gerrymandr/VRDI_DC
 """
 
 import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
 import random
 import math
+import weakref
+
+import boundary_index as bi
+import projection as proj
 
 def make_circle(points):
 	# Convert to float and randomize order
 	shuffled = [(float(x), float(y)) for (x, y) in points]
 	random.shuffle(shuffled)
-	
+	return _make_circle_shuffled(shuffled)
+
+# make_circle on points already in random order
+def _make_circle_shuffled(shuffled):
 	# Progressively add points to circle or recompute circle
 	c = None
 	for (i, p) in enumerate(shuffled):
@@ -99,6 +109,13 @@ def make_diameter(p0, p1):
 
 _MULTIPLICATIVE_EPSILON = 1 + 1e-14
 
+# initial number of points make_circles tests per set in each pass
+_SCAN_WINDOW = 32
+
+# fewest points for which make_circles' lockstep passes beat looping over
+# the sets with make_circle (about 2e4 whatever the number of sets)
+_BATCH_MIN_POINTS = 20000
+
 def is_in_circle(c, p):
 	return c is not None and math.hypot(p[0] - c[0], p[1] - c[1]) <= c[2] * _MULTIPLICATIVE_EPSILON
 
@@ -108,27 +125,287 @@ def _cross_product(x0, y0, x1, y1, x2, y2):
 	return (x1 - x0) * (y2 - y0) - (y1 - y0) * (x2 - x0)
 
     
+def _segment_best(seg, mask, key):
+    """
+    For each segment id in seg, find the position of the masked element with
+    the largest key (the first one on ties). Returns (segments, positions).
+    """
+
+    idx = np.flatnonzero(mask)
+    order = np.lexsort((idx, -key[idx], seg[idx]))
+    segs, first = np.unique(seg[idx][order], return_index=True)
+    return segs, idx[order][first]
+
+
+def _np_make_circles_two_points(pts, seg, p, q):
+    """
+    Batched _make_circle_two_points: pts is a flat array of points, seg gives
+    the problem each point belongs to and p, q the two boundary points of
+    each problem. Returns an (m, 3) array of circles.
+    """
+
+    cx = (p[:, 0] + q[:, 0]) / 2.0
+    cy = (p[:, 1] + q[:, 1]) / 2.0
+    circ = np.column_stack([cx, cy, np.maximum(np.hypot(cx - p[:, 0], cy - p[:, 1]),
+                                               np.hypot(cx - q[:, 0], cy - q[:, 1]))])
+
+    px, py = p[seg, 0], p[seg, 1]
+    qx, qy = q[seg, 0], q[seg, 1]
+    rx, ry = pts[:, 0], pts[:, 1]
+    c = circ[seg]
+    outside = np.hypot(rx - c[:, 0], ry - c[:, 1]) > c[:, 2] * _MULTIPLICATIVE_EPSILON
+    cross = _cross_product(px, py, qx, qy, rx, ry)
+
+    # circumcircles of (p, q, r) for every candidate r, as in make_circumcircle
+    ox = (np.minimum(np.minimum(px, qx), rx) + np.maximum(np.maximum(px, qx), rx)) / 2.0
+    oy = (np.minimum(np.minimum(py, qy), ry) + np.maximum(np.maximum(py, qy), ry)) / 2.0
+    ax, ay = px - ox, py - oy
+    bx, by = qx - ox, qy - oy
+    dx, dy = rx - ox, ry - oy
+    d = (ax * (by - dy) + bx * (dy - ay) + dx * (ay - by)) * 2.0
+    valid = outside & (d != 0.0)
+    d = np.where(valid, d, 1.0)
+    x = ox + ((ax * ax + ay * ay) * (by - dy) + (bx * bx + by * by) * (dy - ay) + (dx * dx + dy * dy) * (ay - by)) / d
+    y = oy + ((ax * ax + ay * ay) * (dx - bx) + (bx * bx + by * by) * (ax - dx) + (dx * dx + dy * dy) * (bx - ax)) / d
+    rad = np.maximum(np.maximum(np.hypot(x - px, y - py), np.hypot(x - qx, y - qy)),
+                     np.hypot(x - rx, y - ry))
+    centre_cross = _cross_product(px, py, qx, qy, x, y)
+
+    # Form a circumcircle and classify it on left or right side
+    m = len(p)
+    left = np.full((m, 3), np.nan)
+    right = np.full((m, 3), np.nan)
+    segs, k = _segment_best(seg, valid & (cross > 0.0), centre_cross)
+    left[segs] = np.column_stack([x[k], y[k], rad[k]])
+    segs, k = _segment_best(seg, valid & (cross < 0.0), -centre_cross)
+    right[segs] = np.column_stack([x[k], y[k], rad[k]])
+
+    # Select which circle to return
+    has_left = ~np.isnan(left[:, 2])
+    has_right = ~np.isnan(right[:, 2])
+    out = circ.copy()
+    out[has_left & ~has_right] = left[has_left & ~has_right]
+    out[has_right & ~has_left] = right[has_right & ~has_left]
+    both = has_left & has_right
+    out[both] = np.where((left[both, 2] <= right[both, 2])[:, None], left[both], right[both])
+    return out
+
+
+def hull_vertices(geo):
+    """
+    Return the convex hull vertices of every geometry in geo as flat arrays.
+
+    Keyword arguments:
+        geo -- GeoSeries or GeoDataFrame
+
+    Returns (coords, offsets), where coords is an (n, 2) float array and the
+    vertices of the i-th hull are coords[offsets[i]:offsets[i + 1]].
+    """
+
+    return _hull_coords(np.asarray(geo.convex_hull))
+
+
+def _hull_coords(hulls):
+    """(coords, offsets) of the vertices of an array of convex hulls"""
+
+    coords, index = shapely.get_coordinates(hulls, return_index=True)
+    offsets = np.searchsorted(index, np.arange(len(hulls) + 1))
+    return coords, offsets
+
+
+def make_circles(coords, offsets, seed=None):
+    """
+    Return minimum enclosing circles of many point sets as an (m, 3) array.
+
+    Keyword arguments:
+        coords -- (n, 2) array of points, as returned by hull_vertices
+        offsets -- boundaries of each point set within coords
+        seed -- seed or numpy Generator used to shuffle the points; results
+            are reproducible for a fixed seed
+
+    Each row is (x, y, r), matching make_circle on the same points (rows for
+    empty point sets are NaN). This runs the same incremental algorithm as
+    make_circle for every point set in lockstep: each pass finds, for all
+    unfinished sets at once, the next point outside their current circle and
+    updates those circles, so the number of passes is bounded by the largest
+    number of circle updates rather than by the number of sets or points.
+    Each pass has a fixed NumPy overhead, so this only pays off at ensemble
+    scale; below _BATCH_MIN_POINTS points in all (e.g. the 33 districts of
+    one plan) the sets are solved one at a time like make_circle instead.
+    """
+
+    rng = np.random.default_rng(seed)
+    offsets = np.asarray(offsets)
+    starts = offsets[:-1]
+    sizes = np.diff(offsets)
+    m = len(sizes)
+    owner = np.repeat(np.arange(m), sizes)
+
+    # Convert to float and randomize order within each point set
+    order = np.lexsort((rng.random(len(owner)), owner))
+    pts = np.asarray(coords, dtype=float)[order]
+
+    if len(pts) < _BATCH_MIN_POINTS:
+        circles = np.full((m, 3), np.nan)
+        for s in np.flatnonzero(sizes):
+            circles[s] = _make_circle_shuffled([tuple(p) for p in pts[starts[s]:starts[s] + sizes[s]].tolist()])
+        return circles
+
+    # level 1 scans all points from i, level 2 scans points[:i + 1] from j
+    # around the boundary point p; level 0 means the circle is final. Scans
+    # look at a window of points at a time, doubling while nothing is found,
+    # so a pass costs about as much as the sequential loop would.
+    circles = np.full((m, 3), np.nan)
+    level = np.where(sizes > 0, 1, 0)
+    circles[level == 1, :2] = pts[starts[level == 1]]
+    circles[level == 1, 2] = 0.0
+    i = np.ones(m, dtype=int)
+    j = np.zeros(m, dtype=int)
+    p = np.zeros((m, 2))
+    width = np.full(m, _SCAN_WINDOW)
+
+    while (level > 0).any():
+        live = np.flatnonzero(level > 0)
+        scan_from = np.where(level == 1, i, j)
+        scan_to = np.where(level == 1, sizes, i + 1)
+        window_end = np.minimum(scan_to, scan_from + width)
+        lengths = window_end[live] - scan_from[live]
+        seg = np.repeat(np.arange(len(live)), lengths)
+        k = (np.repeat(starts[live] + scan_from[live], lengths) + np.arange(len(seg))
+             - np.repeat(np.cumsum(lengths) - lengths, lengths))
+        owner_k = live[seg]
+        c = circles[owner_k]
+        outside = np.hypot(pts[k, 0] - c[:, 0], pts[k, 1] - c[:, 1]) > c[:, 2] * _MULTIPLICATIVE_EPSILON
+        hit_sets, first = np.unique(owner_k[outside], return_index=True)
+        found = np.zeros(m, dtype=bool)
+        found[hit_sets] = True
+        hit = np.zeros(m, dtype=int)
+        hit[hit_sets] = k[outside][first] - starts[hit_sets]
+
+        partial = (level > 0) & ~found & (window_end < scan_to)
+        done = (level == 1) & ~found & ~partial
+        restart = (level == 1) & found
+        resume = (level == 2) & ~found & ~partial
+        grow = (level == 2) & found
+
+        i[partial & (level == 1)] = window_end[partial & (level == 1)]
+        j[partial & (level == 2)] = window_end[partial & (level == 2)]
+        width[partial] *= 2
+        width[found] = _SCAN_WINDOW
+
+        level[done] = 0
+
+        # One boundary point known
+        i[restart] = hit[restart]
+        p[restart] = pts[starts[restart] + hit[restart]]
+        circles[restart, :2] = p[restart]
+        circles[restart, 2] = 0.0
+        j[restart] = 0
+        level[restart] = 2
+
+        i[resume] += 1
+        level[resume] = 1
+
+        # Two boundary points known; only growing sets have a hit to index,
+        # and starts + hit can run past pts for a trailing empty set
+        q = np.zeros((m, 2))
+        q[grow] = pts[starts[grow] + hit[grow]]
+        diameter = grow & (circles[:, 2] == 0.0)
+        cx = (p[diameter, 0] + q[diameter, 0]) / 2.0
+        cy = (p[diameter, 1] + q[diameter, 1]) / 2.0
+        circles[diameter] = np.column_stack([cx, cy, np.maximum(
+                np.hypot(cx - p[diameter, 0], cy - p[diameter, 1]),
+                np.hypot(cx - q[diameter, 0], cy - q[diameter, 1]))])
+
+        two = np.flatnonzero(grow & ~diameter)
+        if len(two):
+            lengths = hit[two] + 1
+            seg = np.repeat(np.arange(len(two)), lengths)
+            flat = starts[two][seg] + np.arange(len(seg)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            circles[two] = _np_make_circles_two_points(pts[flat], seg, p[two], q[two])
+
+        j[grow] = hit[grow] + 1
+
+    return circles
+
+
+def minimum_bounding_circles(geo, seed=None):
+    """
+    Return minimum bounding circles of geometries in geo as an (n, 3) array
+    of (x, y, r).
+
+    Keyword arguments:
+        geo -- GeoSeries or GeoDataFrame
+        seed -- seed for the point shuffle (see make_circles)
+    """
+
+    return make_circles(*hull_vertices(geo), seed=seed)
+
+    
+def _cell_assignment(geo, geo_cell):
+    """
+    Assign each cell to the geometry of geo containing its representative
+    point; returns int positions into geo, -1 for cells outside every one.
+    """
+
+    points = shapely.point_on_surface(np.asarray(geo_cell.geometry))
+    cell, district = shapely.STRtree(np.asarray(geo.geometry)).query(points, predicate='within')
+    assignment = np.full(len(points), -1)
+    assignment[cell] = district
+    return assignment
+
+def _cell_index(geo_cell):
+    """Boundary index of geo_cell, built once per GeoSeries/GeoDataFrame"""
+
+    key = id(geo_cell)
+    if key not in _cell_indexes or _cell_indexes[key][0]() is not geo_cell:
+        _cell_indexes[key] = (weakref.ref(geo_cell), bi.build_boundary_index(geo_cell))
+        # drop the index as soon as geo_cell is collected
+        weakref.finalize(geo_cell, _cell_indexes.pop, key, None)
+    return _cell_indexes[key][1]
+
+_cell_indexes = {}
+
 def _discrete_perimeter(geo, geo_cell):
-    """Not implemented"""
+    """
+    Returns perimeters of geo measured along the boundaries of the cells
+    assigned to each geometry
+    """
     
-    return None
+    index = _cell_index(geo_cell)
+    return pd.Series(bi.discrete_perimeter(index, _cell_assignment(geo, geo_cell), len(geo)),
+                     index=geo.index)
 
 def _continuous_perimeter(geo):
     """returns geo.length"""
     
     return geo.length
 
+def _measured(geo, crs):
+    """geo in the measurement CRS crs (see projection); geo itself if crs is None"""
+
+    return geo if crs is None else proj.projected(geo, crs)
+
+def _geodesic(geo, geo_cell, i):
+    """Geodesic area (i = 0) or perimeter (i = 1) of geo as a Series"""
+
+    if geo_cell is not None:
+        raise ValueError("discrete measures are planar; use a projected crs instead of 'geodesic'")
+    return pd.Series(proj.geodesic_area_perimeter(geo)[i], index=geo.index)
+
 def _discrete_area(geo, geo_cell):
-    """Not implemented"""
+    """Returns areas of geo as sums of areas of the cells assigned to each geometry"""
     
-    return None
+    index = _cell_index(geo_cell)
+    return pd.Series(bi.discrete_area(index, _cell_assignment(geo, geo_cell), len(geo)),
+                     index=geo.index)
 
 def _continuous_area(geo):
     """returns geo.area"""
     
     return geo.area
 
-def perimeter(geo, geo_cell = None):
+def perimeter(geo, geo_cell = None, crs = None):
     """
     Return perimeters of geometries in GeoSeries as Series of floats.
     
@@ -136,30 +413,31 @@ def perimeter(geo, geo_cell = None):
         geo -- GeoSeries or GeoDataFrame
         geo_cell -- GeoSeries or GeoDataFrame representing units used to build
             geo (the "container"); does not have to nest cleanly
+        crs -- measurement CRS: None to measure in geo's own CRS, 'geodesic'
+            for lengths on the ellipsoid, or a projection (see
+            projection.measurement_crs) to reproject geo and geo_cell to
         
     This function calculates continuous or discrete perimeter. 
     
     Continuous (Euclidean) perimeter is calculated if only geo argument is 
-    provided. Currently this function just returns GeoSeries.length. 
-    Future improvements could include:
-        
-        * Checking for lat-long coordinate system and performing geodetic
-        measurement
-        * Determining appropriate local CRS (most likely a State Plane or UTM
-        zone) and performing calculation in that CRS.
+    provided: GeoSeries.length in the measurement CRS.
         
-    NOT YET OPERATIONALIZED: Discrete perimeter is calculated if a second
-    geographic argument is provided that represents the "cells" or "building 
-    blocks" of the first, larger geography.
+    Discrete perimeter is calculated if a second geographic argument is
+    provided that represents the "cells" or "building blocks" of the first,
+    larger geography. Each cell is assigned to the geometry containing its
+    representative point, and the perimeter is the length of cell boundary
+    not shared with another cell of the same geometry (see boundary_index).
     """
 
-    if geo_cell == None:
+    if crs == 'geodesic':
+        return _geodesic(geo, geo_cell, 1)
+    if geo_cell is None:
         # Continuous perimeter
-        return _continuous_perimeter(geo)
+        return _continuous_perimeter(_measured(geo, crs))
     else:
-        return _discrete_perimeter(geo, geo_cell)
+        return _discrete_perimeter(_measured(geo, crs), _measured(geo_cell, crs))
 
-def area(geo, geo_cell = None, convex_hull = False):
+def area(geo, geo_cell = None, convex_hull = False, crs = None):
     """
     Return areas of geometries in GeoSeries as Series of floats.
     
@@ -168,33 +446,33 @@ def area(geo, geo_cell = None, convex_hull = False):
         geo_cell -- GeoSeries or GeoDataFrame representing units used to build
             geo (the "container"); does not have to nest cleanly
         convex_hull -- Calculate area of convex hull of geo
+        crs -- measurement CRS, as for perimeter; convex hulls are always
+            measured in a projection ('equal_area' for 'geodesic')
         
     This function calculates continuous or area. 
     
     Continuous (Euclidean) area is calculated if only geo argument is 
-    provided. Currently this function just returns GeoSeries.area. 
-    Future improvements could include:
-        
-        * Checking for lat-long coordinate system and performing geodetic
-        measurement
-        * Determining appropriate local CRS (most likely a State Plane or UTM
-        zone) and performing calculation in that CRS.
+    provided: GeoSeries.area in the measurement CRS.
         
-    NOT YET OPERATIONALIZED: Discrete area is calculated if a second
-    geographic argument is provided that represents the "cells" or "building 
-    blocks" of the first, larger geography.
+    Discrete area is calculated if a second geographic argument is provided
+    that represents the "cells" or "building blocks" of the first, larger
+    geography: the sum of the areas of the cells assigned to each geometry.
     """
 
-    if geo_cell == None:
+    if crs == 'geodesic':
+        if convex_hull:
+            return _continuous_area(_measured(geo, 'equal_area').convex_hull)
+        return _geodesic(geo, geo_cell, 0)
+    if geo_cell is None:
         # Continuous area
         if convex_hull:
-            return _continuous_area(geo.convex_hull)
+            return _continuous_area(_measured(geo, crs).convex_hull)
         else:        
-            return _continuous_area(geo)
+            return _continuous_area(_measured(geo, crs))
     else:
-        return _discrete_area(geo)
+        return _discrete_area(_measured(geo, crs), _measured(geo_cell, crs))
     
-def polsby_popper(geo, geo_cell = None):
+def polsby_popper(geo, geo_cell = None, crs = None):
     """
     Returns Polsby-Popper (1991) compactness of geo as float
     
@@ -202,11 +480,12 @@ def polsby_popper(geo, geo_cell = None):
         geo -- GeoSeries or GeoDataFrame
         geo_cell -- GeoSeries or GeoDataFrame representing units used to build
             geo (the "container"); does not have to nest cleanly
+        crs -- measurement CRS (see perimeter)
     """
     
-    return 4 * math.pi * area(geo, geo_cell) / (perimeter(geo, geo_cell) ** 2)
+    return 4 * math.pi * area(geo, geo_cell, crs=crs) / (perimeter(geo, geo_cell, crs=crs) ** 2)
 
-def schwartzberg(geo, geo_cell = None):
+def schwartzberg(geo, geo_cell = None, crs = None):
     """
     Returns Schwartzberg (1965) compactness of geo as float
     
@@ -214,22 +493,118 @@ def schwartzberg(geo, geo_cell = None):
         geo -- GeoSeries or GeoDataFrame
         geo_cell -- GeoSeries or GeoDataFrame representing units used to build
             geo (the "container"); does not have to nest cleanly
+        crs -- measurement CRS (see perimeter)
     """
 
-    return polsby_popper(geo, geo_cell) ** -0.5
+    return polsby_popper(geo, geo_cell, crs) ** -0.5
 
-def c_hull_ratio(geo):
+def c_hull_ratio(geo, crs = None):
     
+    geo = _measured(geo, 'equal_area' if crs == 'geodesic' else crs)
     return area(geo) / area(geo, convex_hull = True)
 
-def reock(geo):
+def reock(geo, seed=None, crs=None):
     """
     Returns Reock (1961) compactness of geo as float
     
     Keyword arguments:
         geo -- GeoSeries or GeoDataFrame
+        seed -- seed for the shuffle in the bounding circle solver
+        crs -- measurement CRS (see perimeter); circles are always found in
+            a projection ('equal_area' for 'geodesic')
     """
     
-    mbc_area = geo.convex_hull.apply(lambda x: math.pi * make_circle(list(x.exterior.coords))[2] ** 2)
+    geo = _measured(geo, 'equal_area' if crs == 'geodesic' else crs)
+    mbc_area = math.pi * minimum_bounding_circles(geo, seed=seed)[:, 2] ** 2
     return geo.area / mbc_area
 
+
+def _length_width(hulls):
+    """
+    Width over length of the minimum-area bounding rectangle of each hull
+    (NaN where the rectangle degenerates to a line or point).
+    """
+
+    rectangles = shapely.oriented_envelope(hulls)
+    out = np.full(len(hulls), np.nan)
+    polygon = shapely.get_type_id(rectangles) == 3
+    corners = shapely.get_coordinates(rectangles[polygon]).reshape(-1, 5, 2)
+    sides = np.hypot(*(corners[:, 1:3] - corners[:, 0:2]).transpose(2, 0, 1))
+    out[polygon] = sides.min(axis=1) / sides.max(axis=1)
+    return out
+
+
+def _polar_moment(geoms, centroids):
+    """
+    Polar second moment of area of each geometry about its centroid, summed
+    edge by edge over all rings with the shoelace formula.
+    """
+
+    parts, part_of = shapely.get_parts(shapely.orient_polygons(geoms), return_index=True)
+    rings, ring_of = shapely.get_rings(parts, return_index=True)
+    coords, vertex_of = shapely.get_coordinates(rings, return_index=True)
+    owner = part_of[ring_of[vertex_of]]
+    x = coords[:, 0] - centroids[owner, 0]
+    y = coords[:, 1] - centroids[owner, 1]
+
+    # consecutive vertices form an edge unless they lie on different
+    # (closed) rings, in which case the term is zeroed
+    x0, x1, y0, y1 = x[:-1], x[1:], y[:-1], y[1:]
+    moment = (x0 * y1 - x1 * y0) * (x0 * (x0 + x1) + x1 * x1 + y0 * (y0 + y1) + y1 * y1)
+    moment *= vertex_of[:-1] == vertex_of[1:]
+    return np.bincount(owner[:-1], weights=moment, minlength=len(geoms)) / 12
+
+
+def compactness_table(geo, geo_cell=None, reock=True, extras=False, seed=None, crs='equal_area'):
+    """
+    Return the compactness of every geometry in geo under several measures
+    at once, as a DataFrame indexed like geo.
+
+    Keyword arguments:
+        geo -- GeoSeries or GeoDataFrame
+        geo_cell -- cells for discrete area and perimeter in Polsby-Popper
+            and Schwartzberg (see perimeter); continuous if None
+        reock -- include Reock, the costliest measure
+        extras -- also include length_width (width over length of the
+            minimum bounding rectangle) and moment_of_inertia (area squared
+            over 2 pi times the polar moment of inertia; 1 for a circle)
+        seed -- seed for the shuffle in the bounding circle solver
+        crs -- measurement CRS (see perimeter); by default geo is
+            reprojected to a Virginia equal-area projection, so that plans
+            delivered in different CRSs are comparable; geometries without
+            a CRS are measured in their own units, as by the other measures
+
+    Columns are polsby_popper, schwartzberg, c_hull_ratio and reock, equal
+    to the functions of the same names with the same crs, plus the extras.
+    Areas, perimeters and convex hulls are computed once, for all geometries
+    together, and shared by the measures.
+    """
+
+    index = geo.index
+    if crs == 'equal_area' and geo.crs is None:
+        crs = None
+    if crs == 'geodesic':
+        if geo_cell is not None:
+            raise ValueError("discrete measures are planar; use a projected crs instead of 'geodesic'")
+        pp_area, pp_perimeter = proj.geodesic_area_perimeter(geo)
+    geo = _measured(geo, 'equal_area' if crs == 'geodesic' else crs)
+    geoms = np.asarray(geo.geometry if hasattr(geo, 'geometry') else geo)
+    hulls = shapely.convex_hull(geoms)
+    geo_area = shapely.area(geoms)
+    if geo_cell is not None:
+        geo_cell = _measured(geo_cell, crs)
+        pp_area, pp_perimeter = np.asarray(area(geo, geo_cell)), np.asarray(perimeter(geo, geo_cell))
+    elif crs != 'geodesic':
+        pp_area, pp_perimeter = geo_area, shapely.length(geoms)
+
+    table = pd.DataFrame(index=index)
+    table['polsby_popper'] = 4 * math.pi * pp_area / pp_perimeter ** 2
+    table['schwartzberg'] = table['polsby_popper'].values ** -0.5
+    table['c_hull_ratio'] = geo_area / shapely.area(hulls)
+    if reock:
+        table['reock'] = geo_area / (math.pi * make_circles(*_hull_coords(hulls), seed=seed)[:, 2] ** 2)
+    if extras:
+        table['length_width'] = _length_width(hulls)
+        centroids = shapely.get_coordinates(shapely.centroid(geoms))
+        table['moment_of_inertia'] = geo_area ** 2 / (2 * math.pi * _polar_moment(geoms, centroids))
+    return table
@@ -0,0 +1,177 @@
+"""
+incremental_measures: Compactness of a districting plan that is kept up to
+date as single units (precincts or census blocks) move between districts.
+
+District area and perimeter are sums over a unit boundary index (see
+boundary_index), so moving one unit only touches the boundaries of that unit.
+Convex hulls and minimum bounding circles are recomputed lazily, and only for
+districts where the moved unit could have changed them.
+
+"""
+
+import math
+import numpy as np
+import pandas as pd
+import shapely
+
+import boundary_index as bi
+import continuous_measures as cm
+
+# relative slack used to decide that a point lies strictly inside a circle
+_CIRCLE_SLACK = 1 - 1e-9
+
+
+class IncrementalCompactness:
+    """
+    Compactness scores of districts assembled from units, updated in place by
+    move().
+
+    Keyword arguments:
+        units -- GeoSeries or GeoDataFrame of unit geometries
+        assignment -- district label of each unit, in the order of units
+        index -- (shared, exterior, areas) as returned by
+            boundary_index.build_boundary_index; built from units if None
+        seed -- seed for the bounding circle solver
+
+    polsby_popper, schwartzberg, c_hull_ratio and reock mirror the functions
+    of the same name in continuous_measures and return Series indexed by
+    district label. Areas and perimeters are the sums over member units, so
+    they match the dissolved district geometries when the units tile cleanly.
+    """
+
+    def __init__(self, units, assignment, index=None, seed=None):
+        if index is None:
+            index = bi.build_boundary_index(units)
+        shared, self.exterior, self.unit_area = index
+        shared = shared.tocsr()
+        self._indptr, self._neighbours, self._lengths = shared.indptr, shared.indices, shared.data
+
+        self.labels, self.assignment = np.unique(np.asarray(assignment), return_inverse=True)
+        self._code = {label: code for code, label in enumerate(self.labels)}
+        n_districts = len(self.labels)
+
+        self._geoms = np.asarray(units.geometry if hasattr(units, 'geometry') else units)
+        shapely.prepare(self._geoms)
+        self._hull_coords, self._hull_offsets = cm.hull_vertices(units)
+        self._rng = np.random.default_rng(seed)
+
+        codes = self.assignment
+        rows = np.repeat(np.arange(len(codes)), np.diff(self._indptr))
+        cut = self._lengths * (codes[rows] != codes[self._neighbours])
+        self.area = np.bincount(codes, weights=self.unit_area, minlength=n_districts)
+        self.perimeter = (np.bincount(codes[rows], weights=cut, minlength=n_districts)
+                          + np.bincount(codes, weights=self.exterior, minlength=n_districts))
+
+        self._hulls = np.full(n_districts, None, dtype=object)
+        self._circles = np.full((n_districts, 3), np.nan)
+        self._hull_stale = np.ones(n_districts, dtype=bool)
+        self._circle_stale = np.ones(n_districts, dtype=bool)
+
+    def move(self, unit, district):
+        """
+        Move unit (a position in units) to the district labelled district.
+
+        Runs in time proportional to the number of neighbours of unit, plus
+        a containment test against the current hulls and circles of the two
+        districts involved.
+        """
+
+        a = self.assignment[unit]
+        b = self._code[district]
+        if a == b:
+            return
+
+        lo, hi = self._indptr[unit], self._indptr[unit + 1]
+        lengths = self._lengths[lo:hi]
+        owner = self.assignment[self._neighbours[lo:hi]]
+        with_a = lengths[owner == a].sum()
+        with_b = lengths[owner == b].sum()
+        with_other = lengths.sum() - with_a - with_b
+        ext = self.exterior[unit]
+
+        # boundary with A becomes a cut edge; boundary with B becomes internal
+        self.perimeter[a] += with_a - with_b - with_other - ext
+        self.perimeter[b] += with_a - with_b + with_other + ext
+        self.area[a] -= self.unit_area[unit]
+        self.area[b] += self.unit_area[unit]
+        self.assignment[unit] = b
+
+        self._invalidate_source(a, unit)
+        self._invalidate_target(b, unit)
+
+    def _unit_vertices(self, units):
+        starts = self._hull_offsets[units]
+        lengths = self._hull_offsets[units + 1] - starts
+        idx = (np.repeat(starts, lengths) + np.arange(lengths.sum())
+               - np.repeat(np.cumsum(lengths) - lengths, lengths))
+        return self._hull_coords[idx]
+
+    def _strictly_inside_circle(self, d, unit):
+        x, y, r = self._circles[d]
+        pts = self._unit_vertices(np.array([unit]))
+        return bool((np.hypot(pts[:, 0] - x, pts[:, 1] - y) < r * _CIRCLE_SLACK).all())
+
+    def _invalidate_source(self, d, unit):
+        # Removing a unit can only shrink the hull if it reaches the hull's
+        # boundary, and only shrink the circle if it reaches the circle.
+        if not self._hull_stale[d] and self._hulls[d].boundary.intersects(self._geoms[unit]):
+            self._hull_stale[d] = True
+        if not self._circle_stale[d] and not self._strictly_inside_circle(d, unit):
+            self._circle_stale[d] = True
+
+    def _invalidate_target(self, d, unit):
+        # Adding a unit that already lies inside the hull (or circle) leaves
+        # it unchanged.
+        if not self._hull_stale[d] and not self._hulls[d].covers(self._geoms[unit]):
+            self._hull_stale[d] = True
+        if not self._circle_stale[d]:
+            x, y, r = self._circles[d]
+            pts = self._unit_vertices(np.array([unit]))
+            if not (np.hypot(pts[:, 0] - x, pts[:, 1] - y) <= r * cm._MULTIPLICATIVE_EPSILON).all():
+                self._circle_stale[d] = True
+
+    def _refresh(self, d, circle=False):
+        if self._hull_stale[d]:
+            members = np.flatnonzero(self.assignment == d)
+            hull = shapely.convex_hull(shapely.multipoints(self._unit_vertices(members)))
+            shapely.prepare(hull)
+            self._hulls[d] = hull
+            self._hull_stale[d] = False
+        if circle and self._circle_stale[d]:
+            coords = shapely.get_coordinates(self._hulls[d])
+            self._circles[d] = cm.make_circles(coords, [0, len(coords)], seed=self._rng)[0]
+            self._circle_stale[d] = False
+
+    def hull_area(self):
+        """Return convex hull area of each district as a Series"""
+
+        for d in range(len(self.labels)):
+            self._refresh(d)
+        return pd.Series(shapely.area(self._hulls), index=self.labels)
+
+    def circle_area(self):
+        """Return minimum bounding circle area of each district as a Series"""
+
+        for d in range(len(self.labels)):
+            self._refresh(d, circle=True)
+        return pd.Series(math.pi * self._circles[:, 2] ** 2, index=self.labels)
+
+    def polsby_popper(self):
+        """Returns Polsby-Popper (1991) compactness of each district"""
+
+        return pd.Series(4 * math.pi * self.area / self.perimeter ** 2, index=self.labels)
+
+    def schwartzberg(self):
+        """Returns Schwartzberg (1965) compactness of each district"""
+
+        return self.polsby_popper() ** -0.5
+
+    def c_hull_ratio(self):
+        """Returns ratio of area to convex hull area of each district"""
+
+        return pd.Series(self.area, index=self.labels) / self.hull_area()
+
+    def reock(self):
+        """Returns Reock (1961) compactness of each district"""
+
+        return pd.Series(self.area, index=self.labels) / self.circle_area()
@@ -0,0 +1,117 @@
+"""
+projection: Measurement of plan geometries in a common coordinate system.
+
+The plan shapefiles do not share a projection (compare the .prj files of
+the enacted, HB7001, HB7002 and NVM maps), and several are in geographic
+coordinates, so lengths and areas taken in each file's own CRS are not
+comparable. project reprojects geometries to one measurement CRS:
+
+    'equal_area' -- Albers equal-area conic fitted to Virginia (standard
+        parallels 37N and 39N): areas are exact and lengths are within 0.02%
+        anywhere in the state (the default)
+    'state_plane' -- NAD83 Virginia South State Plane, EPSG:32147
+    any other value -- anything pyproj.CRS accepts
+
+A pyproj Transformer is built once per pair of CRSs and reused, and all
+coordinates of a geometry array go through it in a single call, so
+projecting the districts of a plan costs about as much as copying their
+coordinates. geodesic_area_perimeter measures on the GRS80 ellipsoid instead,
+without projecting.
+
+"""
+
+import functools
+import weakref
+import numpy as np
+import pyproj
+import shapely
+
+crs_aliases = {'equal_area': '+proj=aea +lat_0=36 +lon_0=-79 +lat_1=37 +lat_2=39 '
+                             '+x_0=0 +y_0=0 +datum=NAD83 +units=m +no_defs',
+               'state_plane': 'EPSG:32147'}
+
+
+@functools.lru_cache(maxsize=None)
+def measurement_crs(crs='equal_area'):
+    """Return the pyproj CRS named by crs (an alias above, or anything pyproj.CRS accepts)"""
+
+    return pyproj.CRS.from_user_input(crs_aliases.get(crs, crs))
+
+
+@functools.lru_cache(maxsize=None)
+def _transformer(source, target):
+    return pyproj.Transformer.from_crs(source, target, always_xy=True)
+
+
+def transformer(source, target):
+    """Return a cached always_xy Transformer from CRS source to CRS target"""
+
+    return _transformer(pyproj.CRS.from_user_input(source), pyproj.CRS.from_user_input(target))
+
+
+def project_array(geoms, source, target):
+    """Reproject an array of shapely geometries from source to target in one batch"""
+
+    return shapely.transform(geoms, transformer(source, target).transform, interleaved=False)
+
+
+def project(geo, crs='equal_area'):
+    """
+    Return geo reprojected to the measurement CRS crs, as a new GeoSeries or
+    GeoDataFrame; geo itself if it is already in that CRS.
+
+    Keyword arguments:
+        geo -- GeoSeries or GeoDataFrame with a CRS
+        crs -- measurement CRS (see measurement_crs)
+    """
+
+    if geo.crs is None:
+        raise ValueError('geometries have no CRS to reproject from')
+    target = measurement_crs(crs)
+    if geo.crs == target:
+        return geo
+    geoms = project_array(np.asarray(geo.geometry), geo.crs, target)
+    out = geo.copy()
+    if hasattr(geo, 'set_geometry'):
+        return out.set_geometry(geoms, crs=target)
+    return out.__class__(geoms, index=geo.index, crs=target)
+
+
+def projected(geo, crs='equal_area'):
+    """
+    project(geo, crs), remembered for as long as geo exists, for geometries
+    that are measured repeatedly (e.g. the cells of discrete measures)
+    """
+
+    key = (id(geo), crs)
+    if key not in _projected or _projected[key][0]() is not geo:
+        out = project(geo, crs)
+        if out is geo:
+            # already in crs; caching geo itself would keep it alive
+            return geo
+        _projected[key] = (weakref.ref(geo), out)
+        # drop the copy as soon as geo is collected
+        weakref.finalize(geo, _projected.pop, key, None)
+    return _projected[key][1]
+
+_projected = {}
+
+
+def geodesic_area_perimeter(geo):
+    """
+    Return (area, perimeter) of each geometry in geo on the GRS80 ellipsoid,
+    in square metres and metres, as float arrays.
+
+    Keyword arguments:
+        geo -- GeoSeries or GeoDataFrame with a CRS
+    """
+
+    if geo.crs is None:
+        raise ValueError('geometries have no CRS to measure from')
+    geoms = np.asarray(geo.geometry)
+    if not geo.crs.is_geographic:
+        geoms = project_array(geoms, geo.crs, 'EPSG:4269')
+    geod = pyproj.Geod(ellps='GRS80')
+    measures = np.array([geod.geometry_area_perimeter(g) if g is not None else (np.nan, np.nan)
+                         for g in geoms]).reshape(-1, 2)
+    return np.abs(measures[:, 0]), measures[:, 1]
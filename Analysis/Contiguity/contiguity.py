@@ -0,0 +1,294 @@
+"""
+contiguity: Contiguity and road-connectivity checks of plans built from
+units (precincts or census blocks).
+
+Step 8 of the process in the README requires every district to be
+contiguous, and step 6 that it be possible to drive to all parts of a
+district without leaving it. Both are properties of the unit assignment, so
+the geometry work is done once per unit geography:
+
+    ContiguityIndex -- the unit adjacency graph (rook or queen), stored as
+        a compressed CSR matrix; a district is contiguous if its units form
+        one connected component of the graph restricted to the district
+    RoadIndex -- a road network clipped to the units; a district is road
+        connected if every unit of it that has roads can be reached from
+        every other along roads inside the district
+
+Checking a plan, or a batch of plans of shape (plans, units), is then a
+connected-components pass over edge arrays and takes milliseconds.
+
+Run as a script to check a plan shapefile against the precincts:
+
+    python Analysis/Contiguity/contiguity.py <plan shapefile> <district column> [<roads shapefile>]
+
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import scipy.sparse.csgraph as csgraph
+import shapely
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Compactness'))
+import assignment as asg
+import boundary_index as bi
+import plans
+
+precincts_path = 'Maps/Affected and adjacent precincts with BVAP/BH_precincts_with_BVAP_VAP.shp'
+
+
+def build_adjacency(units, queen=False, tolerance=0):
+    """
+    Return the unit adjacency graph of units as a symmetric boolean CSR matrix.
+
+    Keyword arguments:
+        units -- GeoSeries or GeoDataFrame of unit geometries
+        queen -- if True, units meeting at a single point are neighbours;
+            otherwise they must share a stretch of boundary (rook)
+        tolerance -- for queen adjacency, units closer than this are also
+            neighbours, bridging slivers between unit boundaries; in the
+            units of the geometries' CRS
+    """
+
+    geoms = np.asarray(units.geometry if hasattr(units, 'geometry') else units)
+    n = len(geoms)
+    if queen:
+        tree = shapely.STRtree(geoms)
+        if tolerance > 0:
+            i, j = tree.query(geoms, predicate='dwithin', distance=tolerance)
+        else:
+            i, j = tree.query(geoms, predicate='intersects')
+        keep = i != j
+        i, j = i[keep], j[keep]
+    else:
+        shared = bi.build_boundary_index(geoms)[0].tocoo()
+        i, j = shared.row, shared.col
+    return sp.csr_matrix((np.ones(len(i), dtype=bool), (i, j)), shape=(n, n))
+
+
+def load_adjacency(path, queen=False, tolerance=0):
+    """
+    build_adjacency for the units in the vector file at path, cached as a
+    compressed .npz under Analysis/.cache until the file changes.
+    """
+
+    return plans.cached_matrix([path], lambda: build_adjacency(plans.read_file(path), queen, tolerance),
+                               'adjacency', queen, tolerance)
+
+
+def _components(rows, cols, vertices):
+    """Connected-component labels of the graph with the given edges, and their number"""
+
+    graph = sp.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(vertices, vertices))
+    n_components, labels = csgraph.connected_components(graph, directed=False)
+    return labels, n_components
+
+
+def _count_components(labels, n_components, codes, n_districts):
+    """
+    Number of components per district, given the component labels and
+    district codes of units; no component may span two districts.
+    """
+
+    inside = codes >= 0
+    district = np.full(n_components, -1)
+    district[labels[inside]] = codes[inside]
+    return np.bincount(district[district >= 0], minlength=n_districts)
+
+
+def _per_plan(count, assignment, n_districts):
+    """Apply count(plan, n_districts) to one plan or each row of (plans, units)"""
+
+    assignment = np.asarray(assignment)
+    codes = np.atleast_2d(assignment)
+    if n_districts is None:
+        n_districts = codes.max() + 1
+    counts = np.array([count(plan, n_districts) for plan in codes]).reshape(len(codes), n_districts)
+    return counts[0] if assignment.ndim == 1 else counts
+
+
+class ContiguityIndex:
+    """
+    Unit adjacency graph, reusable across plans.
+
+    Keyword arguments:
+        adjacency -- sparse (units x units) matrix, nonzero where units are
+            adjacent (from build_adjacency or load_adjacency)
+    """
+
+    def __init__(self, adjacency):
+        upper = sp.triu(sp.csr_matrix(adjacency), k=1).tocoo()
+        self.n = adjacency.shape[0]
+        self.rows, self.cols = upper.row, upper.col
+
+    def pieces(self, assignment, n_districts=None):
+        """
+        Return the number of connected pieces of each district.
+
+        Keyword arguments:
+            assignment -- int array of district codes (0 to n_districts - 1,
+                or negative for units outside every district), of shape
+                (units,) for one plan or (plans, units) for many
+            n_districts -- number of districts; inferred from assignment if None
+
+        Returns an int array of shape (n_districts,) or (plans, n_districts);
+        1 for a contiguous district and 0 for an empty one.
+        """
+
+        return _per_plan(self._pieces, assignment, n_districts)
+
+    def _pieces(self, plan, n_districts):
+        # the graph without the edges that cross district lines
+        edge = (plan[self.rows] == plan[self.cols]) & (plan[self.rows] >= 0)
+        labels, n_components = _components(self.rows[edge], self.cols[edge], self.n)
+        return _count_components(labels, n_components, plan, n_districts)
+
+    def contiguous(self, assignment, n_districts=None):
+        """Whether each district is contiguous; arguments and shape as for pieces"""
+
+        return self.pieces(assignment, n_districts) == 1
+
+    def detached(self, assignment, weights=None):
+        """
+        Return a boolean mask of the units of one plan that lie outside the
+        largest piece of their district, i.e. the units to move to make the
+        plan contiguous.
+
+        Keyword arguments:
+            assignment -- int array of district codes of shape (units,)
+            weights -- size of each unit (e.g. population) for choosing the
+                largest piece; unit counts if None
+        """
+
+        codes = np.asarray(assignment)
+        edge = (codes[self.rows] == codes[self.cols]) & (codes[self.rows] >= 0)
+        labels = _components(self.rows[edge], self.cols[edge], self.n)[0]
+        inside = codes >= 0
+        size = np.bincount(labels[inside], weights=None if weights is None else np.asarray(weights)[inside],
+                           minlength=self.n)
+
+        # the largest component of each district, ties to the lowest label
+        order = np.lexsort((np.arange(self.n), -size))
+        district = np.full(self.n, -1)
+        district[labels[inside]] = codes[inside]
+        order = order[district[order] >= 0]
+        main = order[np.unique(district[order], return_index=True)[1]]
+        return inside & ~np.isin(labels, main)
+
+
+class RoadIndex:
+    """
+    A road network clipped to a set of units, reusable across plans.
+
+    Keyword arguments:
+        units -- GeoSeries or GeoDataFrame of unit geometries
+        roads -- GeoSeries or GeoDataFrame of road lines, noded at junctions
+            (as in the Census TIGER road files); reprojected to the units' CRS
+        precision -- road ends closer than this are the same junction, in
+            the units of the units' CRS
+    """
+
+    def __init__(self, units, roads, precision=1e-7):
+        if getattr(roads, 'crs', None) is not None and units.crs is not None:
+            roads = roads.to_crs(units.crs)
+        geoms = np.asarray(units.geometry)
+        lines = np.asarray(roads.geometry)
+        self.n = len(geoms)
+
+        unit, road = shapely.STRtree(lines).query(geoms, predicate='intersects')
+        parts, part_of = shapely.get_parts(shapely.intersection(lines[road], geoms[unit]), return_index=True)
+        keep = shapely.get_type_id(parts) == 1
+        parts, self.unit = parts[keep], unit[part_of[keep]]
+
+        ends = shapely.get_coordinates(np.concatenate([shapely.get_point(parts, 0),
+                                                       shapely.get_point(parts, -1)]))
+        junction = np.unique(np.round(ends / precision), axis=0, return_inverse=True)[1].ravel()
+        self.ends = junction.reshape(2, -1)
+        self.n_junctions = junction.max() + 1 if len(junction) else 0
+        self.has_roads = np.bincount(self.unit, minlength=self.n) > 0
+
+    def groups(self, assignment, n_districts=None):
+        """
+        Return the number of groups of units in each district that roads
+        inside the district do not connect to each other.
+
+        Keyword arguments:
+            assignment -- as for ContiguityIndex.pieces
+            n_districts -- number of districts; inferred from assignment if None
+
+        Returns an int array of shape (n_districts,) or (plans, n_districts);
+        1 for a road-connected district and 0 for one without roads. Units
+        without any roads are left out (see unreached).
+        """
+
+        return _per_plan(self._groups, assignment, n_districts)
+
+    def _groups(self, plan, n_districts):
+        # vertices: units, then road pieces, then (junction, district) pairs,
+        # so that pieces only meet at junctions inside one district
+        m = len(self.unit)
+        piece = self.n + np.arange(m)
+        keys = self.ends.ravel() * (n_districts + 1) + np.tile(plan[self.unit], 2) + 1
+        junctions, node = np.unique(keys, return_inverse=True)
+        labels, n_components = _components(np.concatenate([self.unit, np.tile(piece, 2)]),
+                                           np.concatenate([piece, self.n + m + node.ravel()]),
+                                           self.n + m + len(junctions))
+        return _count_components(labels[:self.n], n_components, np.where(self.has_roads, plan, -1), n_districts)
+
+    def road_connected(self, assignment, n_districts=None):
+        """Whether each district is road connected; arguments and shape as for groups"""
+
+        return self.groups(assignment, n_districts) <= 1
+
+    def unreached(self, assignment, n_districts=None):
+        """Number of units without roads in each district; arguments and shape as for groups"""
+
+        return _per_plan(lambda plan, k: np.bincount(plan[(plan >= 0) & ~self.has_roads], minlength=k),
+                         assignment, n_districts)
+
+
+def validate(plan, units, adjacency, roads=None):
+    """
+    Return a data frame with one row per district of plan giving its number
+    of pieces and whether it is contiguous, plus, if roads is given, its
+    road-connected groups, units without roads and whether it is road
+    connected.
+
+    Keyword arguments:
+        plan -- GeoDataFrame of districts with a district_no column
+        units -- GeoDataFrame of units
+        adjacency -- unit adjacency matrix of units
+        roads -- GeoDataFrame of road lines, or a RoadIndex of units
+    """
+
+    codes = asg.AssignmentIndex(units).assign(plan)
+    k = len(plan)
+    df = pd.DataFrame({plans.common_colname: plan[plans.common_colname].values,
+                       'pieces': ContiguityIndex(adjacency).pieces(codes, k)})
+    df['contiguous'] = df['pieces'] == 1
+    if roads is not None:
+        if not isinstance(roads, RoadIndex):
+            roads = RoadIndex(units, roads)
+        df['road_groups'] = roads.groups(codes, k)
+        df['units_without_roads'] = roads.unreached(codes, k)
+        df['road_connected'] = df['road_groups'] <= 1
+    return df
+
+
+if __name__ == '__main__':
+    plan_path = sys.argv[1]
+    district_colname = sys.argv[2]
+    roads_path = sys.argv[3] if len(sys.argv) > 3 else None
+
+    plan = plans.load_plan(plan_path, district_colname)
+    units = plans.read_file(precincts_path)
+    roads = None if roads_path is None else plans.read_file(roads_path)
+    result = validate(plan, units, load_adjacency(precincts_path), roads)
+    print(result.to_string(index=False))
+    valid = result['contiguous'].all()
+    if 'road_connected' in result:
+        valid &= result['road_connected'].all()
+    sys.exit(0 if valid else 1)
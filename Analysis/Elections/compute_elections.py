@@ -1,8 +1,15 @@
 import geopandas as gpd
+import numpy as np
+import os
 import pandas as pd
 import sys
-sys.path.append('/Users/wtadler/Repos/gerrymander-geoprocessing/areal_interpolation')
-import areal_interpolation as ai
+sys.path.append('Analysis')
+sys.path.append('Analysis/Elections')
+sys.path.append('Analysis/Ensemble')
+import assignment
+import fairness
+import plans
+import quantiles
 import tabulate
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -11,68 +18,51 @@ sns.set()
 
 unconstitutional_only = False
 
-maps = {'reform': {'name': 'PGP Reform map',
-                   'path': 'Maps/Reform map/Districts map bethune-hill final.shp',
-                   'district_colname': 'DISTRICT',
-                   'show': True,
-                   'color': 'orange'},
-        'enacted': {'name': 'Enacted map',
-                    'path': 'Maps/Enacted map/enacted.shp',
-                    'district_colname': 'ID',
-                    'show': False,
-                    'color': 'violet'},
-        'dems':    {'name': 'VA House Dems map',
-                    'path': 'Maps/House Dems map/HB7001.shp',
-                    'district_colname': 'OBJECTID',
-                    'show': False,
-                    'color': 'blue'},
-        'gop':     {'name': 'VA House GOP Map', 
-                    'path': 'Maps/GOP map bell substitute/HB7002_ANS.shp',
-                    'district_colname': 'OBJECTID',
-                    'show': False,
-                    'color': 'red'},
-        'new_VA':  {'name': 'New VA Majority',
-                    'path': 'Maps/New VA Majority/VA NVM Map Submission 20180926.shp',
-                    'district_colname': 'District',
-                    'show': False,
-                    'color': 'green'}
-        }
-
-common_colname = 'district_no'
+# the plans of plans.maps compared here, with their figure colors; 'gop' is
+# the Bell substitute
+maps = {'reform': dict(plans.maps['reform'], color='orange'),
+        'enacted': dict(plans.maps['enacted'], color='violet'),
+        'dems': dict(plans.maps['dems'], color='blue'),
+        'gop': dict(plans.maps['gop_bell2'], name='VA House GOP Map', color='red'),
+        'new_VA': dict(plans.maps['new_VA'], color='green')}
+
+common_colname = plans.common_colname
 
 # identify relevant districts
-affected = [63, 69, 70, 71, 74, 77, 80, 89, 90, 92, 95]
-adjacent= [27, 55, 61, 62, 64, 66, 68, 72, 73, 75, 76, 78, 79, 81, 83, 85, 91, 93, 94, 96, 97, 100]
+affected = plans.affected
+adjacent = plans.adjacent
 
 if unconstitutional_only:
-    bh = [str(i) for i in affected]
+    bh = affected
 else:
-    bh = [str(i) for i in affected + adjacent]
+    bh = affected + adjacent
 
 affected_label = 'Ruled unconstitutional as enacted'
 adjacent_label = 'Adjacent to a district ruled unconstitutional'
 
 #%%
 # get census block geography with BVAP and VAP data
-precincts = 'Maps/Relevant precincts/BH_precincts_with_BVAP_VAP.shp'
-precincts = gpd.read_file(precincts)
+precincts_path = 'Maps/Relevant precincts/BH_precincts_with_BVAP_VAP.shp'
+precincts = plans.read_file(precincts_path)
 
 potential_cols = ['locality', 'precinct', 'NAME', 'BVAP', 'VAP', 'prop_BVAP', 'prop_D_LG', 'prop_D_p', 'prop_D_G', 'prop_D_AG', 'prop_D_P', 'index', 'geometry']
 
 vote_cols = [i for i in precincts.columns if not any([i==j for j in potential_cols])]
 
+# votes are distributed to districts in proportion to precinct area, using
+# one cached precinct-by-district weight matrix per plan
+precinct_index = assignment.AssignmentIndex(precincts)
+votes = precincts[vote_cols].fillna(0).values
+
 for mapname in maps:
-    df = gpd.read_file(maps[mapname]['path'])
-    
-    df = df.rename(columns={maps[mapname]['district_colname']: common_colname})
-        
-    df[common_colname] = df[common_colname].astype(str)
-    df = df[df[common_colname].isin(bh)]
+    df = plans.load_plan(maps[mapname]['path'], maps[mapname]['district_colname'], districts=bh)
     
-    df = ai.aggregate(precincts, df, source_columns=vote_cols, method='fractional_area')[1]
+    weights = plans.cached_matrix([precincts_path, maps[mapname]['path']],
+                                  lambda: precinct_index.weights(df), sorted(bh))
+    df[vote_cols] = assignment.interpolate(weights, votes)
 
-    df.loc[df[common_colname].isin([str(i) for i in affected]), 'status'] = affected_label
-    df.loc[df[common_colname].isin([str(i) for i in adjacent]), 'status'] = adjacent_label
+    df.loc[df[common_colname].isin(affected), 'status'] = affected_label
+    df.loc[df[common_colname].isin(adjacent), 'status'] = adjacent_label
 
     maps[mapname]['df'] = df
 
@@ -84,6 +74,31 @@ other_elections = {'Clinton v. Sanders (2016)': ['P_HC_16_x', 'P_BS_16_x'],
 
 all_elex = {**pres16, **other_elections}
 
+# district votes of every plan as (plans, elections, districts) arrays, for
+# the fairness metrics of all plans and elections at once
+votes1, votes2 = [np.stack([maps[mapname]['df'][[all_elex[e][i] for e in all_elex]].values.T for mapname in maps])
+                  for i in (0, 1)]
+shares = fairness.vote_shares(votes1, votes2)
+fairness.write_fairness('Analysis/Elections/fairness.feather', votes1, votes2, list(all_elex), list(maps),
+                        swings=np.linspace(-0.25, 0.25, 200))
+
+# percentiles of each plan's sorted vote shares within a sampled ensemble,
+# sketched by Ensemble/quantiles.py
+ensemble_sketch = 'Analysis/Elections/ensemble_sketch.npz'
+sketch = quantiles.RankQuantiles.load(ensemble_sketch) if os.path.exists(ensemble_sketch) else None
+if sketch is not None:
+    percentiles = []
+    for e, election in enumerate(all_elex):
+        if all_elex[election][0] in sketch.metrics:
+            df = pd.DataFrame(sketch.percentiles(all_elex[election][0], shares[:, e]),
+                              columns=[f'rank_{r}' for r in range(sketch.n_districts)])
+            df.insert(0, 'map', list(maps))
+            df.insert(1, 'election', election)
+            percentiles.append(df)
+    # a sketch of none of these elections' metrics has nothing to write
+    if percentiles:
+        pd.concat(percentiles).to_csv('Analysis/Elections/ensemble_percentiles.csv', index=False, float_format='%.1f')
+
 #%%
 figs = {'election_results': {'maps': [i for i in maps],
                              'elections': all_elex},
@@ -100,12 +115,14 @@ for f in figs:
             axis=ax
         else:
             axis=ax[i]
+
+        if sketch is not None and all_elex[election][0] in sketch.metrics:
+            sketch.plot_boxes(axis, all_elex[election][0])
             
         for mapname in figs[f]['maps']:
             # print(mapname)
-            df = maps[mapname]['df']
-            v = df[elections[election][0]] / (df[elections[election][0]] + df[elections[election][1]])
-            axis.scatter(range(len(v)), sorted(v), label=maps[mapname]['name'], s=15, color=maps[mapname]['color'], alpha=.7, linewidth=1.5, facecolor='none')
+            v = shares[list(maps).index(mapname), list(all_elex).index(election)]
+            axis.scatter(range(len(v)), np.sort(v), label=maps[mapname]['name'], s=15, color=maps[mapname]['color'], alpha=.7, linewidth=1.5, facecolor='none')
             axis.axhline(.5)
             axis.set_title(election)
             axis.set_ylim([.3, 1])
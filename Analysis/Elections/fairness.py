@@ -0,0 +1,199 @@
+"""
+fairness: Partisan fairness metrics of many plans under many elections at
+once.
+
+All functions take district vote totals as arrays of shape
+(plans, elections, districts), one array per candidate, where candidate 1 is
+the first candidate of each pair in elections (the Democrat in the general
+elections, Clinton in the 2016 primary). Every metric is computed along the
+district axis for all plans and elections together, so an ensemble of 100k
+plans is a few array passes. Signs are from candidate 1's point of view:
+
+    efficiency_gap -- wasted votes of candidate 2 minus those of candidate 1,
+        over all votes; positive when the plan favours candidate 1
+    mean_median -- median minus mean district vote share of candidate 1;
+        positive when the plan favours candidate 1
+    partisan_bias -- candidate 1's seat share minus one half when the
+        district vote shares are shifted uniformly so that their mean is one
+        half; positive when the plan favours candidate 1
+    seats_votes -- candidate 1's seats under uniform swing over a grid of
+        swing steps, for seats-votes curves
+
+Run as a script to score the plans sampled by Ensemble/chain.py:
+
+    python Analysis/Elections/fairness.py <ensemble .npy> <output .feather>
+
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import plans
+
+# election name: (candidate 1 column, candidate 2 column) of the precinct data
+elections = {'Clinton v. Trump (2016)': ('P_DEM_16_x', 'P_REP_16_x'),
+             'Clinton v. Sanders (2016)': ('P_HC_16_x', 'P_BS_16_x'),
+             'Northam v. Gillespie (2017)': ('G_DEM_17_x', 'G_REP_17_x'),
+             'Fairfax v. Vogel (2017)': ('LG_DEM_17_', 'LG_REP_17_'),
+             'Herring v. Adams (2017)': ('AG_DEM_17_', 'AG_REP_17_')}
+
+precincts_path = 'Maps/Affected and adjacent precincts with BVAP/BH_precincts_with_BVAP_VAP.shp'
+
+
+def district_votes(assignment, unit_votes, n_districts=None, chunk=4096):
+    """
+    Return district vote totals of many plans as a (plans, columns, districts)
+    float array.
+
+    Keyword arguments:
+        assignment -- int array of district codes of shape (plans, units);
+            negative codes are left out
+        unit_votes -- (units, columns) array of votes by unit
+        n_districts -- number of districts; inferred from assignment if None
+        chunk -- plans tallied per pass, bounding the size of temporaries
+    """
+
+    codes = np.atleast_2d(assignment)
+    unit_votes = np.asarray(unit_votes, dtype=float)
+    if n_districts is None:
+        n_districts = codes.max() + 1
+    out = np.empty((len(codes), unit_votes.shape[1], n_districts))
+    for start in range(0, len(codes), chunk):
+        block = codes[start:start + chunk]
+        # bin n_districts of each plan holds the units outside every district
+        bins = np.where(block < 0, n_districts, block) + (np.arange(len(block)) * (n_districts + 1))[:, None]
+        for c, column in enumerate(unit_votes.T):
+            sums = np.bincount(bins.ravel(), weights=np.broadcast_to(column, bins.shape).ravel(),
+                               minlength=len(block) * (n_districts + 1))
+            out[start:start + chunk, c] = sums.reshape(len(block), n_districts + 1)[:, :n_districts]
+    return out
+
+
+def vote_shares(votes1, votes2):
+    """Candidate 1's share of the two-candidate vote in each district"""
+
+    return votes1 / (votes1 + votes2)
+
+
+def efficiency_gap(votes1, votes2):
+    """Efficiency gap of each plan and election, of shape (plans, elections)"""
+
+    total = votes1 + votes2
+    wins = votes1 > votes2
+    wasted1 = np.where(wins, votes1 - total / 2, votes1)
+    wasted2 = np.where(wins, votes2, votes2 - total / 2)
+    return (wasted2.sum(axis=-1) - wasted1.sum(axis=-1)) / total.sum(axis=-1)
+
+
+def mean_median(shares):
+    """Median minus mean district vote share, of shape (plans, elections)"""
+
+    return np.median(shares, axis=-1) - shares.mean(axis=-1)
+
+
+def partisan_bias(shares):
+    """Seat share minus one half at a mean vote share of one half, of shape (plans, elections)"""
+
+    swung = shares + (0.5 - shares.mean(axis=-1, keepdims=True))
+    return (swung > 0.5).mean(axis=-1) - 0.5
+
+
+def seats_votes(shares, swings=np.linspace(-0.25, 0.25, 200)):
+    """
+    Return candidate 1's seats under uniform swing, as an int16 array of
+    shape (plans, elections, swings), and the mean vote share at each swing,
+    of shape (plans, elections, swings).
+
+    Keyword arguments:
+        shares -- district vote shares of shape (plans, elections, districts)
+        swings -- evenly spaced, increasing swings added to every district's
+            vote share
+
+    Rather than comparing every district at every swing, each district's
+    first winning swing step is found directly, and the seat counts are a
+    cumulative sum of how many districts flip at each step.
+    """
+
+    swings = np.asarray(swings, dtype=float)
+    n = len(swings)
+    step = (swings[-1] - swings[0]) / (n - 1) if n > 1 else 1.0
+    # a district is won at swings[s] when shares + swings[s] > 0.5
+    first = np.floor((0.5 - shares - swings[0]) / step).astype(np.int64) + 1
+    first = np.clip(first, 0, n)
+    # correct for rounding at the step boundaries
+    first -= (first > 0) & (shares + swings[np.maximum(first - 1, 0)] > 0.5)
+    first += (first < n) & ~(shares + swings[np.minimum(first, n - 1)] > 0.5)
+
+    rows = first.reshape(-1, first.shape[-1])
+    bins = (rows + np.arange(len(rows))[:, None] * (n + 1)).ravel()
+    flips = np.bincount(bins, minlength=len(rows) * (n + 1)).reshape(len(rows), n + 1)
+    seats = np.cumsum(flips[:, :n], axis=1, dtype=np.int16).reshape(*shares.shape[:-1], n)
+    votes = shares.mean(axis=-1)[..., None] + swings
+    return seats, votes
+
+
+def fairness_table(votes1, votes2, names=None, plan_names=None):
+    """
+    Return every scalar metric for every plan and election as a long
+    DataFrame with plan and election columns.
+
+    Keyword arguments:
+        votes1, votes2 -- candidate vote totals of shape (plans, elections,
+            districts)
+        names -- election names; positions if None
+        plan_names -- plan names; positions if None
+    """
+
+    shares = vote_shares(votes1, votes2)
+    n_plans, n_elections = shares.shape[:2]
+    names = list(range(n_elections)) if names is None else list(names)
+    plan = np.repeat(np.arange(n_plans), n_elections)
+    return pd.DataFrame({'plan': plan if plan_names is None else np.asarray(plan_names)[plan],
+                         'election': pd.Categorical(np.tile(names, n_plans), categories=names),
+                         'vote_share': shares.mean(axis=-1).ravel(),
+                         'seats': (shares > 0.5).sum(axis=-1).ravel(),
+                         'efficiency_gap': efficiency_gap(votes1, votes2).ravel(),
+                         'mean_median': mean_median(shares).ravel(),
+                         'partisan_bias': partisan_bias(shares).ravel()})
+
+
+def write_fairness(path, votes1, votes2, names=None, plan_names=None, swings=None):
+    """
+    Write fairness_table to a Feather file at path. If swings is given, the
+    seats-votes curves go to a second Feather file next to it
+    (<name>_seats_votes.feather), with the plan and election columns of the
+    table and one int16 column of seats per swing.
+    """
+
+    table = fairness_table(votes1, votes2, names, plan_names)
+    table.to_feather(path)
+    if swings is not None:
+        seats, _ = seats_votes(vote_shares(votes1, votes2), swings)
+        curves = pd.DataFrame(seats.reshape(-1, len(swings)), columns=[f'{s:+.4f}' for s in swings])
+        curves.insert(0, 'plan', table['plan'].values)
+        curves.insert(1, 'election', table['election'].values)
+        curves.to_feather(os.path.splitext(path)[0] + '_seats_votes.feather')
+
+
+def election_votes(totals):
+    """
+    Split district totals of shape (plans, columns, districts), with columns
+    holding the candidate pairs of each election in turn, into
+    (votes1, votes2) of shape (plans, elections, districts).
+    """
+
+    return totals[:, 0::2], totals[:, 1::2]
+
+
+if __name__ == '__main__':
+    samples = np.load(sys.argv[1], mmap_mode='r')
+    out_path = sys.argv[2]
+
+    precincts = plans.read_file(precincts_path)
+    columns = [c for pair in elections.values() for c in pair]
+    totals = district_votes(samples, precincts[columns].fillna(0).values)
+    votes1, votes2 = election_votes(totals)
+    write_fairness(out_path, votes1, votes2, list(elections), swings=np.linspace(-0.25, 0.25, 200))
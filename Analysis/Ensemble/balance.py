@@ -0,0 +1,293 @@
+"""
+balance: Automatic population balancing of a plan, in place of the manual
+adjustments of steps 3, 4 and 7 of the process in the README.
+
+A Balancer moves units across district lines one at a time, always taking
+the move that most reduces the population outside the tolerance band
+(±1% of the ideal 80010 by default). Candidate moves of the units on each
+district boundary sit in a priority queue; after a move only the moves
+touching the two districts involved are re-scored, and district populations
+are updated incrementally. A move is never made if it would split its
+district. When no move reduces the excess any more, moves that even out
+populations without changing the excess are allowed, so that population can
+be passed along a chain of districts. Finally, moves that turn out not to be
+needed are undone.
+
+balance_plan balances a plan's precincts first, and only if that cannot
+reach the tolerance moves census blocks, starting from the precinct result.
+The result is a diff: one row per moved precinct or block.
+
+Run as a script to balance a plan shapefile:
+
+    python Analysis/Ensemble/balance.py <plan shapefile> <district column> <output .csv>
+
+"""
+
+import heapq
+import itertools
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Contiguity'))
+import assignment as asg
+import census
+import chain
+import contiguity
+import plans
+
+ideal_population = 80010
+
+census_blocks = '/mapping/VA/2010 Census/Census Blocks with Population/tabblock2010_51_pophu.shp'
+block_pop_col = 'POP10'
+
+
+class Balancer(chain.Chain):
+    """
+    Greedy population balancer over a unit adjacency graph.
+
+    Keyword arguments:
+        adjacency -- sparse (units x units) matrix, nonzero where units are
+            adjacent
+        assignment -- district label of each unit in the starting plan
+        population -- population of each unit
+        ideal -- ideal district population; the mean district population if None
+        tolerance -- allowed relative deviation from the ideal population
+        movable -- boolean mask of the units that may change district; all
+            units if None
+
+    As for Chain, assignment holds district codes (positions in labels) and
+    population the district populations; original is the starting assignment.
+    """
+
+    def __init__(self, adjacency, assignment, population, ideal=None, tolerance=0.01, movable=None):
+        super().__init__(adjacency, assignment, population, tolerance=tolerance)
+        if ideal is not None:
+            self.bounds = (ideal * (1 - tolerance), ideal * (1 + tolerance))
+        n = len(self.assignment)
+        self.movable = np.ones(n, dtype=bool) if movable is None else np.asarray(movable, dtype=bool)
+        self.original = self.assignment.copy()
+
+        # every edge in both directions, as (unit, neighbour)
+        self._from = np.concatenate([self._edges[:, 0], self._edges[:, 1]])
+        self._to = np.concatenate([self._edges[:, 1], self._edges[:, 0]])
+        self._version = np.zeros(len(self.labels), dtype=int)
+        self._heap = []
+        self._counter = itertools.count()
+
+    def _excess(self, population):
+        """Population outside the tolerance band, per district"""
+
+        low, high = self.bounds
+        return np.maximum(population - high, 0) + np.maximum(low - population, 0)
+
+    def excess(self):
+        """Total population outside the tolerance band over all districts"""
+
+        return self._excess(self.population).sum()
+
+    def balanced(self):
+        """Whether every district is within tolerance"""
+
+        return bool(self._in_bounds(self.population).all())
+
+    def _scores(self, unit, a, b):
+        """
+        Reduction of the excess, and of the sum of squared deviations, from
+        moving each unit from district a to district b.
+        """
+
+        p = self.unit_population[unit]
+        pa, pb = self.population[a], self.population[b]
+        excess = self._excess(pa) + self._excess(pb) - self._excess(pa - p) - self._excess(pb + p)
+        spread = 2 * p * (pa - pb - p)
+        return excess, spread
+
+    def _push(self, districts=None):
+        """Queue the useful moves of boundary units into or out of districts"""
+
+        a, b = self.assignment[self._from], self.assignment[self._to]
+        keep = (a != b) & self.movable[self._from]
+        if districts is not None:
+            keep &= np.isin(a, districts) | np.isin(b, districts)
+        k = len(self.labels)
+        unit, b = np.divmod(np.unique(self._from[keep] * k + b[keep]), k)
+        a = self.assignment[unit]
+
+        excess, spread = self._scores(unit, a, b)
+        useful = (excess > 0) | ((excess == 0) & (spread > 0))
+        for e, s, u, da, db in zip(excess[useful], spread[useful], unit[useful], a[useful], b[useful]):
+            heapq.heappush(self._heap, (-e, -s, next(self._counter), u, da, db,
+                                        self._version[da], self._version[db]))
+
+    def _move(self, unit, a, b):
+        self.assignment[unit] = b
+        p = self.unit_population[unit]
+        self.population[a] -= p
+        self.population[b] += p
+        self.size[a] -= 1
+        self.size[b] += 1
+        self._version[[a, b]] += 1
+
+    def run(self, max_moves=None):
+        """
+        Move units until every district is within tolerance, no useful move
+        is left, or max_moves moves have been made; return whether the plan
+        is balanced.
+        """
+
+        self._heap = []
+        self._push()
+        moves = 0
+        while self._heap and not self.balanced() and (max_moves is None or moves < max_moves):
+            _, _, _, unit, a, b, version_a, version_b = heapq.heappop(self._heap)
+            # skip moves queued before either district last changed
+            if self._version[a] != version_a or self._version[b] != version_b:
+                continue
+            if self.size[a] == 1 or not self._stays_connected(unit, a):
+                continue
+            self._move(unit, a, b)
+            self._push([a, b])
+            moves += 1
+        self.prune()
+        return self.balanced()
+
+    def prune(self):
+        """Undo moves that are not needed to keep the excess where it is"""
+
+        changed = True
+        while changed:
+            changed = False
+            for unit in np.flatnonzero(self.assignment != self.original):
+                a, b = self.assignment[unit], self.original[unit]
+                neighbours = self._indices[self._indptr[unit]:self._indptr[unit + 1]]
+                if not (self.assignment[neighbours] == b).any() or self.size[a] == 1:
+                    continue
+                excess, _ = self._scores(np.array([unit]), a, b)
+                if excess[0] >= 0 and self._stays_connected(unit, a):
+                    self._move(unit, a, b)
+                    changed = True
+
+    def moved(self):
+        """Positions of the units whose district changed"""
+
+        return np.flatnonzero(self.assignment != self.original)
+
+
+def _balance_units(adjacency, codes, population, ideal, tolerance):
+    """Balance the assigned units of codes; return (balancer, positions of those units)"""
+
+    units = np.flatnonzero(codes >= 0)
+    balancer = Balancer(adjacency[units][:, units], codes[units], population[units],
+                        ideal=ideal, tolerance=tolerance)
+    balancer.run()
+    return balancer, units
+
+
+def balance_precincts(precincts, adjacency, district_col='NAME', pop_col='VAP', tolerance=0.01):
+    """
+    Return a copy of precincts with the plan in district_col balanced, by
+    moving precincts, to within tolerance of the mean district population in
+    pop_col, e.g. as the starting plan of chain.from_precincts. Raises
+    ValueError if precinct moves cannot reach the tolerance.
+
+    Keyword arguments:
+        precincts -- GeoDataFrame of precincts
+        adjacency -- adjacency matrix of precincts (e.g. the shared-boundary
+            matrix from boundary_index)
+        district_col -- column holding each precinct's district
+        pop_col -- population column to balance
+        tolerance -- allowed relative deviation from the mean
+    """
+
+    balancer = Balancer(adjacency, precincts[district_col].astype(int).values,
+                        precincts[pop_col].fillna(0).values, tolerance=tolerance)
+    if not balancer.run():
+        ideal = balancer.unit_population.sum() / len(balancer.labels)
+        deviation = balancer.population / ideal - 1
+        raise ValueError(f'precinct moves only balance {pop_col} to {deviation.min():+.1%} to '
+                         f'{deviation.max():+.1%} of ideal, outside the tolerance of {tolerance:.1%}')
+    out = precincts.copy()
+    out[district_col] = balancer.labels[balancer.assignment]
+    return out
+
+
+def balance_plan(plan, precincts, blocks, precinct_adjacency, block_adjacency=None,
+                 ideal=ideal_population, tolerance=0.01):
+    """
+    Balance the districts of plan by moving precincts, then census blocks if
+    precinct moves alone cannot reach the tolerance.
+
+    Keyword arguments:
+        plan -- GeoDataFrame of districts with a district_no column
+        precincts -- GeoDataFrame of the precincts covering the plan
+        blocks -- GeoDataFrame of census blocks with a POP10 column
+        precinct_adjacency -- adjacency matrix of precincts
+        block_adjacency -- function of a GeoDataFrame of blocks returning
+            their adjacency matrix; contiguity.build_adjacency if None
+        ideal -- ideal district population
+        tolerance -- allowed relative deviation from ideal
+
+    Returns (diff, population): a data frame with one row per moved unit
+    (level, unit, population, from and to district numbers) and a data frame
+    of the district populations before and after.
+    """
+
+    district_no = plan[plans.common_colname].values
+    block_precinct = asg.AssignmentIndex(blocks).assign(precincts)
+    blocks = blocks[block_precinct >= 0]
+    block_precinct = block_precinct[block_precinct >= 0]
+    block_population = blocks[block_pop_col].values.astype(float)
+    precinct_population = np.bincount(block_precinct, weights=block_population, minlength=len(precincts))
+
+    precinct_codes = asg.AssignmentIndex(precincts).assign(plan)
+    before = np.bincount(precinct_codes[precinct_codes >= 0],
+                         weights=precinct_population[precinct_codes >= 0], minlength=len(plan))
+
+    balancer, units = _balance_units(precinct_adjacency, precinct_codes, precinct_population, ideal, tolerance)
+    names = (precincts['locality'].astype(str) + ' ' + precincts['precinct'].astype(str)).values
+    moved = balancer.moved()
+    diff = [pd.DataFrame({'level': 'precinct', 'unit': names[units[moved]],
+                          'population': balancer.unit_population[moved],
+                          'from_district': district_no[balancer.labels[balancer.original[moved]]],
+                          'to_district': district_no[balancer.labels[balancer.assignment[moved]]]})]
+    precinct_codes[units] = balancer.labels[balancer.assignment]
+
+    if not balancer.balanced():
+        block_codes = precinct_codes[block_precinct]
+        adjacency = (block_adjacency or contiguity.build_adjacency)(blocks)
+        balancer, units = _balance_units(adjacency, block_codes, block_population, ideal, tolerance)
+        moved = balancer.moved()
+        diff.append(pd.DataFrame({'level': 'block', 'unit': blocks['BLOCKID10'].values[units[moved]]
+                                  if 'BLOCKID10' in blocks.columns else units[moved],
+                                  'population': balancer.unit_population[moved],
+                                  'from_district': district_no[balancer.labels[balancer.original[moved]]],
+                                  'to_district': district_no[balancer.labels[balancer.assignment[moved]]]}))
+
+    after = np.zeros(len(plan))
+    after[balancer.labels] = balancer.population
+    population = pd.DataFrame({plans.common_colname: district_no, 'population_before': before,
+                               'population_after': after,
+                               'deviation_after': (after - ideal) / ideal})
+    return pd.concat(diff, ignore_index=True), population
+
+
+if __name__ == '__main__':
+    plan_path = sys.argv[1]
+    district_colname = sys.argv[2]
+    out_path = sys.argv[3]
+
+    plan = plans.load_plan(plan_path, district_colname)
+    precincts = plans.read_file(chain.precincts_path)
+    blocks = census.read_blocks(census_blocks, precincts, census.block_columns + ['BLOCKID10'])
+
+    def block_adjacency(region_blocks):
+        return plans.cached_matrix([census_blocks, chain.precincts_path],
+                                   lambda: contiguity.build_adjacency(region_blocks), 'block adjacency')
+
+    diff, population = balance_plan(plan, precincts, blocks, contiguity.load_adjacency(chain.precincts_path),
+                                    block_adjacency)
+    diff.to_csv(out_path, index=False)
+    print(population.to_string(index=False))
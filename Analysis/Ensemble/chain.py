@@ -0,0 +1,248 @@
+"""
+chain: Markov chain sampler of alternative plans for the Bethune-Hill
+districts, drawn on the precinct adjacency graph.
+
+The chain only reassigns the precincts of the 33 affected and adjacent
+districts among those districts, so their combined outer envelope never
+changes. Every plan it accepts keeps each district contiguous and within
+the population tolerance (±1% of ideal by default), so the starting plan must
+already be within tolerance: from_precincts refuses one that is not, and the
+chain and store scripts first balance the enacted map with
+balance.balance_precincts.
+
+Two proposals are available:
+
+    recom -- merge two adjacent districts, draw a random spanning tree of the
+        merged precincts and cut one of its edges so that both halves are
+        within tolerance (spanning-tree recombination)
+    flip -- move one precinct on a district boundary to a neighbouring
+        district, if both districts stay within tolerance and contiguous
+
+District tallies (population, BVAP, VAP and vote columns) are updated only for
+the districts a step changes, and contiguity is checked locally around the
+moved precincts rather than over the whole plan.
+
+Run as a script to sample plans from the enacted map:
+
+    python Analysis/Ensemble/chain.py <steps> <output .npy> [recom|flip]
+
+"""
+
+import os
+import sys
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.csgraph as csgraph
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Compactness'))
+import boundary_index as bi
+import plans
+
+precincts_path = 'Maps/Affected and adjacent precincts with BVAP/BH_precincts_with_BVAP_VAP.shp'
+
+tally_cols = ['BVAP', 'VAP',
+              'P_DEM_16_x', 'P_REP_16_x', 'P_HC_16_x', 'P_BS_16_x',
+              'G_DEM_17_x', 'G_REP_17_x', 'LG_DEM_17_', 'LG_REP_17_',
+              'AG_DEM_17_', 'AG_REP_17_']
+
+
+class Chain:
+    """
+    State of a districting Markov chain over a unit adjacency graph.
+
+    Keyword arguments:
+        adjacency -- sparse (units x units) matrix, nonzero where units are
+            adjacent (e.g. the shared-boundary matrix from boundary_index)
+        assignment -- district label of each unit in the starting plan
+        population -- population of each unit
+        values -- optional (units x columns) array of further unit data to
+            tally by district
+        tolerance -- allowed relative deviation from the ideal population
+        seed -- seed for the chain's random number generator
+
+    After each step, assignment holds district codes (positions in labels),
+    population the district populations and tallies the district totals of
+    values.
+    """
+
+    def __init__(self, adjacency, assignment, population, values=None, tolerance=0.01, seed=None):
+        adjacency = sp.csr_matrix(adjacency)
+        self._indptr, self._indices = adjacency.indptr, adjacency.indices
+        upper = sp.triu(adjacency, k=1).tocoo()
+        self._edges = np.column_stack([upper.row, upper.col])
+        self._adjacency = adjacency
+
+        self.labels, self.assignment = np.unique(np.asarray(assignment), return_inverse=True)
+        k = len(self.labels)
+        self.unit_population = np.asarray(population, dtype=float)
+        self.unit_values = np.zeros((len(self.assignment), 0)) if values is None else np.asarray(values, dtype=float)
+
+        self.population = np.bincount(self.assignment, weights=self.unit_population, minlength=k)
+        self.tallies = np.column_stack([np.bincount(self.assignment, weights=column, minlength=k)
+                                        for column in self.unit_values.T]) if self.unit_values.shape[1] else np.zeros((k, 0))
+        self.size = np.bincount(self.assignment, minlength=k)
+
+        ideal = self.unit_population.sum() / k
+        self.bounds = (ideal * (1 - tolerance), ideal * (1 + tolerance))
+        self.rng = np.random.default_rng(seed)
+        self.accepted = 0
+
+    def _in_bounds(self, population):
+        return (population >= self.bounds[0]) & (population <= self.bounds[1])
+
+    def _random_cut_edge(self):
+        cut = np.flatnonzero(self.assignment[self._edges[:, 0]] != self.assignment[self._edges[:, 1]])
+        return self._edges[cut[self.rng.integers(len(cut))]]
+
+    def recom_step(self, max_attempts=10):
+        """
+        Redraw two adjacent districts by spanning-tree recombination. Returns
+        True if the plan changed; if no balanced cut is found in max_attempts
+        random spanning trees the plan is left unchanged.
+        """
+
+        u, v = self._random_cut_edge()
+        a, b = self.assignment[u], self.assignment[v]
+        nodes = np.flatnonzero((self.assignment == a) | (self.assignment == b))
+        sub = self._adjacency[nodes][:, nodes].tocoo()
+        keep = sub.row < sub.col
+        rows, cols = sub.row[keep], sub.col[keep]
+        pop = self.unit_population[nodes]
+        total = pop.sum()
+
+        for _ in range(max_attempts):
+            # minimum spanning tree under random edge weights
+            weights = self.rng.random(len(rows)) + 1e-9
+            tree = csgraph.minimum_spanning_tree(sp.csr_matrix((weights, (rows, cols)), shape=(len(nodes),) * 2))
+            order, parent = csgraph.breadth_first_order(tree, self.rng.integers(len(nodes)),
+                                                        directed=False, return_predecessors=True)
+            if len(order) < len(nodes):
+                return False
+
+            # population below each tree edge (node, parent[node])
+            below = pop.copy()
+            for node in order[:0:-1]:
+                below[parent[node]] += below[node]
+            candidates = order[1:][self._in_bounds(below[order[1:]]) & self._in_bounds(total - below[order[1:]])]
+            if len(candidates) == 0:
+                continue
+
+            cut = candidates[self.rng.integers(len(candidates))]
+            side = np.zeros(len(nodes), dtype=bool)
+            side[cut] = True
+            for node in order[order.tolist().index(cut) + 1:]:
+                side[node] = side[parent[node]]
+
+            self._reassign(nodes, np.where(side, a, b), (a, b))
+            self.accepted += 1
+            return True
+        return False
+
+    def _reassign(self, nodes, codes, districts):
+        self.assignment[nodes] = codes
+        for d in districts:
+            members = nodes[codes == d]
+            self.population[d] = self.unit_population[members].sum()
+            self.tallies[d] = self.unit_values[members].sum(axis=0)
+            self.size[d] = len(members)
+
+    def _stays_connected(self, unit, d):
+        """Whether district d stays contiguous without unit, searching outward from unit's neighbours"""
+
+        neighbours = self._indices[self._indptr[unit]:self._indptr[unit + 1]]
+        neighbours = neighbours[self.assignment[neighbours] == d]
+        if len(neighbours) <= 1:
+            return len(neighbours) == 1 or self.size[d] == 1
+        targets = set(neighbours[1:].tolist())
+        seen = {neighbours[0], unit}
+        stack = [neighbours[0]]
+        while stack and targets:
+            node = stack.pop()
+            for other in self._indices[self._indptr[node]:self._indptr[node + 1]]:
+                if other not in seen and self.assignment[other] == d:
+                    seen.add(other)
+                    targets.discard(other)
+                    stack.append(other)
+        return not targets
+
+    def flip_step(self):
+        """
+        Move one boundary unit to a neighbouring district. Returns True if
+        the move was accepted.
+        """
+
+        u, v = self._random_cut_edge()
+        if self.rng.random() < 0.5:
+            u, v = v, u
+        a, b = self.assignment[u], self.assignment[v]
+        p = self.unit_population[u]
+        if self.size[a] == 1 or not self._in_bounds(self.population[a] - p) or not self._in_bounds(self.population[b] + p):
+            return False
+        if not self._stays_connected(u, a):
+            return False
+
+        self.assignment[u] = b
+        self.population[a] -= p
+        self.population[b] += p
+        self.tallies[a] -= self.unit_values[u]
+        self.tallies[b] += self.unit_values[u]
+        self.size[a] -= 1
+        self.size[b] += 1
+        self.accepted += 1
+        return True
+
+    def run(self, steps, proposal='recom'):
+        """
+        Advance the chain steps times, yielding the chain after each step.
+        The yielded object is the chain itself; copy assignment to keep it.
+        """
+
+        step = self.recom_step if proposal == 'recom' else self.flip_step
+        for _ in range(steps):
+            step()
+            yield self
+
+
+def from_precincts(precincts, district_col='NAME', pop_col='VAP', index=None, **kwargs):
+    """
+    Return a Chain over the precinct adjacency graph starting from the plan
+    in district_col. Raises ValueError if a district of that plan is outside
+    the population tolerance (see balance.balance_precincts).
+
+    Keyword arguments:
+        precincts -- GeoDataFrame of precincts
+        district_col -- column holding each precinct's starting district
+        pop_col -- population column balanced by the chain
+        index -- precomputed boundary index of precincts (see
+            boundary_index); built if None
+        kwargs -- passed to Chain
+    """
+
+    if index is None:
+        index = bi.build_boundary_index(precincts)
+    values = precincts[[c for c in tally_cols if c in precincts.columns]].fillna(0).values
+    chain = Chain(index[0], precincts[district_col].astype(int).values, precincts[pop_col].values,
+                  values=values, **kwargs)
+    if not chain._in_bounds(chain.population).all():
+        ideal = chain.unit_population.sum() / len(chain.labels)
+        deviation = chain.population / ideal - 1
+        raise ValueError(f'starting plan is {deviation.min():+.1%} to {deviation.max():+.1%} of ideal {pop_col}, '
+                         f'outside the tolerance; balance it first')
+    return chain
+
+
+if __name__ == '__main__':
+    steps = int(sys.argv[1])
+    out_path = sys.argv[2]
+    proposal = sys.argv[3] if len(sys.argv) > 3 else 'recom'
+
+    precincts = plans.read_file(precincts_path)
+    index = bi.boundary_index(precincts, plans.cache_path([precincts_path], '.npz', 'boundary index'))
+    # the enacted map is balanced on total population, not on VAP
+    import balance
+    chain = from_precincts(balance.balance_precincts(precincts, index[0]), index=index, seed=0)
+    samples = np.empty((steps, len(precincts)), dtype=np.int8)
+    for i, state in enumerate(chain.run(steps, proposal)):
+        samples[i] = state.assignment
+    np.save(out_path, samples)
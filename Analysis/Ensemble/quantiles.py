@@ -0,0 +1,279 @@
+"""
+quantiles: Streaming percentiles of an ensemble, by metric and district rank.
+
+Where a submitted plan falls relative to a neutral ensemble is read off the
+distribution, over the ensemble's plans, of each metric's k-th smallest
+district value (the k-th point of the sorted-voteshare figures). Keeping every
+plan to compute these is not necessary: a KLL sketch holds a few hundred
+weighted samples per distribution, answers any quantile or rank to within
+about 1% of the number of plans, and two sketches built from different plans
+merge into a sketch of all of them. Sketches can therefore be built chunk by
+chunk, in separate processes or from separate stores, and combined.
+
+All the distributions are sketched together: every distribution receives one
+value per plan, so their sketches compact at the same moments, and the
+sketch's levels are arrays with one column per (metric, rank) pair.
+
+RankQuantiles reads metric columns named <metric>_<district>, as in the
+summaries of store.Ensemble (e.g. bvap_71, P_DEM_16_x_71). percentiles places
+the submitted plans within the ensemble, and plot_boxes overlays the ensemble
+on the sorted-voteshare figures of Elections/compute_elections.py (drawn when
+Analysis/Elections/ensemble_sketch.npz exists). Run as a script to
+sketch the summaries of one or more stores into one .npz file, one store
+per process:
+
+    python Analysis/Ensemble/quantiles.py <sketch .npz> <store directory> [<store directory> ...]
+
+"""
+
+import concurrent.futures
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import store
+
+# metric column prefixes sketched by default
+metrics = ['bvap', 'P_DEM_16_x', 'P_HC_16_x', 'G_DEM_17_x', 'LG_DEM_17_', 'AG_DEM_17_', 'pp']
+
+
+def _metric_columns(columns, metric):
+    """The columns of metric among columns, named <metric>_<district>"""
+
+    pattern = re.compile(re.escape(metric) + r'_\d+$')
+    return [c for c in columns if pattern.match(c)]
+
+
+class KLL:
+    """
+    KLL quantile sketch of many columns of values at once.
+
+    Keyword arguments:
+        n_columns -- number of columns (distributions) sketched
+        k -- size of the top level; the rank error is about 1.7 / k
+        seed -- seed for the choice of the items kept at each compaction
+
+    levels[h] is an array of shape (items, n_columns) of items of weight 2**h.
+    """
+
+    def __init__(self, n_columns, k=200, seed=None):
+        self.n_columns = n_columns
+        self.k = k
+        self.levels = [np.empty((0, n_columns))]
+        self.count = 0
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, h):
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - 1 - h))))
+
+    def _compress(self):
+        while True:
+            over = [h for h, level in enumerate(self.levels) if len(level) > self._capacity(h)]
+            if not over:
+                return
+            h = over[0]
+            if h + 1 == len(self.levels):
+                self.levels.append(np.empty((0, self.n_columns)))
+            # keep every other item of the sorted level, from a random start
+            # in each column, at twice the weight; an odd item stays behind
+            level = np.sort(self.levels[h], axis=0)
+            pairs = len(level) // 2
+            rows = self._rng.integers(0, 2, self.n_columns) + 2 * np.arange(pairs)[:, None]
+            promoted = np.take_along_axis(level, rows, axis=0)
+            self.levels[h] = level[2 * pairs:]
+            self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+
+    def update(self, values):
+        """Add the rows of values, of shape (items, n_columns)"""
+
+        values = np.asarray(values, dtype=float).reshape(-1, self.n_columns)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self._compress()
+
+    def merge(self, other):
+        """Add the items of another KLL sketch of the same columns"""
+
+        for h, level in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.empty((0, self.n_columns)))
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        self.count += other.count
+        self._compress()
+
+    def _items(self, columns):
+        items = np.concatenate([level[:, columns] for level in self.levels])
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        return items, weights
+
+    def quantile(self, q, columns=slice(None)):
+        """Quantiles q of each column (or of the given columns), of shape (len(q), columns)"""
+
+        items, weights = self._items(columns)
+        order = np.argsort(items, axis=0)
+        cumulative = np.cumsum(weights[order], axis=0)
+        targets = np.atleast_1d(q)[:, None, None] * cumulative[-1]
+        position = np.minimum((cumulative[None] < targets).sum(axis=1), len(items) - 1)
+        return np.take_along_axis(items, np.take_along_axis(order, position, axis=0), axis=0)
+
+    def rank(self, values, columns=slice(None)):
+        """
+        Fraction of the sketched values of each column (or of the given
+        columns) below each of values, of shape (n, columns), counting ties
+        as half below.
+        """
+
+        items, weights = self._items(columns)
+        values = np.asarray(values, dtype=float).reshape(-1, items.shape[1])
+        below = ((items[:, None] < values) * weights[:, None, None]).sum(axis=0)
+        equal = ((items[:, None] == values) * weights[:, None, None]).sum(axis=0)
+        return (below + equal / 2) / weights.sum()
+
+    def state(self):
+        """The sketch as a dict of arrays, for np.savez"""
+
+        return {'n_columns': self.n_columns, 'k': self.k, 'count': self.count,
+                **{f'level_{h}': level for h, level in enumerate(self.levels)}}
+
+    @classmethod
+    def from_state(cls, state, seed=None):
+        sketch = cls(int(state['n_columns']), int(state['k']), seed)
+        sketch.count = int(state['count'])
+        n_levels = sum(1 for key in state if key.startswith('level_'))
+        sketch.levels = [np.asarray(state[f'level_{h}']) for h in range(n_levels)]
+        return sketch
+
+
+class RankQuantiles:
+    """
+    Sketches of each metric's district values by rank within the plan.
+
+    Keyword arguments:
+        metrics -- metric column prefixes; a plan's values of metric m are
+            its columns m_<district>
+        n_districts -- number of districts of each plan
+        k -- KLL sketch size
+        seed -- seed of the sketch
+    """
+
+    def __init__(self, metrics=metrics, n_districts=33, k=200, seed=None):
+        self.metrics = list(metrics)
+        self.n_districts = n_districts
+        self.sketch = KLL(len(self.metrics) * n_districts, k, seed)
+
+    def update(self, summary):
+        """Add the plans of a summary DataFrame with <metric>_<district> columns"""
+
+        values = []
+        for metric in self.metrics:
+            columns = _metric_columns(summary.columns, metric)
+            if len(columns) != self.n_districts:
+                raise ValueError(f'{len(columns)} {metric} columns, expected {self.n_districts}')
+            values.append(np.sort(summary[columns].values, axis=1))
+        self.sketch.update(np.concatenate(values, axis=1))
+
+    def merge(self, other):
+        """Add the plans sketched by another RankQuantiles of the same metrics"""
+
+        if other.metrics != self.metrics or other.n_districts != self.n_districts:
+            raise ValueError('sketches of different metrics or districts cannot be merged')
+        self.sketch.merge(other.sketch)
+
+    @property
+    def count(self):
+        """Number of plans sketched"""
+
+        return self.sketch.count
+
+    def _slice(self, metric):
+        m = self.metrics.index(metric)
+        return slice(m * self.n_districts, (m + 1) * self.n_districts)
+
+    def quantiles(self, metric, q):
+        """Quantiles q of metric at each district rank, of shape (len(q), n_districts)"""
+
+        return self.sketch.quantile(q, self._slice(metric))
+
+    def table(self, q=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        """Quantiles q of every metric at every rank, as a DataFrame"""
+
+        values = self.sketch.quantile(q)
+        df = pd.DataFrame(values.T, columns=[f'q{100 * x:g}' for x in q])
+        df.insert(0, 'metric', np.repeat(self.metrics, self.n_districts))
+        df.insert(1, 'rank', np.tile(np.arange(self.n_districts), len(self.metrics)))
+        return df
+
+    def percentiles(self, metric, values):
+        """
+        Percentile within the ensemble of each district value of each of
+        some plans, by rank.
+
+        Keyword arguments:
+            metric -- one of metrics
+            values -- the plans' district values of metric, of shape
+                (plans, n_districts) in any district order
+
+        Returns an array of shape (plans, n_districts) of percentiles of the
+        plans' sorted values, from 0 to 100.
+        """
+
+        return 100 * self.sketch.rank(np.sort(np.atleast_2d(values), axis=1), self._slice(metric))
+
+    def box_stats(self, metric, whiskers=(0.05, 0.95)):
+        """Box plot statistics of metric at each rank, for matplotlib's Axes.bxp"""
+
+        q = self.quantiles(metric, [whiskers[0], 0.25, 0.5, 0.75, whiskers[1]])
+        return [{'whislo': lo, 'q1': q1, 'med': med, 'q3': q3, 'whishi': hi, 'fliers': []}
+                for lo, q1, med, q3, hi in q.T]
+
+    def plot_boxes(self, axis, metric, whiskers=(0.05, 0.95), **kwargs):
+        """
+        Draw a box of the ensemble's values of metric at each rank on axis,
+        at x positions 0 to n_districts - 1 like the sorted-voteshare
+        figures; kwargs are passed to Axes.bxp.
+        """
+
+        style = {'widths': 0.6, 'showfliers': False, 'manage_ticks': False, 'zorder': 0,
+                 'boxprops': {'color': 'gray'}, 'whiskerprops': {'color': 'gray'},
+                 'capprops': {'color': 'gray'}, 'medianprops': {'color': 'dimgray'}}
+        return axis.bxp(self.box_stats(metric, whiskers), positions=np.arange(self.n_districts),
+                        **{**style, **kwargs})
+
+    def save(self, path):
+        np.savez(path, metrics=np.array(self.metrics), n_districts=self.n_districts, **self.sketch.state())
+
+    @classmethod
+    def load(cls, path, seed=None):
+        with np.load(path) as f:
+            state = dict(f)
+        quantiles = cls(state.pop('metrics').tolist(), int(state.pop('n_districts')), seed=seed)
+        quantiles.sketch = KLL.from_state(state, seed)
+        return quantiles
+
+
+def sketch_ensemble(path, metrics=metrics, k=200, seed=None):
+    """RankQuantiles of the summaries of the store at path, read one chunk at a time"""
+
+    ensemble = store.Ensemble(path)
+    # leave out metrics the store has no columns for (e.g. pp without a boundary index)
+    quantiles = RankQuantiles([m for m in metrics if _metric_columns(ensemble.columns, m)],
+                              len(ensemble.labels), k, seed)
+    columns = [c for m in quantiles.metrics for c in _metric_columns(ensemble.columns, m)]
+    for summary in ensemble.summary_batches(columns):
+        quantiles.update(summary)
+    return quantiles
+
+
+if __name__ == '__main__':
+    out_path = sys.argv[1]
+    paths = sys.argv[2:]
+
+    with concurrent.futures.ProcessPoolExecutor() as pool:
+        sketches = list(pool.map(sketch_ensemble, paths))
+    for other in sketches[1:]:
+        sketches[0].merge(other)
+    sketches[0].save(out_path)
+    print(f'{sketches[0].count} plans')
@@ -0,0 +1,340 @@
+"""
+store: On-disk store for large ensembles of plans sampled by chain.py.
+
+Each plan is kept as its unit-to-district assignment vector (int8, or int16
+for more than 127 districts) rather than as geometry. Plans are written in
+chunks of consecutive chain steps. Within a chunk, every plan after the
+first is stored as its difference from the previous one, which is zero
+except for the few units the step moved, and the chunk is compressed with
+zlib, so a step costs a few bytes. Alongside the assignments, each plan has a
+row of summary columns (population deviation, BVAP share and vote shares of
+every district, and Polsby-Popper scores when a boundary index is given),
+named by district number, e.g. bvap_71.
+
+A store is a directory:
+
+    meta.json -- units, districts, chunk size and number of plans
+    assignments.bin -- the compressed chunks, one after another
+    offsets.npy -- byte offset of each chunk in assignments.bin
+    summary.feather -- the summary columns, one row per plan
+
+Reading memory-maps assignments.bin and summary.feather, so a plan is found
+by decompressing only its chunk, and filters read only the summary columns
+they name:
+
+    ensemble = Ensemble('ensembles/enacted')
+    plan = ensemble[12345]
+    for indices, assignments in ensemble.scan('bvap_71 > 0.5'):
+        ...
+    districts = ensemble.plan(12345, precincts)
+
+Run as a script to sample plans from the enacted map into a store:
+
+    python Analysis/Ensemble/store.py <steps> <store directory> [recom|flip]
+
+"""
+
+import json
+import mmap
+import os
+import re
+import sys
+import zlib
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Compactness'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Elections'))
+import balance
+import boundary_index as bi
+import chain
+import fairness
+import plans
+
+
+def _dtype(n_districts):
+    return np.dtype(np.int8 if n_districts <= 127 else np.int16)
+
+
+def _encode(rows, level):
+    """Compress a chunk of consecutive plans, each after the first as its difference from the one before"""
+
+    deltas = rows.copy()
+    deltas[1:] -= rows[:-1]
+    return zlib.compress(deltas.tobytes(), level)
+
+
+def _decode(data, dtype, n_units):
+    deltas = np.frombuffer(zlib.decompress(data), dtype=dtype).reshape(-1, n_units)
+    # integer overflow wraps, so the running sum undoes the differences exactly
+    return np.cumsum(deltas, axis=0, dtype=dtype)
+
+
+class Summarizer:
+    """
+    Summary columns of chunks of plans, for EnsembleWriter.
+
+    Keyword arguments:
+        labels -- district number of each district code
+        population -- population of each unit
+        values -- DataFrame of unit values with the BVAP and VAP columns
+            and the vote columns of fairness.elections that are present
+        index -- boundary index of the units, for Polsby-Popper scores;
+            left out if None
+        ideal -- ideal district population; the mean district population
+            if None
+    """
+
+    def __init__(self, labels, population, values, index=None, ideal=None):
+        self.labels = np.asarray(labels)
+        self.population = np.asarray(population, dtype=float)
+        self.ideal = self.population.sum() / len(self.labels) if ideal is None else ideal
+        self.pairs = [pair for pair in fairness.elections.values() if set(pair) <= set(values.columns)]
+        columns = ['BVAP', 'VAP'] + [c for pair in self.pairs for c in pair]
+        # population, then BVAP, VAP and the candidate pairs
+        self.values = np.column_stack([self.population, values[columns].fillna(0).values.astype(float)])
+        self.index = index
+
+    def __call__(self, assignments):
+        k = len(self.labels)
+        totals = fairness.district_votes(assignments, self.values, k)
+        out = {'deviation': np.abs(totals[:, 0] - self.ideal).max(axis=1) / self.ideal}
+        out.update({f'bvap_{d}': v for d, v in zip(self.labels, (totals[:, 1] / totals[:, 2]).T)})
+        for e, (c1, c2) in enumerate(self.pairs):
+            shares = fairness.vote_shares(totals[:, 3 + 2 * e], totals[:, 4 + 2 * e])
+            out.update({f'{c1}_{d}': v for d, v in zip(self.labels, shares.T)})
+        if self.index is not None:
+            area = bi.discrete_area(self.index, assignments, k)
+            perimeter = bi.discrete_perimeter(self.index, assignments, k)
+            out.update({f'pp_{d}': v for d, v in zip(self.labels, (4 * np.pi * area / perimeter ** 2).T)})
+        return pd.DataFrame({c: np.asarray(v, dtype=np.float32) for c, v in out.items()})
+
+
+class EnsembleWriter:
+    """
+    Writes plans to a new store at path.
+
+    Keyword arguments:
+        path -- store directory; created, and must not already hold a store
+        labels -- district number of each district code
+        n_units -- number of units in each assignment
+        summarize -- function of a (plans, units) array of district codes
+            returning a DataFrame of summary columns, one row per plan
+            (e.g. a Summarizer); no summary is written if None
+        chunk -- plans per compressed chunk
+        level -- zlib compression level
+
+    Use as a context manager, or call close() when done; meta.json is only
+    written by close(), which the context manager skips if an exception is
+    raised, so an interrupted store cannot be opened.
+    """
+
+    def __init__(self, path, labels, n_units, summarize=None, chunk=4096, level=6):
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            raise FileExistsError(f'{path} already holds an ensemble')
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.labels = np.asarray(labels)
+        self.n_units = n_units
+        self.dtype = _dtype(len(self.labels))
+        self.summarize = summarize
+        self.chunk = chunk
+        self.level = level
+        self.n_plans = 0
+        self.offsets = [0]
+        self._rows = np.empty((chunk, n_units), dtype=self.dtype)
+        self._pending = 0
+        self._data = open(os.path.join(path, 'assignments.bin'), 'wb')
+        self._summary = None
+
+    def append(self, assignment):
+        """Add one plan, given as the district code of each unit"""
+
+        self._rows[self._pending] = assignment
+        self._pending += 1
+        if self._pending == self.chunk:
+            self._flush()
+
+    def extend(self, assignments):
+        """Add the plans of a (plans, units) array of district codes"""
+
+        for assignment in assignments:
+            self.append(assignment)
+
+    def _flush(self):
+        if not self._pending:
+            return
+        rows = self._rows[:self._pending]
+        self._data.write(_encode(rows, self.level))
+        self.offsets.append(self._data.tell())
+        if self.summarize is not None:
+            table = pa.Table.from_pandas(self.summarize(rows), preserve_index=False)
+            if self._summary is None:
+                self._summary = pa.ipc.new_file(os.path.join(self.path, 'summary.feather'), table.schema)
+            self._summary.write_table(table)
+        self.n_plans += self._pending
+        self._pending = 0
+
+    def _close_files(self):
+        self._data.close()
+        if self._summary is not None:
+            self._summary.close()
+
+    def close(self):
+        self._flush()
+        self._close_files()
+        np.save(os.path.join(self.path, 'offsets.npy'), np.array(self.offsets, dtype=np.int64))
+        meta = {'n_plans': self.n_plans, 'n_units': self.n_units, 'chunk': self.chunk,
+                'dtype': self.dtype.name, 'labels': self.labels.tolist()}
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            # no meta.json, so Ensemble refuses the incomplete store
+            self._close_files()
+
+
+class Ensemble:
+    """
+    A store written by EnsembleWriter, opened for reading.
+
+    Keyword arguments:
+        path -- store directory
+
+    ensemble[i] is the district codes of plan i (a 1-D array), and
+    ensemble[indices] those of several plans as a (plans, units) array;
+    labels gives the district number of each code.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.n_plans, self.n_units, self.chunk = meta['n_plans'], meta['n_units'], meta['chunk']
+        self.dtype = np.dtype(meta['dtype'])
+        self.labels = np.array(meta['labels'])
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        with open(os.path.join(path, 'assignments.bin'), 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b''
+        summary_path = os.path.join(path, 'summary.feather')
+        self._summary = feather.read_table(summary_path, memory_map=True) if os.path.exists(summary_path) else None
+        self._chunk_cache = (None, None)
+
+    def __len__(self):
+        return self.n_plans
+
+    def _chunk(self, c):
+        """Decoded plans of chunk c, keeping the last chunk decoded"""
+
+        if self._chunk_cache[0] != c:
+            self._chunk_cache = (c, _decode(self._data[self.offsets[c]:self.offsets[c + 1]],
+                                            self.dtype, self.n_units))
+        return self._chunk_cache[1]
+
+    def __getitem__(self, i):
+        if np.isscalar(i):
+            i = int(i) + (self.n_plans if i < 0 else 0)
+            if not 0 <= i < self.n_plans:
+                raise IndexError(f'plan {i} out of range for {self.n_plans} plans')
+            return self._chunk(i // self.chunk)[i % self.chunk]
+        indices = np.arange(self.n_plans)[i]
+        out = np.empty((len(indices), self.n_units), dtype=self.dtype)
+        chunks = indices // self.chunk
+        for c in np.unique(chunks):
+            rows = chunks == c
+            out[rows] = self._chunk(c)[indices[rows] % self.chunk]
+        return out
+
+    @property
+    def columns(self):
+        """Names of the summary columns"""
+
+        return [] if self._summary is None else self._summary.column_names
+
+    def summary(self, columns=None):
+        """The summary columns (all if columns is None) as a DataFrame, one row per plan"""
+
+        if self._summary is None:
+            raise ValueError(f'{self.path} has no summary columns')
+        table = self._summary if columns is None else self._summary.select(list(columns))
+        return table.to_pandas()
+
+    def summary_batches(self, columns=None):
+        """Yield the summary columns (all if columns is None) as DataFrames, one chunk of plans at a time"""
+
+        if self._summary is None:
+            raise ValueError(f'{self.path} has no summary columns')
+        table = self._summary if columns is None else self._summary.select(list(columns))
+        for batch in table.to_batches():
+            yield batch.to_pandas()
+
+    def query(self, expr):
+        """
+        Return the indices of the plans whose summary satisfies expr, a
+        pandas eval expression over the summary columns such as
+        'bvap_71 > 0.5 and deviation < 0.005'. Only the columns named in
+        expr are read.
+        """
+
+        names = set(re.findall(r'[A-Za-z_]\w*', expr))
+        df = self.summary([c for c in self.columns if c in names])
+        return np.flatnonzero(df.eval(expr).values)
+
+    def scan(self, expr=None, batch=None):
+        """
+        Yield (indices, assignments) for the plans satisfying expr (all
+        plans if None), in order, one chunk (or batch plans) at a time;
+        chunks without a matching plan are not decompressed.
+        """
+
+        indices = np.arange(self.n_plans) if expr is None else self.query(expr)
+        batch = batch or self.chunk
+        chunks = indices // self.chunk
+        bounds = np.flatnonzero(np.diff(chunks)) + 1
+        for group in np.split(indices, bounds):
+            for start in range(0, len(group), batch):
+                part = group[start:start + batch]
+                if len(part):
+                    yield part, self._chunk(part[0] // self.chunk)[part % self.chunk]
+
+    def plan(self, i, units):
+        """
+        Return plan i as a GeoDataFrame of districts with a district_no
+        column, like plans.load_plan, by dissolving units.
+
+        Keyword arguments:
+            i -- index of the plan
+            units -- GeoDataFrame of the units the plans assign, in the
+                order of the assignment vectors
+        """
+
+        codes = self[i]
+        inside = codes >= 0
+        df = gpd.GeoDataFrame({plans.common_colname: self.labels[codes[inside]]},
+                              geometry=np.asarray(units.geometry)[inside], crs=units.crs)
+        return df.dissolve(by=plans.common_colname).reset_index()
+
+
+if __name__ == '__main__':
+    steps = int(sys.argv[1])
+    out_path = sys.argv[2]
+    proposal = sys.argv[3] if len(sys.argv) > 3 else 'recom'
+
+    precincts = plans.read_file(chain.precincts_path)
+    index = bi.boundary_index(precincts, plans.cache_path([chain.precincts_path], '.npz', 'boundary index'))
+    # the enacted map is balanced on total population, not on VAP
+    sampler = chain.from_precincts(balance.balance_precincts(precincts, index[0]), index=index, seed=0)
+    summarize = Summarizer(sampler.labels, sampler.unit_population, precincts, index)
+    with EnsembleWriter(out_path, sampler.labels, len(precincts), summarize) as writer:
+        for state in sampler.run(steps, proposal):
+            writer.append(state.assignment)
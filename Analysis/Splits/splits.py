@@ -0,0 +1,306 @@
+"""
+splits: How plans split counties and independent cities (localities), and
+precincts.
+
+The reform map is described as better preserving cities and counties, and
+step 4 of the process in the README is to split as few precincts as
+practicable; this module measures both. A LocalityIndex maps each unit
+(precinct or census block) to a small int locality code once, from the
+precincts' locality column or the blocks' COUNTYFP10 FIPS code. Scoring a
+plan is then a bincount of unit counts and populations over (locality,
+district) pairs:
+
+    split_localities -- localities whose units fall in more than one
+        district
+    pieces -- (locality, district) pairs with at least one unit, i.e. the
+        number of locality pieces the plan cuts the study area into
+    split_entropy -- entropy, in bits, of the district of a resident given
+        their locality, weighted by locality population; 0 when no locality
+        is split
+
+Plans are int arrays of district codes of shape (units,) or (plans, units),
+so one call scores a single step of a plan search or all six submitted
+plans.
+
+A PrecinctIndex is the same index with census blocks (read around the
+precincts only) as the units and precincts in place of localities. The
+block-to-precinct codes and each plan's block-to-district codes are computed
+once by AssignmentIndex and cached as int arrays (block_codes), so counting
+split precincts and the population on each side of every split
+(split_sides) needs no further polygon overlays.
+
+Run as a script to compare the submitted plans on the precincts, and, given
+an output path, to write the sides of every precinct split by each plan:
+
+    python Analysis/Splits/splits.py [<precinct splits .csv>]
+
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import assignment as asg
+import census
+import plans
+
+precincts_path = 'Maps/Affected and adjacent precincts with BVAP/BH_precincts_with_BVAP_VAP.shp'
+census_blocks = '/mapping/VA/2010 Census/Census Blocks with Population/tabblock2010_51_pophu.shp'
+block_pop_col = 'POP10'
+
+# locality columns of the precinct and census block files, in order of preference
+locality_columns = ['COUNTYFP10', 'locality']
+
+# (locality, district) cells tallied per pass, bounding the size of temporaries
+_CELLS = 1 << 22
+
+
+def _locality_column(units):
+    for column in locality_columns:
+        if column in units.columns:
+            return column
+    raise ValueError(f'units have none of the locality columns {locality_columns}')
+
+
+class LocalityIndex:
+    """
+    Unit-to-locality index, reusable across plans.
+
+    Keyword arguments:
+        locality -- locality of each unit (name or FIPS code)
+        population -- population of each unit, weighting split_entropy;
+            unit counts if None
+
+    codes holds the locality code of each unit (negative for units in no
+    locality, which are left out) and names the locality of each code.
+    """
+
+    def __init__(self, locality, population=None):
+        self.codes, self.names = pd.factorize(pd.Series(np.asarray(locality)).astype(str), sort=True)
+        self.codes = self.codes.astype(np.int32)
+        self.n_localities = len(self.names)
+        self.population = (np.ones(len(self.codes)) if population is None
+                           else np.asarray(population, dtype=float))
+
+    @classmethod
+    def from_units(cls, units, population_col=None):
+        """LocalityIndex of the units of a (Geo)DataFrame, from its COUNTYFP10 or locality column"""
+
+        population = None if population_col is None else units[population_col].fillna(0).values
+        return cls(units[_locality_column(units)].values, population)
+
+    def tally(self, assignment, n_districts=None, weights=None):
+        """
+        Return the units (or the sum of weights) of each locality in each
+        district, as an array of shape (localities, districts) for one plan
+        or (plans, localities, districts) for many.
+
+        Keyword arguments:
+            assignment -- int array of district codes (negative for units
+                outside every district), of shape (units,) or (plans, units)
+            n_districts -- number of districts; inferred from assignment if None
+            weights -- weight of each unit; unit counts if None
+        """
+
+        assignment = np.asarray(assignment)
+        codes = np.atleast_2d(assignment)
+        if n_districts is None:
+            n_districts = codes.max() + 1
+        # row n_localities holds the units in no locality, and column
+        # n_districts the units outside every district
+        rows = np.where(self.codes < 0, self.n_localities, self.codes)
+        cells = (self.n_localities + 1) * (n_districts + 1)
+        chunk = max(1, _CELLS // cells)
+        out = np.empty((len(codes), self.n_localities, n_districts))
+        for start in range(0, len(codes), chunk):
+            block = codes[start:start + chunk]
+            bins = (rows * (n_districts + 1) + np.where(block < 0, n_districts, block)
+                    + (np.arange(len(block)) * cells)[:, None])
+            w = None if weights is None else np.broadcast_to(weights, bins.shape).ravel()
+            counts = np.bincount(bins.ravel(), weights=w, minlength=len(block) * cells)
+            out[start:start + chunk] = counts.reshape(len(block), self.n_localities + 1,
+                                                      n_districts + 1)[:, :-1, :-1]
+        return out[0] if assignment.ndim == 1 else out
+
+    def districts_per_locality(self, assignment, n_districts=None):
+        """Number of districts each locality's units fall in; shape (localities,) or (plans, localities)"""
+
+        return (self.tally(assignment, n_districts) > 0).sum(axis=-1)
+
+    def split_localities(self, assignment, n_districts=None):
+        """Number of split localities; a scalar or shape (plans,)"""
+
+        return (self.districts_per_locality(assignment, n_districts) > 1).sum(axis=-1)
+
+    def pieces(self, assignment, n_districts=None):
+        """Number of (locality, district) pieces; a scalar or shape (plans,)"""
+
+        return self.districts_per_locality(assignment, n_districts).sum(axis=-1)
+
+    def split_entropy(self, assignment, n_districts=None):
+        """Population-weighted entropy of district given locality, in bits; a scalar or shape (plans,)"""
+
+        population = self.tally(assignment, n_districts, self.population)
+        locality = population.sum(axis=-1, keepdims=True)
+        # -log2 of each district's share of its locality's population
+        bits = np.log2(np.divide(locality, population, out=np.ones_like(population), where=population > 0))
+        total = locality.sum(axis=(-2, -1))
+        return (population * bits).sum(axis=(-2, -1)) / np.where(total > 0, total, 1)
+
+    def table(self, assignment, n_districts=None, plan_names=None):
+        """
+        Return a data frame with one row per plan of its split localities,
+        pieces and split entropy.
+
+        Keyword arguments:
+            assignment -- int array of district codes of shape (plans, units)
+            n_districts -- number of districts; inferred from assignment if None
+            plan_names -- plan names; positions if None
+        """
+
+        codes = np.atleast_2d(assignment)
+        if n_districts is None:
+            n_districts = codes.max() + 1
+        counts = self.tally(codes, n_districts) > 0
+        per_locality = counts.sum(axis=-1)
+        return pd.DataFrame({'plan': np.arange(len(codes)) if plan_names is None else list(plan_names),
+                             'split_localities': (per_locality > 1).sum(axis=-1),
+                             'pieces': per_locality.sum(axis=-1),
+                             'split_entropy': self.split_entropy(codes, n_districts)})
+
+    def split_sides(self, assignment, n_districts=None, plan_names=None, district_names=None):
+        """
+        Return a data frame with one row per side of every split locality
+        of every plan: the plan, locality, district, units and population
+        of that side.
+
+        Keyword arguments:
+            assignment -- int array of district codes of shape (plans, units)
+            n_districts -- number of districts; inferred from assignment if None
+            plan_names -- plan names; positions if None
+            district_names -- district name of each code of each plan, of
+                shape (plans, n_districts); codes if None
+        """
+
+        codes = np.atleast_2d(assignment)
+        if n_districts is None:
+            n_districts = codes.max() + 1
+        units = self.tally(codes, n_districts)
+        population = self.tally(codes, n_districts, self.population)
+        split = (units > 0).sum(axis=-1) > 1
+        plan, locality, district = np.nonzero((units > 0) & split[..., None])
+        plan_names = np.arange(len(codes)) if plan_names is None else np.asarray(plan_names)
+        district_names = (np.broadcast_to(np.arange(n_districts), (len(codes), n_districts))
+                          if district_names is None else np.asarray(district_names))
+        return pd.DataFrame({'plan': plan_names[plan],
+                             'locality': np.asarray(self.names)[locality],
+                             'district': district_names[plan, district],
+                             'units': units[plan, locality, district].astype(int),
+                             'population': population[plan, locality, district]})
+
+
+class PrecinctIndex(LocalityIndex):
+    """
+    Block-to-precinct index, reusable across plans: a LocalityIndex of
+    census blocks with precincts as the localities.
+
+    Keyword arguments:
+        block_precinct -- precinct code of each block (negative for blocks
+            outside every precinct)
+        names -- name of each precinct
+        population -- population of each block
+    """
+
+    def __init__(self, block_precinct, names, population=None):
+        self.codes = np.asarray(block_precinct, dtype=np.int32)
+        self.names = pd.Index(names)
+        self.n_localities = len(self.names)
+        self.population = (np.ones(len(self.codes)) if population is None
+                           else np.asarray(population, dtype=float))
+
+    @classmethod
+    def from_blocks(cls, blocks, precincts, block_precinct=None, population_col=block_pop_col):
+        """
+        PrecinctIndex of blocks, a GeoDataFrame with a population column,
+        and precincts, a GeoDataFrame with locality and precinct columns;
+        block_precinct is computed with AssignmentIndex if None.
+        """
+
+        if block_precinct is None:
+            block_precinct = asg.AssignmentIndex(blocks).assign(precincts)
+        names = precincts['locality'].astype(str) + ' ' + precincts['precinct'].astype(str)
+        return cls(block_precinct, names.values, blocks[population_col].fillna(0).values)
+
+    def split_precincts(self, assignment, n_districts=None):
+        """Number of split precincts; a scalar or shape (plans,)"""
+
+        return self.split_localities(assignment, n_districts)
+
+
+def plan_codes(units, plan_paths):
+    """
+    Return the district codes of units under each plan, as an int array of
+    shape (plans, units) with -1 for units outside every district.
+
+    Keyword arguments:
+        units -- GeoDataFrame of units
+        plan_paths -- list of (path, district column) of the plan shapefiles
+    """
+
+    index = asg.AssignmentIndex(units)
+    return np.stack([index.assign(plans.load_plan(path, colname)) for path, colname in plan_paths])
+
+
+def block_codes(blocks_path, zone_paths, regions=None):
+    """
+    Return the codes of the census blocks of census.read_blocks(blocks_path,
+    regions) under each zoning in zone_paths (precincts, or plans given as
+    (path, district column)), as an int32 array of shape (zonings, blocks).
+    Each zoning's codes are cached under Analysis/.cache until either file
+    or the region's bounds change, so the spatial index over the blocks is
+    only built on a miss.
+    """
+
+    bounds = None if regions is None else census.region_bounds(regions)
+    index = []
+
+    def assign(zones):
+        if not index:
+            index.append(asg.AssignmentIndex(census.read_blocks(blocks_path, regions)))
+        return index[0].assign(zones)
+
+    out = []
+    for zone in zone_paths:
+        if isinstance(zone, str):
+            out.append(plans.cached_array([blocks_path, zone], lambda: assign(plans.read_file(zone)),
+                                          'codes', bounds))
+        else:
+            path, colname = zone
+            out.append(plans.cached_array([blocks_path, path], lambda: assign(plans.load_plan(path, colname)),
+                                          'codes', bounds, colname, sorted(plans.bh)))
+    return np.stack(out)
+
+
+if __name__ == '__main__':
+    import run_analyses as ra
+
+    plan_names = [m['name'] for m in ra.maps.values()]
+    plan_paths = [(m['path'], m['district_colname']) for m in ra.maps.values()]
+    district_names = np.stack([plans.load_plan(path, colname)[plans.common_colname].values
+                               for path, colname in plan_paths])
+
+    precincts = plans.read_file(precincts_path)
+    index = LocalityIndex.from_units(precincts, 'VAP')
+    table = index.table(plan_codes(precincts, plan_paths), len(plans.bh), plan_names)
+
+    if len(sys.argv) > 1:
+        codes = block_codes(census_blocks, [precincts_path] + plan_paths, precincts)
+        blocks = census.read_blocks(census_blocks, precincts)
+        precinct_index = PrecinctIndex.from_blocks(blocks, precincts, codes[0])
+        table['split_precincts'] = precinct_index.split_precincts(codes[1:], len(plans.bh))
+        precinct_index.split_sides(codes[1:], len(plans.bh), plan_names, district_names).rename(
+            columns={'locality': 'precinct', 'units': 'blocks'}).to_csv(sys.argv[1], index=False)
+
+    print(table.to_string(index=False))
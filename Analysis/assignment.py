@@ -0,0 +1,146 @@
+"""
+assignment: Assign small units (census blocks, precincts) to the districts of
+a plan, and total unit data by district.
+
+This replaces areal_interpolation.aggregate(..., method='greatest_area'),
+which overlays every unit against every district of each plan. An
+AssignmentIndex is built once per unit geography; assigning a plan then only
+needs point-in-polygon tests for the representative point of each unit, plus
+intersection areas for the few units that straddle a district boundary. The
+result is an int32 array giving the district of each unit, and totals per
+district are a single bincount.
+
+For method='fractional_area' interpolation, weights() builds a sparse
+unit-by-district matrix of area fractions instead, and interpolate() pushes
+any number of data columns through it in one sparse-dense product.
+
+"""
+
+import numpy as np
+import scipy.sparse as sp
+import shapely
+
+
+class AssignmentIndex:
+    """
+    Spatial index over a set of units, reusable across plans.
+
+    Keyword arguments:
+        units -- GeoSeries or GeoDataFrame of unit geometries
+    """
+
+    def __init__(self, units):
+        self.crs = units.crs
+        self.geoms = np.asarray(units.geometry)
+        self.tree = shapely.STRtree(self.geoms)
+        self.points = shapely.point_on_surface(self.geoms)
+        self.point_tree = shapely.STRtree(self.points)
+
+    def __len__(self):
+        return len(self.geoms)
+
+    def assign(self, districts):
+        """
+        Return the position in districts of the district containing the
+        greatest area of each unit, as an int32 array (-1 where a unit does
+        not overlap any district).
+
+        Keyword arguments:
+            districts -- GeoSeries or GeoDataFrame of district geometries;
+                reprojected to the units' CRS if necessary
+        """
+
+        shapes = self._district_shapes(districts)
+        out = np.full(len(self.geoms), -1, dtype=np.int32)
+
+        # units lying inside a district: the one containing the unit's point
+        district, unit = self.point_tree.query(shapes, predicate='contains')
+        out[unit] = district
+
+        straddling, unit, district, overlap = self._overlaps(shapes)
+        if len(straddling):
+            order = np.lexsort((-overlap, unit))
+            first = np.unique(unit[order], return_index=True)[1]
+            best = order[first]
+            best = best[overlap[best] > 0]
+            out[straddling[unit[best]]] = district[best]
+
+        return out
+
+    def weights(self, districts):
+        """
+        Return a sparse (units x districts) CSR matrix whose (i, j) entry is
+        the fraction of unit i's area that lies in district j.
+
+        Keyword arguments:
+            districts -- GeoSeries or GeoDataFrame of district geometries;
+                reprojected to the units' CRS if necessary
+        """
+
+        shapes = self._district_shapes(districts)
+
+        district, unit = self.point_tree.query(shapes, predicate='contains')
+        straddling, s_unit, s_district, overlap = self._overlaps(shapes)
+        inside = ~np.isin(unit, straddling)
+        unit_area = shapely.area(self.geoms[straddling])
+        fraction = np.divide(overlap, unit_area[s_unit], out=np.zeros(len(overlap)),
+                             where=unit_area[s_unit] > 0)
+
+        rows = np.concatenate([unit[inside], straddling[s_unit]])
+        cols = np.concatenate([district[inside], s_district])
+        data = np.concatenate([np.ones(inside.sum()), fraction])
+        keep = data > 0
+        return sp.csr_matrix((data[keep], (rows[keep], cols[keep])),
+                             shape=(len(self.geoms), len(shapes)))
+
+    def _district_shapes(self, districts):
+        if self.crs is not None and districts.crs is not None and districts.crs != self.crs:
+            districts = districts.to_crs(self.crs)
+        return np.asarray(districts.geometry)
+
+    def _overlaps(self, shapes):
+        """
+        Find the units whose interior meets a district boundary. Returns
+        (straddling, unit, district, overlap): the straddling units and, for
+        each pair of straddling unit (as a position in straddling) and
+        district that intersect, their area of overlap.
+        """
+
+        boundaries = shapely.boundary(shapes)
+        district, unit = self.tree.query(boundaries, predicate='intersects')
+        straddling = np.unique(unit[~shapely.touches(boundaries[district], self.geoms[unit])])
+        unit, district = shapely.STRtree(shapes).query(self.geoms[straddling], predicate='intersects')
+        overlap = shapely.area(shapely.intersection(self.geoms[straddling][unit], shapes[district]))
+        return straddling, unit, district, overlap
+
+
+def interpolate(weights, values):
+    """
+    Return district totals of unit values distributed by area fraction.
+
+    Keyword arguments:
+        weights -- sparse matrix from AssignmentIndex.weights
+        values -- array of shape (units,) or (units, columns)
+    """
+
+    return weights.T @ np.asarray(values, dtype=float)
+
+
+def tally(assignment, values, n_districts):
+    """
+    Return totals of values per district.
+
+    Keyword arguments:
+        assignment -- int array of district positions per unit, -1 for none
+        values -- array of shape (units,) or (units, columns)
+        n_districts -- number of districts
+
+    Returns an array of shape (n_districts,) or (n_districts, columns).
+    """
+
+    values = np.asarray(values, dtype=float)
+    inside = assignment >= 0
+    if values.ndim == 1:
+        return np.bincount(assignment[inside], weights=values[inside], minlength=n_districts)
+    return np.column_stack([np.bincount(assignment[inside], weights=column[inside], minlength=n_districts)
+                            for column in values.T])
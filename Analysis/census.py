@@ -0,0 +1,143 @@
+"""
+census: Ingest of the 2010 Census block data used to compute BVAP.
+
+The NHGIS block-level race table (P10, Race for the Population 18 and Over)
+covers every block in Virginia and has hundreds of columns, plus a second
+header row of column descriptions. read_block_race streams only the columns
+we use (GISJOIN, H74004 = BVAP, H74001 = VAP) in chunks with int32 dtypes,
+skipping the description row while parsing. It stores the result in the
+plans cache as a compact table sorted by an int64 block key, so later runs
+load a few megabytes instead of re-parsing the CSV.
+
+The TIGER block shapefile likewise covers the whole state. read_blocks reads
+only the blocks intersecting the bounding box of a study region (e.g. the 33
+districts of every plan) and only the attribute columns we use, letting
+GDAL skip the rest of the file (using its spatial index, if the shapefile
+has one), so memory and load time scale with the region rather than the
+state.
+
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pyogrio
+
+import plans
+
+# column codes
+bvap = 'H74004'
+vap = 'H74001'
+
+_CHUNKSIZE = 200000
+
+# TIGER block columns we use: the GISJOIN parts and total population
+block_columns = ['STATEFP10', 'COUNTYFP10', 'TRACTCE10', 'BLOCKCE', 'POP10']
+
+
+def gisjoin(blocks):
+    """
+    Return NHGIS GISJOIN identifiers for census blocks as a string Series.
+
+    Keyword arguments:
+        blocks -- DataFrame with TIGER STATEFP10, COUNTYFP10, TRACTCE10 and
+            BLOCKCE columns
+    """
+
+    return ('G' + blocks['STATEFP10'].astype(str)
+            + blocks['COUNTYFP10'].astype(str).str.zfill(4)
+            + blocks['TRACTCE10'].astype(str).str.zfill(7)
+            + blocks['BLOCKCE'].astype(str).str.zfill(4))
+
+
+def region_bounds(regions, crs=None):
+    """
+    Return the bounding box (minx, miny, maxx, maxy) of the union of
+    regions, a GeoSeries or GeoDataFrame or a list of them, in crs (that of
+    the regions if None).
+    """
+
+    if not isinstance(regions, (list, tuple)):
+        regions = [regions]
+    bounds = np.array([(r if crs is None or r.crs is None else r.to_crs(crs)).total_bounds for r in regions])
+    return tuple(float(b) for b in np.concatenate([bounds[:, :2].min(axis=0), bounds[:, 2:].max(axis=0)]))
+
+
+def read_blocks(path, regions=None, columns=block_columns):
+    """
+    Return the census blocks of the shapefile at path, from the plans cache.
+
+    Keyword arguments:
+        path -- TIGER block shapefile
+        regions -- GeoSeries or GeoDataFrame (or list of them) of the study
+            region, e.g. the districts of each plan; only blocks
+            intersecting the bounding box of all of them are read. All
+            blocks if None
+        columns -- attribute columns to read
+    """
+
+    kwargs = {'columns': list(columns)}
+    if regions is not None:
+        kwargs['bbox'] = region_bounds(regions, pyogrio.read_info(path)['crs'])
+    return plans.read_file(path, **kwargs)
+
+
+def gisjoin_key(gisjoins):
+    """Return int64 keys for GISJOIN strings (the 17 digits after the 'G')"""
+
+    return pd.Series(gisjoins).str[1:].astype(np.int64).values
+
+
+def _read_csv(path):
+    keys = []
+    values = []
+    reader = pd.read_csv(path, usecols=['GISJOIN', bvap, vap], skiprows=[1],
+                         dtype={'GISJOIN': str, bvap: np.int32, vap: np.int32},
+                         chunksize=_CHUNKSIZE)
+    for chunk in reader:
+        keys.append(gisjoin_key(chunk['GISJOIN']))
+        values.append(chunk[[bvap, vap]].values)
+    keys = np.concatenate(keys)
+    values = np.concatenate(values)
+    order = np.argsort(keys, kind='stable')
+    return keys[order], values[order]
+
+
+def read_block_race(path):
+    """
+    Return (keys, values) for the NHGIS block race table at path: sorted
+    int64 block keys (see gisjoin_key) and an int32 array of BVAP and VAP
+    columns, read from the plans cache when the CSV is unchanged.
+    """
+
+    cache_path = plans.cache_path([path], '.npz', 'block_race', bvap, vap)
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as f:
+            return f['keys'], f['values']
+
+    keys, values = _read_csv(path)
+    os.makedirs(plans.cache_dir, exist_ok=True)
+    tmp_path = cache_path + f'.{os.getpid()}.tmp.npz'
+    np.savez(tmp_path, keys=keys, values=values)
+    os.replace(tmp_path, cache_path)
+    return keys, values
+
+
+def join_block_race(blocks, race):
+    """
+    Return the blocks that appear in the race table, with BVAP and VAP
+    columns added.
+
+    Keyword arguments:
+        blocks -- (Geo)DataFrame of census blocks, as for gisjoin
+        race -- (keys, values) from read_block_race
+    """
+
+    keys, values = race
+    block_keys = gisjoin_key(gisjoin(blocks))
+    pos = np.minimum(np.searchsorted(keys, block_keys), len(keys) - 1)
+    found = keys[pos] == block_keys
+    blocks = blocks[found].copy()
+    blocks['BVAP'] = values[pos[found], 0]
+    blocks['VAP'] = values[pos[found], 1]
+    return blocks
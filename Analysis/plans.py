@@ -0,0 +1,277 @@
+"""
+plans: Shared loading of the district plan shapefiles under Maps/.
+
+Every analysis script reads the same plans, listed once in maps, renames each
+plan's district column to district_no and keeps the 33 Bethune-Hill
+districts. load_plan does that once per shapefile and caches the result as
+an uncompressed Feather file (WKB geometry) under Analysis/.cache, keyed by
+the source file's path, size and modification time. Later runs memory-map
+the cached file instead of parsing the DBF/SHP again. read_file caches any
+other vector file (e.g. the statewide census blocks) the same way;
+cached_frame, cached_matrix and cached_array cache data frames, sparse
+matrices and arrays derived from one or more source files.
+
+dissolve_plan merges the districts of a plan outside a given set into one
+polygon. That result is cached next to the plan shapefile itself, keyed by a
+hash of the shapefile's contents, together with a simplified copy for
+display.
+
+"""
+
+import glob
+import hashlib
+import os
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import shapely
+
+# identify relevant districts
+affected = [63, 69, 70, 71, 74, 77, 80, 89, 90, 92, 95]
+adjacent = [27, 55, 61, 62, 64, 66, 68, 72, 73, 75, 76, 78, 79, 81, 83, 85,
+            91, 93, 94, 96, 97, 100]
+bh = affected + adjacent
+
+# the plans compared by every analysis: display name, shapefile and district
+# number column, and whether the interactive map shows the plan at first
+maps = {'reform': {'name': 'PGP Reform map',
+                   'path': 'Maps/Reform map/Districts map bethune-hill final.shp',
+                   'district_colname': 'DISTRICT',
+                   'show': True},
+        'enacted': {'name': 'Enacted map',
+                    'path': 'Maps/Enacted map/enacted.shp',
+                    'district_colname': 'ID',
+                    'show': False},
+        'dems':    {'name': 'VA House Dems map',
+                    'path': 'Maps/House Dems map/HB7001.shp',
+                    'district_colname': 'OBJECTID',
+                    'show': False},
+# =============================================================================
+#         'gop_bell1':     {'name': 'VA House GOP (Bell 1)',
+#                     'path': 'Maps/GOP map bell/HB7002_shapefile.shp',
+#                     'district_colname': 'OBJECTID',
+#                     'show': False},
+# =============================================================================
+        'gop_bell2':     {'name': 'VA House GOP (Bell)',
+                    'path': 'Maps/GOP map bell substitute/HB7002_ANS.shp',
+                    'district_colname': 'OBJECTID',
+                    'show': False},
+        'gop_jones':    {'name': 'VA House GOP (Jones)',
+                    'path': 'Maps/GOP map jones/HB7003.shp',
+                    'district_colname': 'OBJECTID',
+                    'show': False},
+        'new_VA':    {'name': 'New VA Majority',
+                    'path': 'Maps/New VA Majority/VA NVM Map Submission 20180926.shp',
+                    'district_colname': 'District',
+                    'show': False}
+        }
+
+common_colname = 'district_no'
+
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+
+# shapefile components whose changes should invalidate a cached read
+_SIDECARS = ['.shp', '.dbf', '.shx', '.prj', '.cpg']
+
+
+def _sidecars(path):
+    """path and whichever of its shapefile sidecar files exist"""
+
+    root, ext = os.path.splitext(path)
+    sidecars = [root + s for s in _SIDECARS + [s.upper() for s in _SIDECARS]]
+    return [path] + [s for s in sidecars if s != root + ext and os.path.exists(s)]
+
+
+def _content_key(path, *extra):
+    """Hash of the contents of path and its sidecar files, plus extra"""
+
+    h = hashlib.sha1()
+    for candidate in _sidecars(path):
+        with open(candidate, 'rb') as f:
+            h.update(os.path.splitext(candidate)[1].lower().encode())
+            h.update(hashlib.sha1(f.read()).digest())
+    h.update(repr(extra).encode())
+    return h.hexdigest()
+
+
+def _source_key(path, *extra):
+    """Hash of path, size and mtime of path and its sidecar files, plus extra"""
+
+    parts = [os.path.abspath(path)]
+    for candidate in _sidecars(os.path.abspath(path)):
+        if os.path.exists(candidate):
+            st = os.stat(candidate)
+            parts.append(f'{candidate}:{st.st_size}:{st.st_mtime_ns}')
+    parts.extend(repr(e) for e in extra)
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+
+
+def _paths_key(paths, extra):
+    return hashlib.sha1(''.join(_source_key(p) for p in paths).encode()
+                        + repr(extra).encode()).hexdigest()
+
+
+def _cached(key, build):
+    """Return the GeoDataFrame cached under key, building and caching it if absent"""
+
+    cache_path = os.path.join(cache_dir, key + '.feather')
+    if os.path.exists(cache_path):
+        return gpd.read_feather(cache_path, memory_map=True)
+
+    df = build().reset_index(drop=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cache_path + f'.{os.getpid()}.tmp'
+    df.to_feather(tmp_path, compression='uncompressed')
+    os.replace(tmp_path, cache_path)
+    return df
+
+
+def read_file(path, **kwargs):
+    """
+    Cached equivalent of gpd.read_file(path, **kwargs).
+
+    Keyword arguments:
+        path -- path to a vector file readable by geopandas
+        kwargs -- passed to gpd.read_file, and part of the cache key
+    """
+
+    key = _source_key(path, sorted(kwargs.items()))
+    return _cached(key, lambda: gpd.read_file(path, **kwargs))
+
+
+def cached_frame(paths, build, *extra):
+    """
+    Return the GeoDataFrame build() computes from the files in paths,
+    caching it until any of those files changes.
+
+    Keyword arguments:
+        paths -- source files the frame is derived from
+        build -- function of no arguments returning a GeoDataFrame
+        extra -- further values distinguishing the cache entry
+    """
+
+    return _cached(_paths_key(paths, extra), build)
+
+
+def load_plan(path, district_colname, districts=bh):
+    """
+    Return a plan's districts as a GeoDataFrame with an int district_no column.
+
+    Keyword arguments:
+        path -- path to the plan shapefile
+        district_colname -- name of the plan's district number column
+        districts -- district numbers to keep; all districts if None
+    """
+
+    def build():
+        df = gpd.read_file(path)
+        df = df.rename(columns={district_colname: common_colname})
+        df[common_colname] = pd.to_numeric(df[common_colname]).astype(int)
+        if districts is not None:
+            df = df[df[common_colname].isin(districts)]
+        return df
+
+    key = _source_key(path, district_colname, common_colname,
+                      None if districts is None else sorted(districts))
+    return _cached(key, build)
+
+
+def cache_path(paths, suffix, *extra):
+    """
+    Return the cache file path for data derived from the files in paths;
+    it changes whenever any of those files does.
+
+    Keyword arguments:
+        paths -- source files the cached data is derived from
+        suffix -- file extension of the cache file
+        extra -- further values distinguishing the cache entry
+    """
+
+    return os.path.join(cache_dir, _paths_key(paths, extra) + suffix)
+
+
+def cached_matrix(paths, build, *extra):
+    """
+    Return the sparse matrix build() computes from the files in paths,
+    caching it as .npz until any of those files changes.
+
+    Keyword arguments:
+        paths -- source files the matrix is derived from
+        build -- function of no arguments returning a scipy.sparse matrix
+        extra -- further values distinguishing the cache entry
+    """
+
+    path = cache_path(paths, '.npz', *extra)
+    if os.path.exists(path):
+        return sp.load_npz(path)
+
+    matrix = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + f'.{os.getpid()}.tmp.npz'
+    sp.save_npz(tmp_path, matrix)
+    os.replace(tmp_path, path)
+    return matrix
+
+
+def cached_array(paths, build, *extra):
+    """
+    Return the numpy array build() computes from the files in paths,
+    caching it as .npy until any of those files changes; arguments as for
+    cached_matrix.
+    """
+
+    path = cache_path(paths, '.npy', *extra)
+    if os.path.exists(path):
+        return np.load(path)
+
+    array = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + f'.{os.getpid()}.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+    return array
+
+
+def dissolve_plan(path, district_colname, exclude=bh, tolerance=0.0001):
+    """
+    Return the union of a plan's districts other than those in exclude, as
+    (full, display): one-row GeoDataFrames holding the exact union and a
+    copy simplified for display.
+
+    The union is cached next to the shapefile as
+    <name>.dissolve.<arguments hash>.<contents hash>.feather; when the
+    shapefile changes, the older union for the same arguments is removed,
+    while unions for other arguments are kept.
+
+    Keyword arguments:
+        path -- path to the plan shapefile
+        district_colname -- name of the plan's district number column
+        exclude -- district numbers to leave out of the union
+        tolerance -- simplification tolerance of the display copy, in the
+            units of the plan's CRS
+    """
+
+    root = os.path.splitext(path)[0]
+    args_key = hashlib.sha1(repr((district_colname, sorted(exclude), tolerance)).encode()).hexdigest()[:8]
+    cache_path = f'{root}.dissolve.{args_key}.{_content_key(path)[:16]}.feather'
+    if os.path.exists(cache_path):
+        df = gpd.read_feather(cache_path)
+        return df.iloc[[0]].reset_index(drop=True), df.iloc[[1]].reset_index(drop=True)
+
+    df = load_plan(path, district_colname, districts=None)
+    geoms = df.loc[~df[common_colname].isin(exclude), 'geometry'].values
+    # districts tile the state, so their union only has to drop shared edges
+    if shapely.coverage_is_valid(geoms):
+        union = shapely.coverage_union_all(geoms)
+    else:
+        union = shapely.union_all(geoms)
+    display = shapely.simplify(union, tolerance, preserve_topology=True)
+    df = gpd.GeoDataFrame(geometry=[union, display], crs=df.crs)
+
+    for old in glob.glob(glob.escape(f'{root}.dissolve.{args_key}.') + '*.feather'):
+        os.remove(old)
+    tmp_path = cache_path + f'.{os.getpid()}.tmp'
+    df.to_feather(tmp_path, compression='uncompressed')
+    os.replace(tmp_path, cache_path)
+    return df.iloc[[0]].reset_index(drop=True), df.iloc[[1]].reset_index(drop=True)
@@ -0,0 +1,330 @@
+"""
+report: One command that writes every table and figure of the compactness,
+BVAP and election analyses.
+
+Run from the repository root:
+
+    python Analysis/report.py [compactness] [bvap] [elections]
+
+The outputs are built from a graph of intermediate results: each loaded
+plan, the census blocks and precincts, each plan's block assignment and
+precinct weights, each plan's tallies and metrics, and the comparison tables.
+Every intermediate result is a Node, memoized on disk under
+Analysis/.cache/report. A node's key is a hash of its function's source, the
+source of the analysis modules under Analysis/ that are loaded, its
+arguments, the contents of its source files and the keys of the nodes it is
+computed from. The census blocks are read around the precincts, which no plan
+changes, so changing one plan shapefile changes the keys of only that plan's
+nodes and of the tables built from them, and nothing else is recomputed.
+Changing an analysis module recomputes every node. The CSV files, the README
+tables and the PDF figures are rewritten from the cached tables on every run.
+
+"""
+
+import glob
+import hashlib
+import inspect
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+import tabulate
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Elections'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Ensemble'))
+import assignment
+import fairness
+import plans
+import quantiles
+import run_analyses as ra
+
+maps = ra.maps
+common_colname = plans.common_colname
+
+report_dir = os.path.join(plans.cache_dir, 'report')
+
+# sketch of a sampled ensemble (see Ensemble/quantiles.py), overlaid on the
+# election figures when present
+ensemble_sketch = 'Analysis/Elections/ensemble_sketch.npz'
+
+colors = {'reform': 'orange',
+          'enacted': 'violet',
+          'dems': 'blue',
+          'gop_bell2': 'red',
+          'gop_jones': 'darkred',
+          'new_VA': 'green'}
+
+figs = {'election_results': {'maps': list(maps),
+                             'elections': list(fairness.elections)},
+        'election_results_pres_only': {'maps': ['reform', 'dems', 'gop_bell2', 'new_VA'],
+                                       'elections': ['Clinton v. Trump (2016)']}}
+
+
+# content hashes of source files, remembered by path, size and mtime so that
+# unchanged files are not read again
+_file_hashes = None
+
+
+def _file_hash(path):
+    global _file_hashes
+    index_path = os.path.join(report_dir, 'files.json')
+    if _file_hashes is None:
+        _file_hashes = {}
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                _file_hashes = json.load(f)
+    stamp = plans._source_key(path)
+    if stamp not in _file_hashes:
+        _file_hashes[stamp] = plans._content_key(path)
+        os.makedirs(report_dir, exist_ok=True)
+        tmp_path = index_path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(_file_hashes, f)
+        os.replace(tmp_path, index_path)
+    return _file_hashes[stamp]
+
+
+def _code_hash(function):
+    try:
+        return inspect.getsource(function)
+    except (OSError, TypeError):
+        return function.__module__ + '.' + function.__qualname__
+
+
+# hash of the analysis modules the node functions call into, computed once
+_modules_hash = None
+
+
+def _analysis_hash():
+    """Hash of the contents of every loaded module under Analysis/"""
+
+    global _modules_hash
+    if _modules_hash is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        paths = {os.path.abspath(module.__file__) for module in list(sys.modules.values())
+                 if getattr(module, '__file__', None) and module.__file__.endswith('.py')}
+        h = hashlib.sha1()
+        for path in sorted(p for p in paths if p.startswith(root + os.sep)):
+            h.update(os.path.relpath(path, root).encode())
+            h.update(_file_hash(path).encode())
+        _modules_hash = h.hexdigest()
+    return _modules_hash
+
+
+class Node:
+    """
+    One memoized intermediate result.
+
+    Keyword arguments:
+        name -- name of the node, used in its cache file name
+        function -- computes the value from the values of deps, followed by args
+        deps -- nodes whose values function takes
+        args -- further arguments of function, part of the key by their repr
+        files -- source files the value is read from
+    """
+
+    def __init__(self, name, function, deps=(), args=(), files=()):
+        self.name = name
+        self.function = function
+        self.deps = list(deps)
+        self.args = tuple(args)
+        self.files = list(files)
+        self._key = None
+        self._value = None
+        self._has_value = False
+
+    def key(self):
+        if self._key is None:
+            h = hashlib.sha1()
+            for part in [self.name, _code_hash(self.function), _analysis_hash(), repr(self.args)]:
+                h.update(part.encode())
+            for path in self.files:
+                h.update(_file_hash(path).encode())
+            for dep in self.deps:
+                h.update(dep.key().encode())
+            self._key = h.hexdigest()
+        return self._key
+
+    def value(self):
+        """The node's value: from memory, else from the cache, else computed and cached"""
+
+        if self._has_value:
+            return self._value
+        path = os.path.join(report_dir, f'{self.name}.{self.key()[:16]}.pkl')
+        if os.path.exists(path):
+            self._value = pd.read_pickle(path)
+        else:
+            print(f'computing {self.name}')
+            self._value = self.function(*[dep.value() for dep in self.deps], *self.args)
+            os.makedirs(report_dir, exist_ok=True)
+            for old in glob.glob(os.path.join(report_dir, glob.escape(self.name) + '.*.pkl')):
+                os.remove(old)
+            tmp_path = path + f'.{os.getpid()}.tmp'
+            pd.to_pickle(self._value, tmp_path)
+            os.replace(tmp_path, path)
+        self._has_value = True
+        return self._value
+
+
+# assignment indexes of the unit frames, built once per process
+_indexes = {}
+
+
+def _index(units):
+    if id(units) not in _indexes:
+        _indexes[id(units)] = assignment.AssignmentIndex(units)
+    return _indexes[id(units)]
+
+
+def _blocks_with_race(precincts):
+    return ra._build_blocks_with_race(precincts)
+
+
+def _assign_blocks(blocks, plan):
+    return _index(blocks).assign(plan)
+
+
+def _plan_bvap(plan, block_district, blocks, mapname):
+    return ra.plan_bvap(plan, block_district, blocks[['BVAP', 'VAP']].values, mapname)
+
+
+def _precinct_weights(precincts, plan):
+    return _index(precincts).weights(plan)
+
+
+def _plan_elections(plan, weights, precincts):
+    vote_cols = [i for i in precincts.columns if i not in ra.potential_cols]
+    return ra.plan_elections(plan, weights, precincts[vote_cols].fillna(0).values, vote_cols)
+
+
+def _by_map(*results):
+    return dict(zip(maps, results))
+
+
+def _compactness_tables(*results):
+    return ra.compactness_tables(_by_map(*results))
+
+
+def _bvap_tables(*results):
+    return ra.bvap_tables(_by_map(*results))
+
+
+def build_graph():
+    """Return the table nodes of each analysis, keyed by analysis name"""
+
+    plan = {m: Node(f'plan_{m}', plans.load_plan, args=(maps[m]['path'], maps[m]['district_colname']),
+                    files=[maps[m]['path']])
+            for m in maps}
+    precincts = Node('precincts', plans.read_file, args=(ra.precincts_path,), files=[ra.precincts_path])
+    # blocks are read within the bounding box of the precincts, which no plan
+    # changes, so that editing one plan leaves the blocks node as it is
+    blocks = Node('blocks', _blocks_with_race, deps=[precincts], files=[ra.census_blocks, ra.P10_table])
+
+    compactness = [Node(f'compactness_{m}', ra.plan_compactness, deps=[plan[m]], args=(m,)) for m in maps]
+
+    bvap = []
+    for m in maps:
+        block_district = Node(f'block_district_{m}', _assign_blocks, deps=[blocks, plan[m]])
+        bvap.append(Node(f'bvap_{m}', _plan_bvap, deps=[plan[m], block_district, blocks], args=(m,)))
+
+    elections = []
+    for m in maps:
+        weights = Node(f'precinct_weights_{m}', _precinct_weights, deps=[precincts, plan[m]])
+        elections.append(Node(f'elections_{m}', _plan_elections, deps=[plan[m], weights, precincts]))
+
+    return {'compactness': Node('compactness_tables', _compactness_tables, deps=compactness),
+            'bvap': Node('bvap_tables', _bvap_tables, deps=bvap),
+            'elections': Node('election_results', _by_map, deps=elections)}
+
+
+def markdown_table(df, precision=3, showindex=False):
+    return tabulate.tabulate(df, headers=df.columns, floatfmt=f'.{precision}g', tablefmt='pipe', showindex=showindex)
+
+
+def write_compactness(tables):
+    all, mean = tables
+    all.to_csv('Analysis/Compactness/compactness_comparison.csv', index=True, float_format='%.3f')
+    mean.to_csv('Analysis/Compactness/mean_compactness_comparison.csv', index=True, float_format='%.3f')
+
+    with open('Analysis/Compactness/README.md', 'w') as text_file:
+        print('Various compactness metrics:\n', file=text_file)
+        print(markdown_table(mean, showindex=True), file=text_file)
+        print('\n\n', file=text_file)
+        print(markdown_table(pd.DataFrame(all.to_records()), showindex='never'), file=text_file)
+
+
+def write_bvap(tables):
+    sorted, mean = tables
+    sorted.to_csv('Analysis/BVAP/bvap_comparison.csv', index=False, float_format='%.3f')
+    mean.to_csv('Analysis/BVAP/mean_bvap_comparison.csv', index=False, float_format='%.3f')
+
+    with open('Analysis/BVAP/README.md', 'w') as text_file:
+        print('Proportion of voting-age population that identifies as Black or African-American (one race only), by district.\n', file=text_file)
+        print(markdown_table(mean, showindex=True), file=text_file)
+        print('\n\n', file=text_file)
+        print(markdown_table(sorted), file=text_file)
+
+
+def write_elections(results):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.set()
+
+    for mapname in maps:
+        results[mapname].to_csv(f'Analysis/Elections/election_results_{mapname}.csv', index=False)
+
+    names = list(fairness.elections)
+    votes1, votes2 = [np.stack([results[mapname][[fairness.elections[e][i] for e in names]].values.T
+                                for mapname in maps]) for i in (0, 1)]
+    shares = fairness.vote_shares(votes1, votes2)
+    fairness.write_fairness('Analysis/Elections/fairness.feather', votes1, votes2, names, list(maps),
+                            swings=np.linspace(-0.25, 0.25, 200))
+
+    sketch = quantiles.RankQuantiles.load(ensemble_sketch) if os.path.exists(ensemble_sketch) else None
+
+    for f in figs:
+        elections = figs[f]['elections']
+        n_elex = len(elections)
+        fig, ax = plt.subplots(1, n_elex, figsize=(n_elex*5, 3), squeeze=False)
+
+        for axis, election in zip(ax[0], elections):
+            if sketch is not None and fairness.elections[election][0] in sketch.metrics:
+                sketch.plot_boxes(axis, fairness.elections[election][0])
+            for mapname in figs[f]['maps']:
+                v = shares[list(maps).index(mapname), names.index(election)]
+                axis.scatter(range(len(v)), np.sort(v), label=maps[mapname]['name'], s=15, color=colors[mapname],
+                             alpha=.7, linewidth=1.5, facecolor='none')
+            axis.axhline(.5)
+            axis.set_title(election)
+            axis.set_ylim([.3, 1])
+
+        ax[0][0].legend(loc='upper left')
+        if n_elex == 1:
+            candidate = election.split(' ')[0]
+            ax[0][0].set_ylabel(f'{candidate} voteshare')
+            ax[0][0].set_xlabel(f'District, ranked by {candidate} voteshare')
+        else:
+            ax[0][0].set_ylabel('Candidate 1 voteshare')
+            ax[0][0].set_xlabel('District, ranked by candidate 1 voteshare')
+
+        fig.savefig(f'Analysis/Elections/{f}.pdf', bbox_inches='tight')
+        plt.close(fig)
+
+
+writers = {'compactness': write_compactness,
+           'bvap': write_bvap,
+           'elections': write_elections}
+
+
+def main(selected):
+    graph = build_graph()
+    for analysis in selected:
+        writers[analysis](graph[analysis].value())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or list(writers))
@@ -0,0 +1,249 @@
+"""
+run_analyses: Run the compactness, BVAP and election analyses for every plan
+in parallel, writing the same CSV files as compute_compactness.py,
+compute_BVAP.py and compute_elections.py.
+
+Run from the repository root:
+
+    python Analysis/run_analyses.py [compactness] [bvap] [elections]
+
+Every (plan, analysis) pair is one task in a process pool. The large shared
+inputs, the census blocks with race data and the precincts with election
+returns, are never pickled to the workers: the parent process writes them to
+the plans cache once, and each worker memory-maps the cached Feather files
+when it starts. The parent also assigns the blocks to each plan's districts,
+building the spatial index over the blocks once, and caches the codes as int
+arrays, which the workers load.
+
+"""
+
+import concurrent.futures
+import os
+import sys
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Compactness'))
+import assignment
+import census
+import continuous_measures as cm
+import plans
+
+maps = plans.maps
+
+# columns of cm.compactness_table
+metrics = {'Reock (higher is better)': 'reock',
+           'Schwartzberg (lower is better)': 'schwartzberg',
+           'Convex hull ratio (higher is better)': 'c_hull_ratio',
+           'Polsby-Popper (higher is better)': 'polsby_popper'}
+
+census_blocks = '/mapping/VA/2010 Census/Census Blocks with Population/tabblock2010_51_pophu.shp'
+P10_table = '/mapping/VA/2010 Census/P10 Race for 18+ Population by Block/nhgis0003_ds172_2010_block.csv'
+precincts_path = 'Maps/Affected and adjacent precincts with BVAP/BH_precincts_with_BVAP_VAP.shp'
+
+common_colname = plans.common_colname
+affected_label = 'Ruled unconstitutional as enacted'
+adjacent_label = 'Adjacent to a district ruled unconstitutional'
+
+potential_cols = ['locality', 'precinct', 'NAME', 'BVAP', 'VAP', 'prop_BVAP', 'prop_D_LG', 'prop_D_p', 'prop_D_G', 'prop_D_AG', 'prop_D_P', 'index', 'geometry']
+
+
+def _build_blocks_with_race(regions=None):
+    """
+    Census blocks with BVAP and VAP columns, read only within the bounding
+    box of regions (see census.read_blocks); the precincts if None. The
+    precincts cover the study region whatever the plans, so editing a plan
+    does not change which blocks are read.
+    """
+
+    if regions is None:
+        regions = load_precincts()
+    blocks = census.read_blocks(census_blocks, regions)
+    blocks_w_race = census.join_block_race(blocks, census.read_block_race(P10_table))
+    return blocks_w_race[['BVAP', 'VAP', 'geometry']]
+
+
+def load_blocks_with_race():
+    """Census blocks around the precincts with BVAP and VAP columns, from the plans cache"""
+
+    return plans.cached_frame([census_blocks, P10_table, precincts_path], _build_blocks_with_race)
+
+
+def load_precincts():
+    """Precincts with election returns, from the plans cache"""
+
+    return plans.read_file(precincts_path)
+
+
+def block_codes(mapname, assign=None):
+    """
+    District code of each block of load_blocks_with_race() under plan
+    mapname, from the plans cache; computed on a miss by assign, a function
+    of the plan's districts (e.g. an AssignmentIndex's assign).
+    """
+
+    return plans.cached_array([census_blocks, P10_table, precincts_path, maps[mapname]['path']],
+                              lambda: assign(load_plan(mapname)), 'block codes',
+                              maps[mapname]['district_colname'], sorted(plans.bh))
+
+
+# per-worker inputs, loaded once by _init_worker
+_inputs = {}
+
+
+def _init_worker(analyses):
+    if 'bvap' in analyses:
+        _inputs['blocks'] = load_blocks_with_race()[['BVAP', 'VAP']].values
+    if 'elections' in analyses:
+        precincts = load_precincts()
+        vote_cols = [i for i in precincts.columns if i not in potential_cols]
+        _inputs['vote_cols'] = vote_cols
+        _inputs['votes'] = precincts[vote_cols].fillna(0).values
+        _inputs['precinct_index'] = assignment.AssignmentIndex(precincts)
+
+
+def _label_status(df):
+    df.loc[df[common_colname].isin(plans.affected), 'status'] = affected_label
+    df.loc[df[common_colname].isin(plans.adjacent), 'status'] = adjacent_label
+    return df
+
+
+def load_plan(mapname):
+    return plans.load_plan(maps[mapname]['path'], maps[mapname]['district_colname'])
+
+
+def plan_compactness(df, mapname):
+    """Compactness metrics of the districts of one plan"""
+
+    df = df.copy()
+    table = cm.compactness_table(df)
+    for m in metrics:
+        df[m] = table[metrics[m]]
+    df['map'] = mapname
+    return pd.DataFrame(df[[common_colname, 'map'] + list(metrics)])
+
+
+def plan_bvap(df, block_district, blocks, mapname):
+    """BVAP and VAP of the districts of one plan, given the district of each block"""
+
+    df = df.copy()
+    df[['BVAP', 'VAP']] = assignment.tally(block_district, blocks, len(df)).astype(int)
+    df['prop_BVAP'] = df['BVAP'] / df['VAP']
+    df = _label_status(pd.DataFrame(df[[common_colname, 'BVAP', 'VAP', 'prop_BVAP']]))
+    return df.rename(columns={i: i + '_' + mapname for i in ['BVAP', 'VAP', 'prop_BVAP']})
+
+
+def plan_elections(df, weights, votes, vote_cols):
+    """Votes in the districts of one plan, given the precinct-by-district weights"""
+
+    df = df.copy()
+    df[vote_cols] = assignment.interpolate(weights, votes)
+    df = _label_status(pd.DataFrame(df.drop(columns='geometry')))
+    return df[[common_colname, 'status'] + [c for c in df.columns if c not in [common_colname, 'status']]]
+
+
+def compactness(mapname):
+    return plan_compactness(load_plan(mapname), mapname)
+
+
+def bvap(mapname):
+    df = load_plan(mapname)
+    return plan_bvap(df, block_codes(mapname), _inputs['blocks'], mapname)
+
+
+def elections(mapname):
+    df = load_plan(mapname)
+    weights = plans.cached_matrix([precincts_path, maps[mapname]['path']],
+                                  lambda: _inputs['precinct_index'].weights(df), sorted(plans.bh))
+    return plan_elections(df, weights, _inputs['votes'], _inputs['vote_cols'])
+
+
+analyses = {'compactness': compactness,
+            'bvap': bvap,
+            'elections': elections}
+
+
+def _run(analysis, mapname):
+    return analyses[analysis](mapname)
+
+
+def compactness_tables(results):
+    """(all, mean) compactness tables from the per-plan results"""
+
+    all = pd.concat([results[mapname] for mapname in maps], sort=False)
+    mean = all.pivot_table(values=list(metrics), index='map')
+    all = all.pivot_table(values=list(metrics), index=['map', common_colname]).sort_values(by=[common_colname, 'map'])
+    return all, mean
+
+
+def bvap_tables(results):
+    """(sorted, mean) BVAP tables from the per-plan results"""
+
+    keys = list(maps)
+    df = results[keys[0]]
+    for mapname in keys[1:]:
+        df = df.merge(results[mapname].drop(columns='status'), on=common_colname)
+    df = df[[common_colname, 'status'] + [c for c in df.columns if c not in [common_colname, 'status']]]
+
+    sorted = df.sort_values(by=['status', common_colname], ascending=[False, True])
+    mean = pd.DataFrame(df.loc[df['status']==affected_label, ['prop_BVAP_' + i for i in maps]].mean()).T.rename(index={0: 'mean BVAP in affected districts'})
+    return sorted, mean
+
+
+def write_compactness(results):
+    all, mean = compactness_tables(results)
+    all.to_csv('Analysis/Compactness/compactness_comparison.csv', index=True, float_format='%.3f')
+    mean.to_csv('Analysis/Compactness/mean_compactness_comparison.csv', index=True, float_format='%.3f')
+
+
+def write_bvap(results):
+    sorted, mean = bvap_tables(results)
+    sorted.to_csv('Analysis/BVAP/bvap_comparison.csv', index=False, float_format='%.3f')
+    mean.to_csv('Analysis/BVAP/mean_bvap_comparison.csv', index=False, float_format='%.3f')
+
+
+def write_elections(results):
+    for mapname in maps:
+        results[mapname].to_csv(f'Analysis/Elections/election_results_{mapname}.csv', index=False)
+
+
+writers = {'compactness': write_compactness,
+           'bvap': write_bvap,
+           'elections': write_elections}
+
+
+def main(selected, max_workers=None):
+    # parse every input once here, so workers only memory-map the cache
+    for mapname in maps:
+        plans.load_plan(maps[mapname]['path'], maps[mapname]['district_colname'])
+    if 'bvap' in selected:
+        blocks = load_blocks_with_race()
+        # the index over the blocks is built only if a plan's codes are not cached
+        index = []
+
+        def assign(df):
+            if not index:
+                index.append(assignment.AssignmentIndex(blocks))
+            return index[0].assign(df)
+
+        for mapname in maps:
+            block_codes(mapname, assign)
+    if 'elections' in selected:
+        load_precincts()
+
+    tasks = [(analysis, mapname) for analysis in selected for mapname in maps]
+    results = {analysis: {} for analysis in selected}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers or min(len(tasks), os.cpu_count()),
+                                                initializer=_init_worker,
+                                                initargs=(selected,)) as executor:
+        futures = {executor.submit(_run, *task): task for task in tasks}
+        for future in concurrent.futures.as_completed(futures):
+            analysis, mapname = futures[future]
+            results[analysis][mapname] = future.result()
+
+    for analysis in selected:
+        writers[analysis](results[analysis])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or list(analyses))
@@ -0,0 +1,291 @@
+"""
+run_benchmarks: Timing and memory benchmarks for the hot paths of the
+analysis and map scripts.
+
+Run from the repository root:
+
+    python Benchmarks/run_benchmarks.py [--out results.json] [--baseline old.json]
+                                        [--stages reock make_circles ...] [--quick]
+
+Each stage runs in a fresh process, so the reported peak RSS is that of the
+stage alone (including the interpreter and imports). Stages use the plan
+shapefiles shipped under Maps/ where they are present, plus synthetic inputs
+scaled up from them: 10x and 100x as many districts, and hulls of 10^4 to
+10^6 vertices. Everything runs offline, and every random choice, including
+make_circle's shuffle, is seeded.
+
+With --baseline, each stage is compared with the same stage in a stored
+results file, and the exit status is 1 if any stage got slower by more than
+--threshold.
+
+"""
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(root, 'Analysis'))
+sys.path.append(os.path.join(root, 'Analysis', 'Compactness'))
+
+plan_paths = {'reform': ('Maps/Reform map/Districts map bethune-hill final.shp', 'DISTRICT'),
+              'enacted': ('Maps/Enacted map/enacted.shp', 'ID'),
+              'dems': ('Maps/House Dems map/HB7001.shp', 'OBJECTID'),
+              'gop_bell2': ('Maps/GOP map bell substitute/HB7002_ANS.shp', 'OBJECTID'),
+              'gop_jones': ('Maps/GOP map jones/HB7003.shp', 'OBJECTID'),
+              'new_VA': ('Maps/New VA Majority/VA NVM Map Submission 20180926.shp', 'District')}
+
+
+def _districts(scale):
+    """The shipped plans' districts, replicated scale times side by side"""
+
+    import geopandas as gpd
+    import pandas as pd
+    import plans
+
+    frames = [plans.load_plan(os.path.join(root, path), colname)
+              for path, colname in plan_paths.values() if os.path.exists(os.path.join(root, path))]
+    if not frames:
+        raise FileNotFoundError('no plan shapefiles found under Maps/')
+    df = pd.concat(frames, ignore_index=True)
+    width = df.total_bounds[2] - df.total_bounds[0]
+    copies = [df.geometry.translate(xoff=i * width * 1.1) for i in range(scale)]
+    return gpd.GeoDataFrame(geometry=pd.concat(copies, ignore_index=True), crs=df.crs)
+
+
+def _hull(n, seed):
+    """n points on an ellipse, all of which are convex hull vertices"""
+
+    import numpy as np
+
+    # a different stream from the solvers' shuffle: with the same seed the
+    # shuffle would sort the points by angle, the worst case for Welzl
+    rng = np.random.default_rng((seed, n))
+    theta = rng.uniform(0, 2 * np.pi, n)
+    return np.column_stack([np.cos(theta), 0.5 * np.sin(theta)])
+
+
+def _grid(districts, n, seed):
+    """About n square units covering the extent of districts"""
+
+    import geopandas as gpd
+    import numpy as np
+    import shapely
+
+    xmin, ymin, xmax, ymax = districts.total_bounds
+    side = np.sqrt((xmax - xmin) * (ymax - ymin) / n)
+    xs = np.arange(xmin, xmax, side)
+    ys = np.arange(ymin, ymax, side)
+    x, y = [a.ravel() for a in np.meshgrid(xs, ys)]
+    rng = np.random.default_rng(seed)
+    return gpd.GeoDataFrame({'value': rng.integers(0, 100, len(x))},
+                            geometry=shapely.box(x, y, x + side, y + side), crs=districts.crs)
+
+
+# Each stage takes (size, seed) and returns (run, items, unit): run() does
+# the timed work, which processes items of the given unit.
+
+def make_circle(size, seed):
+    import continuous_measures as cm
+
+    points = _hull(size, seed).tolist()
+
+    def run():
+        random.seed(seed)
+        cm.make_circle(points)
+
+    return run, size, 'vertices'
+
+
+def make_circles(size, seed):
+    import continuous_measures as cm
+
+    points = _hull(size, seed)
+    return (lambda: cm.make_circles(points, [0, size], seed=seed)), size, 'vertices'
+
+
+def reock(size, seed):
+    import continuous_measures as cm
+
+    districts = _districts(size)
+    return (lambda: cm.reock(districts, seed=seed)), len(districts), 'districts'
+
+
+def reock_make_circle(size, seed):
+    import math
+    import continuous_measures as cm
+
+    districts = _districts(size)
+
+    def run():
+        random.seed(seed)
+        return districts.area / districts.convex_hull.apply(
+            lambda x: math.pi * cm.make_circle(list(x.exterior.coords))[2] ** 2)
+
+    return run, len(districts), 'districts'
+
+
+def compactness_metrics(size, seed):
+    import continuous_measures as cm
+
+    districts = _districts(size)
+
+    def run():
+        cm.polsby_popper(districts)
+        cm.schwartzberg(districts)
+        cm.c_hull_ratio(districts)
+
+    return run, len(districts), 'districts'
+
+
+def compactness_table(size, seed):
+    import continuous_measures as cm
+
+    districts = _districts(size)
+    return (lambda: cm.compactness_table(districts, seed=seed)), len(districts), 'districts'
+
+
+def assign(size, seed):
+    import assignment
+
+    districts = _districts(1)
+    units = _grid(districts, size, seed)
+
+    def run():
+        index = assignment.AssignmentIndex(units)
+        assignment.tally(index.assign(districts), units['value'].values, len(districts))
+
+    return run, len(units), 'units'
+
+
+def areal_weights(size, seed):
+    import assignment
+
+    districts = _districts(1)
+    units = _grid(districts, size, seed)
+
+    def run():
+        index = assignment.AssignmentIndex(units)
+        assignment.interpolate(index.weights(districts), units[['value']].values)
+
+    return run, len(units), 'units'
+
+
+def ai_aggregate(size, seed):
+    # the external areal_interpolation module the scripts used to call
+    import areal_interpolation as ai
+
+    districts = _districts(1)
+    units = _grid(districts, size, seed)
+    return (lambda: ai.aggregate(units, districts, source_columns=['value'], method='greatest_area')), len(units), 'units'
+
+
+def html_map(size, seed):
+    def run():
+        subprocess.run([sys.executable, 'Maps/Interactive/make_html_map.py'], cwd=root, check=True,
+                       stdout=subprocess.DEVNULL)
+
+    return run, 1, 'maps'
+
+
+stages = {'make_circle': (make_circle, [10**4, 10**5, 10**6]),
+          'make_circles': (make_circles, [10**4, 10**5, 10**6]),
+          'reock_make_circle': (reock_make_circle, [1, 10, 100]),
+          'reock': (reock, [1, 10, 100]),
+          'compactness_metrics': (compactness_metrics, [1, 10, 100]),
+          'compactness_table': (compactness_table, [1, 10, 100]),
+          'assign': (assign, [10**4, 10**5]),
+          'areal_weights': (areal_weights, [10**4, 10**5]),
+          'ai_aggregate': (ai_aggregate, [10**4, 10**5]),
+          'html_map': (html_map, [1])}
+
+
+def _measure(stage, size, seed, repeat):
+    function = stages[stage][0]
+    run, items, unit = function(size, seed)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    wall = min(times)
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    peak = usage / 2**20 if sys.platform == 'darwin' else usage / 2**10
+    return {'stage': stage, 'size': size, 'wall_s': wall, 'peak_rss_mb': peak,
+            'throughput': items / wall if wall > 0 else float('inf'), 'unit': unit + '/s'}
+
+
+def run_benchmarks(selected, seed=0, repeat=3, quick=False):
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for stage in selected:
+        sizes = stages[stage][1][:1] if quick else stages[stage][1]
+        for size in sizes:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                try:
+                    result = executor.submit(_measure, stage, size, seed, repeat).result()
+                except Exception as e:
+                    result = {'stage': stage, 'size': size, 'error': f'{type(e).__name__}: {e}'}
+            results.append(result)
+            if 'error' in result:
+                print(f"{stage:>20} {size:>8}  skipped ({result['error']})")
+            else:
+                print(f"{stage:>20} {size:>8}  {result['wall_s']:10.4f} s  {result['peak_rss_mb']:8.1f} MB"
+                      f"  {result['throughput']:12.1f} {result['unit']}")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the ratio of each stage's time to baseline; return the regressions"""
+
+    old = {(r['stage'], r['size']): r for r in baseline['results'] if 'error' not in r}
+    regressions = []
+    for r in results:
+        key = (r['stage'], r['size'])
+        if 'error' in r or key not in old:
+            continue
+        ratio = r['wall_s'] / old[key]['wall_s']
+        flag = '  REGRESSION' if ratio > threshold else ''
+        print(f'{r["stage"]:>20} {r["size"]:>8}  {ratio:6.2f}x baseline{flag}')
+        if ratio > threshold:
+            regressions.append(r)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default='benchmark_results.json', help='where to write results as JSON')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio reported as a regression')
+    parser.add_argument('--stages', nargs='+', choices=list(stages), default=list(stages))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage; the fastest is reported')
+    parser.add_argument('--quick', action='store_true', help='only the smallest size of each stage')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.stages, seed=args.seed, repeat=args.repeat, quick=args.quick)
+
+    with open(args.out, 'w') as f:
+        json.dump({'meta': {'python': platform.python_version(),
+                            'platform': platform.platform(),
+                            'cpu_count': os.cpu_count(),
+                            'seed': args.seed,
+                            'repeat': args.repeat,
+                            'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+                   'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
@@ -1,8 +1,10 @@
 import geopandas as gpd
 import pandas as pd
+import os
 import sys
-sys.path.append('/Users/wtadler/Repos/gerrymander-geoprocessing/areal_interpolation')
-import areal_interpolation as ai
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Analysis'))
+import assignment
+import census
 
 # SET PATHS
 
@@ -15,40 +17,44 @@ BH_precincts = '/Volumes/GoogleDrive/Team Drives/princeton_gerrymandering_projec
 house_districts = '/Volumes/GoogleDrive/Team Drives/princeton_gerrymandering_project/mapping/VA/House of Delegates map (census)/cb_2017_51_sldl_500k.shp'
 
 
-# 1) Load census block geographies, join with BVAP and non-B VAP
-
-blocks = gpd.read_file(census_blocks)
-
-race = pd.read_csv(P10_table)[1:]
-
-# column codes
-bvap = 'H74004'
-vap = 'H74001'
+# filter to only include precincts in affected and adjacent districts according to VPAP
+# https://www.vpap.org/visuals/visual/ruling-could-impact-1-3-house-districts/
+affected = [63, 69, 70, 71, 74, 77, 80, 89, 90, 92, 95]
+adjacent = [27, 55, 61, 62, 64, 66, 68, 72, 73, 75, 76, 78, 79, 81, 83, 85, 91, 93, 94, 96, 97, 100]
+relevant_districts = affected + adjacent
 
-blocks['GISJOIN'] = 'G' + blocks['STATEFP10'] + blocks['COUNTYFP10'].apply(lambda x: x.zfill(4)) + blocks['TRACTCE10'].apply(lambda x: x.zfill(7)) + blocks['BLOCKCE'].apply(lambda x: x.zfill(4))
+# 1) Load precinct data with election results and House geographies, assign
+# districts to precincts, find the precincts in the relevant districts
+precincts = gpd.read_file(BH_precincts)
+house = gpd.read_file(house_districts)
 
-blocks_w_race = blocks.merge(race.loc[:, ['GISJOIN', bvap, vap]], on='GISJOIN')
-blocks_w_race = blocks_w_race.rename(columns={bvap: 'BVAP', vap: 'VAP'})
-blocks_w_race = blocks_w_race.astype({'BVAP': int, 'VAP': int})
+precinct_district = assignment.AssignmentIndex(precincts).assign(house)
+precinct_name = pd.Series(house['NAME'].values[precinct_district]).where(precinct_district >= 0).values
+relevant = pd.Series(precinct_name).isin([str(i) for i in relevant_districts]).values
 
-# 2) Load precinct data with election result, merge them with census block data
-precincts = gpd.read_file(BH_precincts)
+# 2) Load the census blocks around the relevant precincts, with only the
+# columns we use, and join them with BVAP and VAP
+blocks = census.read_blocks(census_blocks, precincts[relevant])
 
-precincts_w_race = ai.aggregate(blocks_w_race, precincts, source_columns=['BVAP', 'VAP'], method='greatest_area')[1]
+# BVAP and VAP by block, streamed from the NHGIS table
+race = census.read_block_race(P10_table)
 
+blocks['GISJOIN'] = census.gisjoin(blocks)
 
-# 3) load House geographies, assign districts to precincts, filte
-house = gpd.read_file(house_districts)
+blocks_w_race = census.join_block_race(blocks, race)
 
-precincts_w_race_and_districts = ai.aggregate(precincts_w_race, house, target_columns=['NAME'])[0]
+# 3) each census block goes to the precinct containing most of its area,
+# among all precincts, so that a block mostly in a precinct outside the
+# relevant districts is not counted in a relevant one; then keep the
+# relevant precincts
+block_precinct = assignment.AssignmentIndex(blocks_w_race).assign(precincts)
+precincts_w_race = precincts.copy()
+precincts_w_race[['BVAP', 'VAP']] = assignment.tally(block_precinct, blocks_w_race[['BVAP', 'VAP']].values, len(precincts)).astype(int)
 
-# filter to only include precincts in affected and adjacent districts according to VPAP
-# https://www.vpap.org/visuals/visual/ruling-could-impact-1-3-house-districts/
-affected = [63, 69, 70, 71, 74, 77, 80, 89, 90, 92, 95]
-adjacent = [27, 55, 61, 62, 64, 66, 68, 72, 73, 75, 76, 78, 79, 81, 83, 85, 91, 93, 94, 96, 97, 100]
-relevant_districts = affected + adjacent
+precincts_w_race_and_districts = precincts_w_race[precinct_district >= 0].copy()
+precincts_w_race_and_districts['NAME'] = precinct_name[precinct_district >= 0]
 
-relevant_precincts = precincts_w_race_and_districts[precincts_w_race_and_districts['NAME'].isin([str(i) for i in relevant_districts])]
+relevant_precincts = precincts_w_race_and_districts[relevant[precinct_district >= 0]].copy()
 
 # proportion of the voting age population that is black
 relevant_precincts['prop_BVAP'] = relevant_precincts['BVAP'] / relevant_precincts['VAP']
@@ -1,14 +1,36 @@
 import folium
 import geopandas as gpd
 import numpy as np
-import shapely
 import fileinput
 import matplotlib.cm as cm
 import pandas as pd
 import json
+import os
+import sys
+sys.path.append('Analysis')
+import plans
+import shared_topology
+import styles
+import vector_tiles
 
 make_BVAP_choropleth = False
 
+# How the map layers get to the page:
+#   'geojson' -- each layer embedded as full-resolution GeoJSON
+#   'topojson' -- all layers embedded as one shared-arc TopoJSON topology,
+#       simplified (tolerance in degrees) and quantized, decoded on load
+#   'tiles' -- a vector tile pyramid per layer, written to tile_dir next to
+#       the page, of which the page loads only the tiles in view; serve
+#       Maps/Interactive over HTTP (e.g. python -m http.server) to view it
+layer_format = 'topojson'
+topojson_tolerance = 0.0001
+topojson_quantization = 1e5
+tile_dir = 'tiles'
+tile_zooms = (8, 14)
+
+# simplification tolerance of the non-Bethune-Hill area, in degrees
+nonBH_tolerance = 0.0001
+
 # Color conversion helper function
 def rgb_to_hex(rgb):
     def f(x): return int(x * 255)
@@ -23,28 +45,27 @@ np.random.seed(105)
 np.random.shuffle(colors)
 
 # identify relevant districts
-affected = [63, 69, 70, 71, 74, 77, 80, 89, 90, 92, 95]
-adjacent = [27, 55, 61, 62, 64, 66, 68, 72, 73, 75, 76, 78, 79, 81, 83, 85,
-            91, 93, 94, 96, 97, 100]
-bh = [str(i) for i in affected + adjacent]
+affected = plans.affected
+adjacent = plans.adjacent
+bh = plans.bh
 
 # Set colors for each district
 colordict = {}
 affected_label = 'Ruled unconstitutional as enacted'
 adjacent_label = 'Adjacent to a district ruled unconstitutional'
 for i, district in enumerate(affected):
-    colordict[str(district)] = {'status': affected_label,
-                                'color': rgb_to_hex(colors[i])}
+    colordict[district] = {'status': affected_label,
+                           'color': rgb_to_hex(colors[i])}
 for i, district in enumerate(adjacent):
-    colordict[str(district)] = {'status': adjacent_label,
-                                'color': rgb_to_hex(colors[i + len(affected)])}
+    colordict[district] = {'status': adjacent_label,
+                           'color': rgb_to_hex(colors[i + len(affected)])}
 
 # manually adjust colors:
-colordict['62']['color'] = '#002235'
-colordict['83']['color'] = colordict['95']['color']
-colordict['81']['color'] = '#330035'
-colordict['64']['color'] = colordict['61']['color']
-colordict['97']['color'] = colordict['75']['color']
+colordict[62]['color'] = '#002235'
+colordict[83]['color'] = colordict[95]['color']
+colordict[81]['color'] = '#330035'
+colordict[64]['color'] = colordict[61]['color']
+colordict[97]['color'] = colordict[75]['color']
 
 # Create dataframe from the color dictionary
 color_df = pd.DataFrame.from_dict(colordict, orient='index')
@@ -52,57 +73,22 @@ color_df = pd.DataFrame.from_dict(colordict, orient='index')
 # map boundaries, SW and NE points
 bounds = [[36.482, -78.91], [38.22, -75.19]]
 
-maps = {'reform': {'name': 'PGP Reform map',
-                   'path': 'Maps/Reform map/Districts map bethune-hill final.shp',
-                   'district_colname': 'DISTRICT',
-                   'show': True},
-        'enacted': {'name': 'Enacted map',
-                    'path': 'Maps/Enacted map/enacted.shp',
-                    'district_colname': 'ID',
-                    'show': False},
-        'dems':    {'name': 'VA House Dems map',
-                    'path': 'Maps/House Dems map/HB7001.shp',
-                    'district_colname': 'OBJECTID',
-                    'show': False},
-# =============================================================================
-#         'gop_bell1':     {'name': 'VA House GOP (Bell 1)',
-#                     'path': 'Maps/GOP map bell/HB7002_shapefile.shp',
-#                     'district_colname': 'OBJECTID',
-#                     'show': False},
-# =============================================================================
-        'gop_bell2':     {'name': 'VA House GOP (Bell)',
-                    'path': 'Maps/GOP map bell substitute/HB7002_ANS.shp',
-                    'district_colname': 'OBJECTID',
-                    'show': False}, 
-        'gop_jones':    {'name': 'VA House GOP (Jones)',
-                    'path': 'Maps/GOP map jones/HB7003.shp',
-                    'district_colname': 'OBJECTID',
-                    'show': False},
-        'new_VA':    {'name': 'New VA Majority',
-                    'path': 'Maps/New VA Majority/VA NVM Map Submission 20180926.shp',
-                    'district_colname': 'District',
-                    'show': False}
-        }
-
-common_colname = 'district_no'
+# the plans of plans.maps, copied since each gets a 'df' entry below
+maps = {mapname: dict(plans.maps[mapname]) for mapname in plans.maps}
+
+common_colname = plans.common_colname
 
 # Iterate through every option on the interactive map
 for mapname in maps:
-    # load in dataframe
-    df = gpd.read_file(maps[mapname]['path'])
-
-    # Merge all of the non Bethune-Hill districts into one district
+    # Merge all of the non Bethune-Hill districts into one district (cached
+    # next to the shapefile), simplified for display
     if mapname == 'enacted':
-        nonBH = shapely.ops.cascaded_union(df.loc[~df[maps['enacted']
-                                                      ['district_colname']]
-                                                  .isin(bh), 'geometry'])
+        nonBH = plans.dissolve_plan(maps[mapname]['path'], maps[mapname]['district_colname'],
+                                    exclude=bh, tolerance=nonBH_tolerance)[1]
 
-    # Make the identifying column name district_no
-    df = df.rename(columns={maps[mapname]['district_colname']: common_colname})
-    df[common_colname] = df[common_colname].astype(str)
-
-    # Filter out districts that are not Bethune-Hill districts
-    df = df[df[common_colname].isin(bh)]
+    # load in dataframe with the identifying column name district_no,
+    # filtered to the Bethune-Hill districts
+    df = plans.load_plan(maps[mapname]['path'], maps[mapname]['district_colname'])
 
     # assign colors as shuffled
     df = df.merge(color_df, left_on=common_colname, right_index=True)
@@ -110,48 +96,40 @@ for mapname in maps:
     # for labeling purposes
     df['Empty'] = ''
 
+    df['opacity'] = np.where(df['status'] == adjacent_label, 0.18, 0.55)
+
+    # only the properties the styles and tooltips use
+    df = df[[common_colname, 'status', 'color', 'opacity', 'Empty', 'geometry']]
+
     # Place dataframe into the maps dict
     maps[mapname]['df'] = df
     
 ###################
 # styles          #
 ###################
-def style_func(x, choropleth=False, highlight=False):
-    if choropleth:
-        color = '#fff'
-    else:
-        color = '#888'
-    
+# Styles are (constants, columns) pairs, see styles.py: the plan districts'
+# fill colors and status-dependent fill opacities are data columns, so the
+# page needs one style rule per layer rather than one style per feature.
+def plan_style(choropleth=False, highlight=False):
+    color = '#fff' if choropleth else '#888'
+
     if highlight:
-        if choropleth:
-            fillColor = '#adadad'
-            fillOpacity = 0.4
-        else:
-            fillColor = x['properties']['color'] if 'color' in x['properties'] else '#fff'
-            fillOpacity = 0.7
         weight = 2 # should this be lower or higher for choropleth or not?
-
-    else:
-        fillColor = x['properties']['color'] if 'color' in x['properties'] else '#fff'
         if choropleth:
-            fillOpacity = 0
-        else:
-            fillOpacity = 0.18 if x['properties']['status']==adjacent_label else 0.55
-        weight = 1
-    
-    return {'fillColor': fillColor,
-            'fillOpacity': fillOpacity,
-            'color': color,
-            'weight': weight}
-            
+            return {'fillColor': '#adadad', 'fillOpacity': 0.4, 'color': color, 'weight': weight}, {}
+        return {'fillOpacity': 0.7, 'color': color, 'weight': weight}, {'fillColor': 'color'}
+
+    if choropleth:
+        return {'fillOpacity': 0, 'color': color, 'weight': 1}, {'fillColor': 'color'}
+    return {'color': color, 'weight': 1}, {'fillColor': 'color', 'fillOpacity': 'opacity'}
+
+nonBH_style = ({'fillColor': '#000', 'weight': 0, 'fillOpacity': .5}, {})
 
 #choropleth
 inferno = lambda x: rgb_to_hex(cm.inferno(x))
 
-choropleth_style_function = lambda x: {'fillColor': inferno(x['properties']['Perc_BVAP']),
-                                       'fillOpacity': 0.8,
-                                       'weight': 1,
-                                       'color': inferno(x['properties']['Perc_BVAP'])}
+# colors of the tracts, in a 'fill' column
+choropleth_style = ({'fillOpacity': 0.8, 'weight': 1}, {'fillColor': 'fill', 'color': 'fill'})
 
 
 ###################
@@ -168,36 +146,62 @@ if make_BVAP_choropleth:
     choro_path = "Maps/Relevant census tracts/BH_Tracts.json"
     choro_json = gpd.read_file(choro_path)
     choro_json['Perc_BVAP'] = choro_json['Perc_BVAP'].round(3)
+    choro_json['fill'] = styles.colormap(choro_json['Perc_BVAP'], cm.inferno)
 
+# every layer drawn on the map
+layers = {mapname: maps[mapname]['df'] for mapname in maps}
+layers['nonBH'] = nonBH
+if make_BVAP_choropleth:
+    layers['tracts'] = choro_json[['Perc_BVAP', 'fill', 'geometry']]
+
+if layer_format == 'topojson':
+    topology = shared_topology.TopologyData(
+        shared_topology.build_topology(layers, topojson_tolerance, topojson_quantization))
+    topology.add_to(m)
+
+def add_layer(object_name, style, highlight=None, **kwargs):
+    if layer_format == 'topojson':
+        shared_topology.TopoJsonLayer(topology, object_name, style, highlight, **kwargs).add_to(m)
+    elif layer_format == 'tiles':
+        vector_tiles.write_directory(vector_tiles.build_tiles({object_name: layers[object_name]}, *tile_zooms),
+                                     os.path.join('Maps/Interactive', tile_dir, object_name))
+        vector_tiles.VectorTileLayer(f'{tile_dir}/{object_name}/{{z}}/{{x}}/{{y}}.pbf', object_name,
+                                     style, highlight, max_native_zoom=tile_zooms[1], **kwargs).add_to(m)
+    else:
+        folium.features.GeoJson(layers[object_name], style=styles.feature_rule(style),
+                                on_each_feature=None if highlight is None else styles.highlighter(style, highlight),
+                                **kwargs).add_to(m)
+
+if make_BVAP_choropleth:
     tooltip = folium.features.GeoJsonTooltip(['Perc_BVAP'], aliases=['Proportion BVAP'])
 
     # prop BVAP choropleth
-    folium.features.GeoJson(choro_json,
-                            name='Prop BVAP',
-                            control=False,
-                            style_function=choropleth_style_function,
-                            tooltip=tooltip,
-                            overlay=True).add_to(m)
+    add_layer('tracts',
+              name='Prop BVAP',
+              control=False,
+              style=choropleth_style,
+              tooltip=tooltip,
+              overlay=True)
 
 # non-relevant VA districts
-folium.features.GeoJson(nonBH,
-                        show=True,
-                        control=False,
-                        style_function=lambda x: {'fillColor': '#000', 'weight': 0, 'fillOpacity': .5},
-                        name='nonBH districts',
-                        tooltip='Non-affected districts').add_to(m)
+add_layer('nonBH',
+          show=True,
+          control=False,
+          style=nonBH_style,
+          name='nonBH districts',
+          tooltip='Non-affected districts')
 
 # Set up maps with outline
 for mapname in maps:
     tooltip = folium.features.GeoJsonTooltip(['Empty', 'status', common_colname],
                                              aliases=[maps[mapname]['name'], 'Status', 'District'])
-    folium.features.GeoJson(maps[mapname]['df'],
-                            name=maps[mapname]['name'],
-                            style_function=lambda x: style_func(x, choropleth=make_BVAP_choropleth),
-                            highlight_function=lambda x: style_func(x, choropleth=make_BVAP_choropleth, highlight=True),
-                            show=maps[mapname]['show'],
-                            tooltip=tooltip,
-                            overlay=False).add_to(m)
+    add_layer(mapname,
+              name=maps[mapname]['name'],
+              style=plan_style(choropleth=make_BVAP_choropleth),
+              highlight=plan_style(choropleth=make_BVAP_choropleth, highlight=True),
+              show=maps[mapname]['show'],
+              tooltip=tooltip,
+              overlay=False)
 
 # Add open street map as a raaster layer
 folium.raster_layers.TileLayer(control=False, min_zoom=8, overlay=True, show=True).add_to(m)
@@ -337,6 +341,11 @@ m.get_root().header.add_child(folium.Element(
     ' initial-scale=1.0, maximum-scale=1.0, user-scalable=no" />'
 ))
 
+# with tiles, the page is served locally: serve Leaflet, folium's scripts
+# and Leaflet.VectorGrid from tile_dir too, so it works offline
+if layer_format == 'tiles':
+    vector_tiles.vendor_assets(m, os.path.join('Maps/Interactive', tile_dir, 'lib'), f'{tile_dir}/lib')
+
 filename = "Maps/Interactive/map_comparison.html"
 m.save(filename)
 
@@ -0,0 +1,134 @@
+"""
+shared_topology: TopoJSON output for the interactive comparison map.
+
+The plans in the map are all drawn on the same census geography, so most
+district borders are shared: between neighbouring districts of one plan, and
+between plans. build_topology puts every plan into a single TopoJSON
+topology, in which each border is one arc stored once. Arcs are simplified
+after the topology is built, so both sides of a border are simplified
+together and neighbouring districts cannot drift apart, and coordinates are
+quantized to an integer grid and delta-encoded.
+
+The page embeds the topology once (TopologyData), and each TopoJsonLayer
+decodes its own object from it in the browser with topojson-client and
+styles it with a single rule over the feature properties (see styles).
+
+"""
+
+import folium
+import topojson as tp
+from branca.element import MacroElement
+from jinja2 import Template
+from jinja2.utils import htmlsafe_json_dumps
+
+import styles
+
+
+def build_topology(layers, tolerance=0.0001, quantization=1e5):
+    """
+    Return one TopoJSON topology, as a dict, holding every layer as an object.
+
+    Keyword arguments:
+        layers -- dict of object name: GeoDataFrame, all in the same CRS
+        tolerance -- Douglas-Peucker tolerance for simplifying the arcs, in
+            the units of the layers' CRS; False for no simplification
+        quantization -- number of grid steps across the extent of all layers
+    """
+
+    topology = tp.Topology(list(layers.values()), object_name=list(layers),
+                           prequantize=quantization, toposimplify=tolerance,
+                           topology=True)
+    return topology.to_dict()
+
+
+class TopologyData(MacroElement):
+    """
+    A TopoJSON topology embedded once in the page, for TopoJsonLayers to
+    draw from. Add it to the map before the layers that use it.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = {{ this.json }};
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, data):
+        super().__init__()
+        self._name = 'TopologyData'
+        self.data = data
+
+    def render(self, **kwargs):
+        self.json = htmlsafe_json_dumps(self.data, separators=(',', ':'))
+        super().render(**kwargs)
+
+
+class TopoJsonLayer(folium.TopoJson):
+    """
+    A layer drawing one object of a TopologyData.
+
+    Keyword arguments:
+        topology -- TopologyData holding the object
+        object_name -- name of the object in the topology
+        style -- (constants, columns) style of the features (see styles)
+        highlight -- style of a feature on mouseover; None for no highlight
+        kwargs -- passed to folium.TopoJson (name, tooltip, show, overlay,
+            control, smooth_factor)
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_style = {{ this.style_rule }};
+            {%- if this.highlight_rule %}
+            var {{ this.get_name() }}_highlight = {{ this.highlight_rule }};
+            {%- endif %}
+            var {{ this.get_name() }} = L.geoJson(
+                topojson.feature(
+                    {{ this.topology.get_name() }},
+                    {{ this.topology.get_name() }}{{ this._safe_object_path }}
+                ),
+                {
+                    style: function(feature) {
+                        return {{ this.get_name() }}_style(feature.properties);
+                    },
+                {%- if this.highlight_rule %}
+                    onEachFeature: function(feature, layer) {
+                        layer.on({
+                            mouseover: function(e) {
+                                e.target.setStyle({{ this.get_name() }}_highlight(feature.properties));
+                            },
+                            mouseout: function(e) {
+                                {{ this.get_name() }}.resetStyle(e.target);
+                            }
+                        });
+                    },
+                {%- endif %}
+                {%- if this.smooth_factor is not none %}
+                    smoothFactor: {{ this.smooth_factor|tojson }},
+                {%- endif %}
+                }
+            );
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, topology, object_name, style, highlight=None, **kwargs):
+        super().__init__(topology.data, 'objects.' + object_name, **kwargs)
+        self._name = 'TopoJsonLayer'
+        self.topology = topology
+        self.style_rule = styles.rule(style)
+        self.highlight_rule = None if highlight is None else styles.rule(highlight)
+
+    def style_data(self):
+        """
+        Do nothing, in place of folium's TopoJson.style_data, which render
+        calls to write a style dict into the properties of every feature.
+        Here styles are computed in the browser from the feature properties
+        by style_rule, and topology.data is shared by every layer, so those
+        dicts would only add to the single copy of the topology in the page.
+        """
+
+        return
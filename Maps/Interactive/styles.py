@@ -0,0 +1,67 @@
+"""
+styles: Columnar styling of the interactive map layers.
+
+A layer's style is a pair (constants, columns). constants is the part of the
+Leaflet path style shared by every feature, and columns maps the remaining
+style keys to the feature properties that hold them, e.g.
+
+    ({'color': '#888', 'weight': 1}, {'fillColor': 'color', 'fillOpacity': 'opacity'})
+
+The properties are ordinary data frame columns computed for all features at
+once (colormap does the color lookup for a whole column), so no Python runs
+per feature, and the page gets one short style rule per layer instead of a
+style object per feature.
+
+"""
+
+import json
+import numpy as np
+from folium.utilities import JsCode
+
+# two-digit hex codes of 0-255
+_HEX = np.array([f'{i:02X}' for i in range(256)])
+
+
+def to_hex(rgba):
+    """
+    Return '#RRGGBB' strings for an (n, 3) or (n, 4) array of RGB(A) values
+    in [0, 1], truncating as rgb_to_hex in make_html_map does.
+    """
+
+    rgb = np.clip((np.asarray(rgba, dtype=float)[:, :3] * 255).astype(int), 0, 255)
+    return np.char.add(np.char.add(np.char.add('#', _HEX[rgb[:, 0]]), _HEX[rgb[:, 1]]), _HEX[rgb[:, 2]])
+
+
+def colormap(values, cmap):
+    """Return hex colors of values in [0, 1] under a matplotlib colormap"""
+
+    return to_hex(cmap(np.asarray(values, dtype=float)))
+
+
+def rule(style):
+    """Return a JavaScript function mapping a feature's properties to its style"""
+
+    constants, columns = style
+    fields = ', '.join(f'{json.dumps(key)}: properties[{json.dumps(column)}]'
+                       for key, column in columns.items())
+    return f'function(properties) {{ return Object.assign({json.dumps(constants)}, {{{fields}}}); }}'
+
+
+def feature_rule(style):
+    """rule(style) as a Leaflet GeoJSON style option, taking the whole feature"""
+
+    return JsCode(f'function(feature) {{ return ({rule(style)})(feature.properties); }}')
+
+
+def highlighter(style, highlight):
+    """
+    Return a Leaflet GeoJSON onEachFeature option that switches features to
+    the highlight style on mouseover and back to style on mouseout.
+    """
+
+    return JsCode(f'''function(feature, layer) {{
+        layer.on({{
+            mouseover: function(e) {{ e.target.setStyle(({rule(highlight)})(feature.properties)); }},
+            mouseout: function(e) {{ e.target.setStyle(({rule(style)})(feature.properties)); }}
+        }});
+    }}''')
@@ -0,0 +1,304 @@
+"""
+vector_tiles: Mapbox Vector Tile pyramids for the interactive map layers.
+
+build_tiles cuts GeoDataFrames into z8-z14 vector tiles in the Web Mercator
+tile scheme. At each zoom the polygons are first simplified to about half a
+screen pixel, as one coverage so that neighbouring districts stay gap-free,
+and each tile then holds only the clipped parts of the features that
+intersect it. write_directory writes the pyramid as {z}/{x}/{y}.pbf files for
+a static file server, and write_mbtiles writes it to an MBTiles file.
+
+VectorTileLayer draws a pyramid on a folium map with Leaflet.VectorGrid,
+which requests only the tiles in view, and styles it with a single rule over
+the feature properties (see styles). vendor_assets saves the scripts and
+stylesheets the page would load from CDNs (Leaflet, folium's, and a pinned
+Leaflet.VectorGrid) next to the tiles, so that the page works offline from a
+static file server.
+
+"""
+
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import urllib.request
+import numpy as np
+import shapely
+import mapbox_vector_tile
+import folium
+from folium.plugins import VectorGridProtobuf
+from jinja2 import Template
+
+import styles
+
+# half the width of the Web Mercator world, in metres
+_HALF_WORLD = 20037508.342789244
+
+# tile size in screen pixels, for converting the simplification tolerance
+_TILE_PIXELS = 256
+
+# pinned in place of folium's leaflet.vectorgrid@latest
+vectorgrid_js = ('vectorGrid', 'https://unpkg.com/leaflet.vectorgrid@1.3.0/dist/Leaflet.VectorGrid.bundled.js')
+
+
+def tile_bounds(z, x, y):
+    """Return the Web Mercator bounds (xmin, ymin, xmax, ymax) of tile z/x/y"""
+
+    size = 2 * _HALF_WORLD / 2 ** z
+    return (-_HALF_WORLD + x * size, _HALF_WORLD - (y + 1) * size,
+            -_HALF_WORLD + (x + 1) * size, _HALF_WORLD - y * size)
+
+
+def tile_range(bounds, z):
+    """Return the ranges of tile columns and rows at zoom z covering Web Mercator bounds"""
+
+    size = 2 * _HALF_WORLD / 2 ** z
+    xmin, ymin, xmax, ymax = bounds
+    last = 2 ** z - 1
+    x0, x1 = [min(max(int((v + _HALF_WORLD) // size), 0), last) for v in (xmin, xmax)]
+    y0, y1 = [min(max(int((_HALF_WORLD - v) // size), 0), last) for v in (ymax, ymin)]
+    return range(x0, x1 + 1), range(y0, y1 + 1)
+
+
+def _records(df):
+    """The non-geometry columns of df as one dict per row, even if there are none"""
+
+    records = df.drop(columns=df.geometry.name).to_dict('records')
+    return records if records else [{} for _ in range(len(df))]
+
+
+def build_tiles(layers, minzoom=8, maxzoom=14, extent=4096, buffer=64, simplify=0.5):
+    """
+    Generate (z, x, y, tile) for every non-empty tile of the pyramid, where
+    tile is the encoded vector tile as bytes.
+
+    Keyword arguments:
+        layers -- dict of layer name: GeoDataFrame of polygons; each becomes
+            a layer of the tiles, with the non-geometry columns as
+            properties and a feature_id property giving the row position
+        minzoom, maxzoom -- zoom levels of the pyramid
+        extent -- tile coordinate resolution
+        buffer -- margin, in tile coordinates, kept around each tile so that
+            outlines are not cut at tile edges
+        simplify -- simplification tolerance, in screen pixels
+    """
+
+    projected = {}
+    for name, df in layers.items():
+        df = df.to_crs(epsg=3857)
+        properties = _records(df)
+        for i, p in enumerate(properties):
+            p['feature_id'] = i
+        projected[name] = (np.asarray(df.geometry), properties)
+    bounds = np.array([shapely.total_bounds(geoms) for geoms, _ in projected.values()])
+    bounds = (*bounds[:, :2].min(axis=0), *bounds[:, 2:].max(axis=0))
+
+    for z in range(minzoom, maxzoom + 1):
+        size = 2 * _HALF_WORLD / 2 ** z
+        pad = size * buffer / extent
+        simplified = {}
+        for name, (geoms, properties) in projected.items():
+            geoms = shapely.coverage_simplify(geoms, simplify * size / _TILE_PIXELS)
+            simplified[name] = (geoms, shapely.STRtree(geoms), properties)
+
+        xs, ys = tile_range(bounds, z)
+        for x in xs:
+            for y in ys:
+                xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+                clip = (xmin - pad, ymin - pad, xmax + pad, ymax + pad)
+                tile_layers = []
+                for name, (geoms, tree, properties) in simplified.items():
+                    hits = tree.query(shapely.box(*clip), predicate='intersects')
+                    if not len(hits):
+                        continue
+                    clipped = shapely.clip_by_rect(geoms[hits], *clip)
+                    keep = ~shapely.is_empty(clipped)
+                    tile_layers.append({'name': name,
+                                        'features': [{'geometry': g, 'properties': properties[i]}
+                                                     for g, i in zip(clipped[keep], hits[keep])]})
+                if tile_layers:
+                    yield z, x, y, mapbox_vector_tile.encode(
+                        tile_layers, default_options={'quantize_bounds': (xmin, ymin, xmax, ymax),
+                                                      'extents': extent})
+
+
+def write_directory(tiles, path):
+    """
+    Write tiles from build_tiles to path/{z}/{x}/{y}.pbf, replacing any
+    pyramid already there; return the number written.
+    """
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    n = 0
+    for z, x, y, tile in tiles:
+        os.makedirs(os.path.join(path, str(z), str(x)), exist_ok=True)
+        with open(os.path.join(path, str(z), str(x), f'{y}.pbf'), 'wb') as f:
+            f.write(tile)
+        n += 1
+    return n
+
+
+def write_mbtiles(tiles, path, name, layers=(), minzoom=8, maxzoom=14):
+    """
+    Write tiles from build_tiles to an MBTiles file at path, replacing it;
+    return the number written.
+
+    Keyword arguments:
+        tiles -- iterable of (z, x, y, tile)
+        path -- MBTiles file to write
+        name -- tileset name for the metadata
+        layers -- names of the layers in the tiles, for the metadata
+        minzoom, maxzoom -- zoom levels of the pyramid
+    """
+
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    with db:
+        db.execute('CREATE TABLE metadata (name text, value text)')
+        db.execute('CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)')
+        db.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+        metadata = {'name': name, 'format': 'pbf', 'type': 'overlay',
+                    'minzoom': str(minzoom), 'maxzoom': str(maxzoom),
+                    'json': json.dumps({'vector_layers': [{'id': layer, 'fields': {}} for layer in layers]})}
+        db.executemany('INSERT INTO metadata VALUES (?, ?)', metadata.items())
+        n = 0
+        for z, x, y, tile in tiles:
+            # MBTiles rows count from the south, and pbf tiles are gzipped
+            db.execute('INSERT INTO tiles VALUES (?, ?, ?, ?)',
+                       (z, x, 2 ** z - 1 - y, gzip.compress(tile)))
+            n += 1
+    db.close()
+    return n
+
+
+class VectorTileLayer(VectorGridProtobuf):
+    """
+    A Leaflet.VectorGrid layer of one layer of a tile pyramid.
+
+    Keyword arguments:
+        url -- tile URL template, e.g. 'tiles/reform/{z}/{x}/{y}.pbf'
+        layer -- name of the layer in the tiles
+        style -- (constants, columns) style of the features (see styles)
+        highlight -- style of a feature on mouseover; None for no highlight
+        tooltip -- text, or a folium.GeoJsonTooltip whose fields and aliases
+            are shown on mouseover
+        max_native_zoom -- highest zoom of the pyramid; tiles are scaled
+            up beyond it
+        kwargs -- passed to VectorGridProtobuf (name, show, overlay, control)
+    """
+
+    default_js = [vectorgrid_js]
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) -%}
+            var {{ this.get_name() }}_style = {{ this.style_rule }};
+            var {{ this.get_name() }} = L.vectorGrid.protobuf(
+                {{ this.url|tojson }},
+                {
+                    rendererFactory: L.canvas.tile,
+                    interactive: true,
+                    maxNativeZoom: {{ this.max_native_zoom }},
+                    getFeatureId: function(f) { return f.properties.feature_id; },
+                    vectorTileLayerStyles: {
+                        {{ this.layer|tojson }}: function(properties) {
+                            return Object.assign({fill: true}, {{ this.get_name() }}_style(properties));
+                        }
+                    }
+                }
+            );
+            {%- if this.highlight_rule %}
+            var {{ this.get_name() }}_highlight = {{ this.highlight_rule }};
+            {{ this.get_name() }}.on('mouseover', function(e) {
+                {{ this.get_name() }}.setFeatureStyle(e.layer.properties.feature_id,
+                    Object.assign({fill: true}, {{ this.get_name() }}_highlight(e.layer.properties)));
+            });
+            {{ this.get_name() }}.on('mouseout', function(e) {
+                {{ this.get_name() }}.resetFeatureStyle(e.layer.properties.feature_id);
+            });
+            {%- endif %}
+            {%- if this.tooltip_fields is not none or this.tooltip_text is not none %}
+            var {{ this.get_name() }}_tooltip = L.tooltip();
+            {{ this.get_name() }}.on('mouseover', function(e) {
+            {%- if this.tooltip_fields is not none %}
+                var fields = {{ this.tooltip_fields|tojson }};
+                var aliases = {{ this.tooltip_aliases|tojson }};
+                var content = '<table>' + fields.map(function(field, i) {
+                    return '<tr><th>' + aliases[i] + '</th><td>' + e.layer.properties[field] + '</td></tr>';
+                }).join('') + '</table>';
+            {%- else %}
+                var content = {{ this.tooltip_text|tojson }};
+            {%- endif %}
+                {{ this.get_name() }}_tooltip.setLatLng(e.latlng).setContent(content)
+                    .openOn({{ this._parent.get_name() }});
+            });
+            {{ this.get_name() }}.on('mouseout', function(e) {
+                {{ this._parent.get_name() }}.closeTooltip({{ this.get_name() }}_tooltip);
+            });
+            {%- endif %}
+        {%- endmacro %}
+        """
+    )
+
+    def __init__(self, url, layer, style, highlight=None, tooltip=None, max_native_zoom=14, **kwargs):
+        super().__init__(url, **kwargs)
+        self._name = 'VectorTileLayer'
+        self.layer = layer
+        self.style_rule = styles.rule(style)
+        self.highlight_rule = None if highlight is None else styles.rule(highlight)
+        self.max_native_zoom = max_native_zoom
+        self.tooltip_fields = self.tooltip_aliases = self.tooltip_text = None
+        if isinstance(tooltip, folium.GeoJsonTooltip):
+            self.tooltip_fields = tooltip.fields
+            self.tooltip_aliases = tooltip.aliases or tooltip.fields
+        elif tooltip is not None:
+            self.tooltip_text = str(tooltip)
+
+
+def _elements(element):
+    yield element
+    for child in list(element._children.values()):
+        yield from _elements(child)
+
+
+def vendor_assets(m, out_dir, url_prefix):
+    """
+    Save the scripts and stylesheets that the page of folium map m loads
+    from CDNs to out_dir, and point the page at the saved copies, so that it
+    works without a network connection. Files already in out_dir are not
+    fetched again, so the page keeps the versions first saved.
+
+    Keyword arguments:
+        m -- folium Map, with every layer added
+        out_dir -- directory to save the files to
+        url_prefix -- URL of out_dir relative to the page, e.g. 'tiles/lib'
+
+    Only the files the elements name are saved, not the fonts and images
+    that stylesheets refer to, which the map does not use. Raster tile
+    layers (the OpenStreetMap basemap) still need the network.
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    def local(links, ext):
+        out = []
+        for name, url in links:
+            if url.startswith(('http://', 'https://')):
+                filename = name + ext
+                path = os.path.join(out_dir, filename)
+                if not os.path.exists(path):
+                    tmp_path = path + f'.{os.getpid()}.tmp'
+                    urllib.request.urlretrieve(url, tmp_path)
+                    os.replace(tmp_path, path)
+                url = f'{url_prefix}/{filename}'
+            out.append((name, url))
+        return out
+
+    for element in _elements(m.get_root()):
+        if getattr(element, 'default_js', None):
+            element.default_js = local(element.default_js, '.js')
+        if getattr(element, 'default_css', None):
+            element.default_css = local(element.default_css, '.css')